@@ -0,0 +1,80 @@
+import json
+import os
+import time
+
+from constants import CHECKPOINT_INTERVAL
+
+
+class Checkpoint:
+    """Журнал выполненной части копирования или распаковки.
+
+    Записи (готовый файл или смещение в недописанном файле) копятся в памяти
+    и раз в CHECKPOINT_INTERVAL секунд дописываются в файл JSON-строками.
+    Быстрые операции так и не создают файл, а после сбоя при возобновлении
+    теряется не больше одного интервала работы.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = set()
+        self.partial = {}
+        self._pending = []
+        self._last_flush = time.monotonic()
+        if resume:
+            self._load()
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Последняя строка могла оборваться при сбое
+                    break
+                if record[0] == 'done':
+                    self.done.add(record[1])
+                    self.partial.pop(record[1], None)
+                elif record[0] == 'partial':
+                    self.partial[record[1]] = record[2]
+
+    def is_done(self, name):
+        return name in self.done
+
+    def offset(self, name):
+        return self.partial.get(name, 0)
+
+    def mark_done(self, name):
+        self.done.add(name)
+        self.partial.pop(name, None)
+        self._pending.append(['done', name])
+        self._maybe_flush()
+
+    def mark_partial(self, name, offset):
+        self.partial[name] = offset
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= CHECKPOINT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        # Смещения недописанных файлов сохраняются только в момент сброса
+        records = self._pending + [['partial', name, offset] for name, offset in self.partial.items()]
+        self._pending = []
+        self._last_flush = time.monotonic()
+        if not records:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self, remove=False):
+        """Завершает журнал: после успеха удаляет файл, после ошибки сохраняет"""
+        if remove:
+            self._pending = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        else:
+            self.flush()
@@ -0,0 +1,43 @@
+import json
+import os
+import socket
+import sys
+
+from constants import SERVER_SOCKET
+
+
+def run(commands, cwd=None, path=SERVER_SOCKET):
+    """Выполняет команды на сервере по одному соединению, ответы отдаются по мере получения"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        with sock.makefile('rb') as reader:
+            for command in commands:
+                request = {'command': command, 'cwd': cwd or os.getcwd()}
+                sock.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+                line = reader.readline()
+                if not line:
+                    return
+                yield json.loads(line)
+
+
+def main(argv=None):
+    """client.py [--socket путь] [команда] - без команды читает команды из stdin"""
+    argv = sys.argv[1:] if argv is None else argv
+    path = SERVER_SOCKET
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        path, argv = argv[1], argv[2:]
+    commands = [' '.join(argv)] if argv else (line.strip() for line in sys.stdin if line.strip())
+    status = 0
+    try:
+        for response in run(commands, path=path):
+            if response['output']:
+                print(response['output'])
+            status = response['status']
+    except OSError as e:
+        print(f"Ошибка: Нет соединения с сервером {path}: {e}", file=sys.stderr)
+        return 2
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import bisect
+import os
+import time
+from collections import OrderedDict
+
+try:
+    import readline
+except ImportError:
+    readline = None  # type: ignore[assignment]
+
+from constants import COMMANDS, COMPLETION_REFRESH, COMPLETION_CACHE_DIRS
+
+
+class DirectoryCache:
+    """Кэш отсортированных имен в каталогах для автодополнения.
+
+    Поиск по префиксу - двоичный поиск в отсортированном списке, поэтому
+    дополнение в каталоге со 100 тысячами файлов не перечитывает его на каждое
+    нажатие Tab. Каталог перечитывается, только если изменился его mtime, а
+    mtime проверяется не чаще раза в COMPLETION_REFRESH секунд.
+    """
+
+    def __init__(self, refresh=COMPLETION_REFRESH, max_dirs=COMPLETION_CACHE_DIRS):
+        self.refresh = refresh
+        self.max_dirs = max_dirs
+        self.hits = 0
+        self._dirs = OrderedDict()
+
+    def entries(self, directory):
+        now = time.monotonic()
+        cached = self._dirs.get(directory)
+        if cached is not None:
+            self._dirs.move_to_end(directory)
+            mtime, names, checked = cached
+            if now - checked < self.refresh:
+                self.hits += 1
+                return names
+            if os.stat(directory).st_mtime_ns == mtime:
+                self.hits += 1
+                self._dirs[directory] = (mtime, names, now)
+                return names
+
+        mtime = os.stat(directory).st_mtime_ns
+        with os.scandir(directory) as it:
+            # Каталоги помечаются '/', чтобы дополнение сразу продолжалось внутрь
+            names = sorted(entry.name + '/' if entry.is_dir() else entry.name for entry in it)
+        self._dirs[directory] = (mtime, names, now)
+        while len(self._dirs) > self.max_dirs:
+            self._dirs.popitem(last=False)
+        return names
+
+    def complete(self, directory, prefix):
+        """Имена в каталоге, начинающиеся с prefix"""
+        try:
+            names = self.entries(directory)
+        except OSError:
+            return []
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + '\U0010ffff')
+        matches = names[start:end]
+        if not prefix.startswith('.'):
+            matches = [name for name in matches if not name.startswith('.')]
+        return matches
+
+
+class Completer:
+    """Дополнение имен команд и путей относительно текущего каталога оболочки"""
+
+    def __init__(self, shell, cache=None):
+        self.shell = shell
+        self.cache = cache if cache is not None else DirectoryCache()
+        self._matches = []
+
+    def candidates(self, line, text):
+        if not line[:len(line) - len(text)].strip():
+            return [command + ' ' for command in COMMANDS if command.startswith(text)]
+
+        head, prefix = os.path.split(text)
+        if head.startswith('~'):
+            directory = os.path.expanduser(head)
+        else:
+            directory = self.shell.resolve_path(head or '.')
+        return [os.path.join(head, name) for name in self.cache.complete(directory, prefix)]
+
+    def complete(self, text, state):
+        """Функция дополнения в формате readline"""
+        if state == 0:
+            self._matches = self.candidates(readline.get_line_buffer()[:readline.get_endidx()], text)
+        return self._matches[state] if state < len(self._matches) else None
+
+
+def install(shell):
+    """Подключает автодополнение по Tab, если доступен модуль readline"""
+    if readline is None:
+        return None
+    completer = Completer(shell)
+    readline.set_completer(completer.complete)
+    # Разделители только пробельные, чтобы путь дополнялся целиком
+    readline.set_completer_delims(' \t\n')
+    if 'libedit' in (readline.__doc__ or ''):
+        readline.parse_and_bind('bind ^I rl_complete')
+    else:
+        readline.parse_and_bind('tab: complete')
+    return completer
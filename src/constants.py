@@ -1 +1,157 @@
+import os
 
+# Количество строк статистики cProfile в режиме --profile
+PROFILE_TOP = 15
+
+# Поддерживаемые форматы shell.log
+LOG_FORMATS = ('text', 'json')
+
+# Размер блока при копировании и распаковке файлов
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Число потоков параллельного копирования при перемещении между файловыми системами
+COPY_WORKERS = min(8, os.cpu_count() or 4)
+
+# Как часто (в секундах) выводится прогресс длинных операций
+PROGRESS_INTERVAL = 0.5
+
+# Как часто (в секундах) контрольная точка cp/untar сбрасывается на диск
+CHECKPOINT_INTERVAL = 2.0
+
+# Хэширование файлов: размер блока, число потоков и размер постоянного кэша
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+HASH_WORKERS = os.cpu_count() or 4
+HASH_CACHE_LIMIT = 1_000_000
+
+# Алгоритм команды hash по умолчанию (совместим с sha256sum)
+CHECKSUM_ALGORITHM = 'sha256'
+
+# Фоновое удаление: число потоков, сколько поддеревьев набрать для
+# параллельного удаления и на сколько уровней раскрывать дерево ради этого
+PURGE_WORKERS = min(8, os.cpu_count() or 4)
+PURGE_FANOUT = 64
+PURGE_MAX_DEPTH = 3
+
+# Сколько скомпилированных шаблонов grep держать в кэше
+REGEX_CACHE_SIZE = 256
+
+# Многострочный grep -U: размер блока чтения и перекрытие соседних блоков
+# (совпадение длиннее перекрытия на границе блоков может быть найдено не целиком)
+MULTILINE_CHUNK_SIZE = 1024 * 1024
+MULTILINE_OVERLAP = 64 * 1024
+
+# Определение кодировки: сколько байт читать с начала файла и какую
+# однобайтовую кодировку считать, если файл не в UTF-8
+SNIFF_SIZE = 8192
+FALLBACK_ENCODING = 'cp1251'
+
+# Команды, которые понимает оболочка (для автодополнения)
+COMMANDS = ('ls', 'cd', 'cat', 'cp', 'mv', 'rm', 'history', 'undo',
+            'zip', 'unzip', 'tar', 'untar', 'grep', 'hash', 'verify', 'diff',
+            'tail', 'watch', 'stats', 'snapshot', 'restore',
+            'jobs', 'fg', 'kill', 'time', 'help', 'exit')
+
+# Автодополнение: как часто (в секундах) проверять изменение каталога
+# и сколько каталогов держать в кэше
+COMPLETION_REFRESH = 1.0
+COMPLETION_CACHE_DIRS = 64
+
+# Файлы, внутрь которых можно перейти как в каталог (cd archive.zip)
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# Unix-сокет сервера оболочки (--serve) и клиента по умолчанию
+SERVER_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+                             f"minishell-{os.getuid() if hasattr(os, 'getuid') else 0}.sock")
+
+# tail: число строк по умолчанию и размер блока чтения с конца файла;
+# tail -f и watch: как часто ожидание событий проверяет отмену команды
+# (без inotify это и период опроса каталога)
+TAIL_LINES = 10
+TAIL_BLOCK_SIZE = 64 * 1024
+WATCH_TIMEOUT = 0.5
+
+# stats: сколько строк выводить, сколько разных команд и самых долгих
+# выполнений хранить в сводке и каким блоком дочитывать shell.log
+STATS_TOP = 10
+STATS_MAX_COMMANDS = 1000
+STATS_KEEP_SLOWEST = 100
+STATS_CHUNK_SIZE = 1024 * 1024
+
+# Ограничение ввода-вывода (--bwlimit, --iops): самое долгое непрерывное
+# ожидание в планировщике, после которого проверяется отмена команды
+THROTTLE_SLICE = 0.1
+
+# Имя снимка каталога: время создания, по которому снимки упорядочиваются
+SNAPSHOT_NAME_FORMAT = '%Y%m%d-%H%M%S-%f'
+
+# Распаковка ZIP: предельные общий объем, число элементов и степень сжатия
+# элемента (проверяется для элементов больше UNZIP_RATIO_MIN_SIZE)
+UNZIP_MAX_SIZE = 8 * 1024 ** 3
+UNZIP_MAX_MEMBERS = 100_000
+UNZIP_MAX_RATIO = 100
+UNZIP_RATIO_MIN_SIZE = 1024 * 1024
+
+# ioctl клонирования файла (reflink) в Linux
+FICLONE = 0x40049409
+
+
+HELP_TEXT = """
+Доступные команды:
+  ls [-l] [-S|-t] [-r] [путь]
+                         - список файлов (-S по размеру, -t по времени, -r обратно)
+  cd [путь]              - смена каталога (.., ~)
+  cat <файл>             - вывод файла
+  cp [-r] [--resume] [--dedupe] [--verify] <src> <dst>
+                         - копирование (--resume продолжает прерванное,
+                           --dedupe клонирует одинаковые файлы (reflink),
+                           --verify сверяет хэши копии и источника)
+  mv <src> <dst>         - перемещение/переименование (между ФС - с fsync, проверкой и журналом)
+  rm [-r] [-f] <путь>    - удаление (-r переносит каталог в корзину, -f без подтверждения)
+  rm -rf --purge <путь>  - удалить каталог окончательно в фоне
+  rm --purge             - очистить корзину в фоне
+
+Плагины:
+  zip <папка> <архив.zip>   - создать ZIP архив
+  unzip <архив.zip>         - распаковать ZIP (с ограничениями объема, числа элементов и сжатия)
+  tar <папка> <архив.tar.gz> - создать TAR.GZ архив
+  untar [--resume] [--verify] <архив.tar.gz> - распаковать TAR.GZ (--verify сверяет с архивом)
+  grep [-r] [-i] <шаблон> <путь> - поиск в файлах
+       -c    - число совпадений в каждом файле
+       -l    - только имена файлов с совпадениями
+       -q    - без вывода, остановка на первом совпадении
+       -m N  - не больше N совпадений в файле
+       -A N, -B N, -C N - N строк контекста после, до, вокруг совпадения
+       -U    - многострочный поиск (шаблон может содержать \\n)
+
+Утилиты:
+  hash [-a алг] [-o манифест] <путь> - контрольные суммы (sha256, md5, ...)
+  verify <манифест>      - проверить файлы по манифесту
+  diff [-r] <путь1> <путь2> - различия файлов или деревьев (+ добавлено, - удалено, M изменено)
+  tail [-n N] [-f] <файл> - последние N строк (-f - дописываемые строки до Ctrl+C)
+  watch <каталог>        - показывать изменения в каталоге до Ctrl+C
+  stats [top|errors|slow] [N] - по shell.log: частые команды, доля ошибок, самые долгие
+  snapshot <каталог>     - снимок каталога (неизменные файлы общие с прошлым снимком)
+  restore <снимок|каталог> - вернуть каталог к снимку (к последнему, если указан каталог)
+  history [N]            - показать последние N команд
+  undo                   - отменить последнюю команду
+  time <команда>         - выполнить команду и вывести время и метрики
+
+Задачи:
+  <команда> &            - запустить команду в фоне
+  jobs                   - список фоновых задач
+  fg %N                  - дождаться фоновой задачи N
+  kill %N                - отменить фоновую задачу N
+  Ctrl+C                 - отменить только выполняемую команду
+  help                   - эта справка
+  exit                   - выход из оболочки
+
+Tab дополняет имена команд и пути.
+В zip и tar архив можно перейти как в каталог: cd archive.zip, затем ls/cat/grep.
+Запуск с --profile включает профилирование (cProfile, tracemalloc) каждой команды,
+--log-format json переключает shell.log на JSON-записи.
+--bwlimit N[K|M|G], --iops N и --nice N (0..19) перед аргументами любой команды
+ограничивают ее ввод-вывод: байт и блоков в секунду и приоритет потоков (как nice/ionice),
+например: cp -r --bwlimit 20M --nice 10 data backup.
+--serve [--socket путь] запускает сервер на Unix-сокете, команды к нему
+отправляет python src/client.py <команда>.
+"""
@@ -0,0 +1,140 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from constants import HASH_CHUNK_SIZE, HASH_WORKERS, HASH_CACHE_LIMIT
+from jobs import check_cancelled
+from throttle import throttle
+
+# Самый быстрый доступный алгоритм для поиска одинаковых файлов
+FAST_ALGORITHM = 'xxh3_128' if xxhash is not None else 'blake2b'
+
+
+def new_hasher(algorithm):
+    if algorithm == 'xxh3_128':
+        if xxhash is None:
+            raise ValueError("Для xxh3_128 нужен пакет xxhash")
+        return xxhash.xxh3_128()
+    return hashlib.new(algorithm)
+
+
+# Алгоритм контрольной суммы в манифесте по длине ее шестнадцатеричной записи
+MANIFEST_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+
+def hash_stream(f, algorithm=FAST_ALGORITHM):
+    """Хэширует двоичный поток большими блоками через один буфер"""
+    hasher = new_hasher(algorithm)
+    buf = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buf)
+    while True:
+        check_cancelled()
+        n = f.readinto(buf)
+        if not n:
+            break
+        throttle(n)
+        hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def hash_file(path, algorithm=FAST_ALGORITHM):
+    """Хэширует файл на диске"""
+    with open(path, 'rb', buffering=0) as f:
+        return hash_stream(f, algorithm)
+
+
+def parse_manifest(lines):
+    """Разбирает манифест в формате sha256sum: '<хэш>  <путь>' или '<хэш> *<путь>'.
+
+    Возвращает список (хэш, путь, алгоритм); алгоритм определяется по длине хэша.
+    """
+    entries = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        digest, _, name = line.partition(' ')
+        if name[:1] in (' ', '*'):
+            name = name[1:]
+        algorithm = MANIFEST_ALGORITHMS.get(len(digest))
+        if not name or algorithm is None:
+            raise ValueError(f"Неверная строка манифеста: {line}")
+        entries.append((digest.lower(), name, algorithm))
+    return entries
+
+
+class HashCache:
+    """Постоянный кэш хэшей по (устройство, inode, размер, mtime).
+
+    Пока файл не менялся, повторные запуски берут хэш из кэша и не читают
+    содержимое. Кэш ограничен HASH_CACHE_LIMIT записями, вытесняются давно
+    не использованные.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _key(st, algorithm):
+        return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{algorithm}"
+
+    def hash(self, path, algorithm=FAST_ALGORITHM):
+        key = self._key(os.stat(path), algorithm)
+        with self._lock:
+            digest = self._entries.pop(key, None)
+            if digest is not None:
+                # Переставляем запись в конец: порядок словаря служит очередью LRU
+                self._entries[key] = digest
+                self.hits += 1
+                return digest
+        digest = hash_file(path, algorithm)
+        with self._lock:
+            self._entries[key] = digest
+            self._dirty = True
+            while len(self._entries) > HASH_CACHE_LIMIT:
+                del self._entries[next(iter(self._entries))]
+        return digest
+
+    def save(self):
+        if not self._dirty:
+            return
+        # Свой временный файл у каждого потока: сессии с общим state_dir не мешают друг другу
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+
+def hash_files(paths, algorithm=FAST_ALGORITHM, cache=None, workers=HASH_WORKERS, hasher=None):
+    """Параллельно хэширует файлы, возвращает словарь путь -> хэш.
+
+    hashlib отпускает GIL на больших блоках, поэтому потоки загружают все ядра.
+    hasher(путь, алгоритм) заменяет чтение с диска, например для виртуальной ФС.
+    """
+    paths = list(paths)
+    if hasher is None:
+        hasher = cache.hash if cache is not None else hash_file
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Каждой задаче своя копия контекста, чтобы в потоках работала отмена команды
+        futures = [pool.submit(contextvars.copy_context().run, hasher, path, algorithm)
+                   for path in paths]
+        return {path: future.result() for path, future in zip(paths, futures)}
@@ -0,0 +1,114 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import itertools
+import threading
+
+
+class CommandCancelled(BaseException):
+    """Команда отменена пользователем (Ctrl+C или kill %N).
+
+    Наследуется от BaseException, как и asyncio.CancelledError, чтобы не
+    перехватываться обработчиками `except Exception` внутри команд.
+    """
+
+
+# Флаг отмены текущей задачи; asyncio.to_thread переносит контекст в рабочий поток
+_cancel_event = contextvars.ContextVar('cancel_event', default=None)
+
+
+def check_cancelled():
+    """Прерывает команду, если ее задача была отменена"""
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise CommandCancelled()
+
+
+class Job:
+    def __init__(self, job_id, command):
+        self.id = job_id
+        self.command = command
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return "Отменяется" if self.cancel_event.is_set() else "Выполняется"
+        if self.cancel_event.is_set():
+            return "Отменено"
+        return "Завершено"
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class JobManager:
+    """Выполняет команды как задачи asyncio в отдельном потоке цикла событий.
+
+    Каждая команда работает в пуле потоков через asyncio.to_thread, поэтому
+    независимые тяжелые команды выполняются одновременно, а отмена задачи
+    проверяется самими командами через check_cancelled().
+    """
+
+    def __init__(self, run):
+        self._run = run
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.jobs = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="jobs", daemon=True)
+        self._thread.start()
+
+    async def _execute(self, job):
+        _cancel_event.set(job.cancel_event)
+        return await asyncio.to_thread(self._run, job.command)
+
+    def submit(self, command, background=False):
+        """Запускает команду; фоновые задачи получают номер для jobs/fg/kill"""
+        with self._lock:
+            job = Job(next(self._ids) if background else 0, command)
+            job.future = asyncio.run_coroutine_threadsafe(self._execute(job), self._loop)
+            if background:
+                self.jobs[job.id] = job
+        return job
+
+    def get(self, spec):
+        """Находит фоновую задачу по номеру вида `%1` или `1`"""
+        try:
+            return self.jobs.get(int(spec.lstrip('%')))
+        except ValueError:
+            return None
+
+    def remove(self, job):
+        with self._lock:
+            self.jobs.pop(job.id, None)
+
+    def reap(self):
+        """Возвращает и убирает из таблицы завершившиеся фоновые задачи"""
+        with self._lock:
+            finished = [job for job in self.jobs.values() if job.done()]
+            for job in finished:
+                del self.jobs[job.id]
+        return finished
+
+    def wait(self, job, poll=0.1):
+        """Ждет задачу с коротким таймаутом, чтобы Ctrl+C доходил до основного потока"""
+        while True:
+            try:
+                return job.result(timeout=poll)
+            except concurrent.futures.TimeoutError:
+                continue
+
+    def close(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
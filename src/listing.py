@@ -0,0 +1,94 @@
+import datetime
+import os
+import stat
+import sys
+from array import array
+
+from jobs import check_cancelled
+from vfs import scan
+
+
+class Listing:
+    """Записи каталога или дерева в колонках вместо списка строк и кортежей.
+
+    Запись i: имя names[i] (интернированная строка, одинаковые имена в разных
+    каталогах - один объект), индекс родителя parents[i], размер, mtime (нс),
+    права и тип. Дети каталога лежат подряд с индекса first[i], их count[i],
+    отсортированы по имени. Запись 0 - сам корень. Пути и строки вывода
+    собираются только для выводимых записей.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.parents = array('q')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.modes = array('L')
+        self.dirs = bytearray()
+        self.first = array('q')
+        self.count = array('q')
+
+    def __len__(self):
+        return len(self.names)
+
+    def _append(self, name, parent, is_dir, st):
+        self.names.append(sys.intern(name))
+        self.parents.append(parent)
+        self.sizes.append(st.st_size)
+        self.mtimes.append(st.st_mtime_ns)
+        self.modes.append(st.st_mode)
+        self.dirs.append(is_dir)
+        self.first.append(0)
+        self.count.append(0)
+
+    @classmethod
+    def build(cls, fs, root, recursive=False):
+        """Колонки записей каталога root (с recursive - всего дерева, за один обход).
+
+        Если root - файл, в листинге только запись 0 с его именем.
+        """
+        listing = cls()
+        root_stat = fs.stat(root)
+        is_dir = stat.S_ISDIR(root_stat.st_mode)
+        listing._append(os.path.basename(root.rstrip('/\\')), -1, is_dir, root_stat)
+        pending = [(0, root)] if is_dir else []
+        while pending:
+            check_cancelled()
+            parent, path = pending.pop()
+            entries = sorted(scan(fs, path))
+            first = len(listing)
+            listing.first[parent] = first
+            listing.count[parent] = len(entries)
+            for name, entry_is_dir, st in entries:
+                listing._append(name, parent, entry_is_dir, st)
+            if recursive:
+                # Подкаталоги кладем в обратном порядке, чтобы обходить их по алфавиту
+                pending.extend((first + k, os.path.join(path, entries[k][0]))
+                               for k in reversed(range(len(entries))) if entries[k][1])
+        return listing
+
+    def children(self, i):
+        return range(self.first[i], self.first[i] + self.count[i])
+
+    def path(self, i):
+        """Путь записи относительно корня"""
+        parts = []
+        while i > 0:
+            parts.append(self.names[i])
+            i = self.parents[i]
+        return os.path.join(*reversed(parts)) if parts else ''
+
+    def order(self, indexes, key=None, reverse=False):
+        """Индексы, отсортированные по колонке 'size' или 'mtime' (иначе по имени)"""
+        column = {'size': self.sizes, 'mtime': self.mtimes}.get(key)
+        if column is None:
+            return sorted(indexes, key=self.names.__getitem__, reverse=reverse)
+        # Большие значения первыми, как в ls -S и ls -t; при равенстве - по имени
+        ranked = sorted(indexes, key=self.names.__getitem__)
+        return sorted(ranked, key=column.__getitem__, reverse=not reverse)
+
+    def long_lines(self, indexes):
+        """Строки ls -l; каждая форматируется только в момент вывода"""
+        for i in indexes:
+            mtime = datetime.datetime.fromtimestamp(self.mtimes[i] / 1e9).strftime("%Y-%m-%d %H:%M")
+            yield f"{oct(self.modes[i])[-3:]} {self.sizes[i]:8d} {mtime} {self.names[i]}"
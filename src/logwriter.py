@@ -0,0 +1,90 @@
+import atexit
+import os
+import queue
+import threading
+
+
+class LogWriter:
+    """Фоновая запись строк лога.
+
+    Команды только кладут готовые строки в очередь, а запись на диск и flush
+    выполняет отдельный поток, поэтому задержка команды не зависит от диска.
+    """
+
+    # Общие писатели по пути файла: сессии с одним логом пишут через один поток
+    _shared: dict[str, "LogWriter"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._users = 0
+        self._queue = queue.Queue()
+        # Файл открывается сразу, чтобы лог существовал с момента старта оболочки
+        self._file = open(path, 'a', encoding='utf-8')
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def open_shared(cls, path):
+        """Писатель для файла лога, общий для всех сессий процесса"""
+        path = os.path.abspath(path)
+        with cls._shared_lock:
+            writer = cls._shared.get(path)
+            if writer is None or writer._closed:
+                writer = cls._shared[path] = cls(path)
+            writer._users += 1
+            return writer
+
+    def release(self):
+        """Отпускает общий писатель; последняя сессия закрывает файл"""
+        with self._shared_lock:
+            self._users -= 1
+            last = self._users <= 0
+            if last and self._shared.get(self.path) is self:
+                del self._shared[self.path]
+        if not last:
+            # Записи сессии должны оказаться в файле к моменту ее закрытия
+            self.flush()
+            return
+        self.close()
+
+    def write(self, text):
+        if not self._closed:
+            self._queue.put(text)
+
+    def flush(self):
+        """Ждет, пока все поставленные в очередь записи попадут в файл"""
+        if not self._closed:
+            self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        # Закрытый писатель не должен удерживаться до выхода из процесса
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Забираем все, что накопилось, и пишем одним flush
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                self._file.write(''.join(text for text in batch if text is not None))
+                self._file.flush()
+            except (OSError, ValueError):
+                pass
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
@@ -1,3 +1,4 @@
+import errno
 import os
 import shutil
 import sys
@@ -5,28 +6,238 @@ import datetime
 import zipfile
 import tarfile
 import re
+import json
+import time
+import io
+import cProfile
+import pstats
+import tracemalloc
+import threading
+import contextvars
+import functools
+import codecs
+import filecmp
+import hashlib
+import stat
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+from constants import (HELP_TEXT, PROFILE_TOP, LOG_FORMATS, COPY_CHUNK_SIZE, FICLONE, SERVER_SOCKET,
+                       COPY_WORKERS, PROGRESS_INTERVAL, REGEX_CACHE_SIZE,
+                       MULTILINE_CHUNK_SIZE, MULTILINE_OVERLAP, ARCHIVE_EXTENSIONS,
+                       CHECKSUM_ALGORITHM, FALLBACK_ENCODING, TAIL_LINES, TAIL_BLOCK_SIZE,
+                       WATCH_TIMEOUT, STATS_TOP, SNAPSHOT_NAME_FORMAT,
+                       UNZIP_MAX_SIZE, UNZIP_MAX_MEMBERS, UNZIP_MAX_RATIO, UNZIP_RATIO_MIN_SIZE)
+from logwriter import LogWriter
+from checkpoint import Checkpoint
+from hashing import HashCache, FAST_ALGORITHM, hash_file, hash_files, hash_stream, parse_manifest
+from purger import Purger
+from sniff import sniff_file, bytes_pattern
+from vfs import LocalFS, ArchiveFS, walk_tree
+from watcher import open_watcher
+from stats import update_stats
+from throttle import IOScheduler, throttle, throttled, parse_size
+from sparse import is_sparse, data_ranges, data_size, sparse_tarinfo, SparseReader
+from listing import Listing
+import completion
+from jobs import JobManager, CommandCancelled, check_cancelled
+
+
+def new_metrics():
+    """Пустой набор метрик одной команды"""
+    return {'files': 0, 'bytes_read': 0, 'bytes_written': 0, 'cache_hits': 0}
+
+
+@functools.lru_cache(maxsize=REGEX_CACHE_SIZE)
+def compile_pattern(pattern, flags=0):
+    """Скомпилированные шаблоны grep общие для всех вызовов"""
+    return re.compile(pattern, flags)
+
+
+class Progress:
+    """Потокобезопасный счетчик байт, периодически выводящий скорость"""
+
+    def __init__(self, total, stream, label):
+        self.total = total
+        self.done = 0
+        self.stream = stream
+        self.label = label
+        self.start = time.perf_counter()
+        self._last_report = self.start
+        self._reported = False
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """Скорость в МБ/с"""
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+
+    def add(self, n):
+        with self._lock:
+            self.done += n
+            now = time.perf_counter()
+            if now - self._last_report < PROGRESS_INTERVAL:
+                return
+            self._last_report = now
+            self._reported = True
+            percent = self.done * 100 // self.total if self.total else 100
+            self.stream.write(f"\r{self.label}: {percent}% {self.rate:.1f} МБ/с")
+            self.stream.flush()
+
+    def copied(self, pos, n):
+        """Обратный вызов копирования: считает записанные байты, а не позицию в файле"""
+        self.add(n)
+
+    def finish(self):
+        if self._reported:
+            self.stream.write("\n")
+            self.stream.flush()
+
 
 class MiniShell:
-    def __init__(self):
-        self.current_dir = os.getcwd()
-        self.history_file = '.history'
-        self.trash_dir = '.trash'
-        self.log_file = 'shell.log'
+    def __init__(self, profile=False, log_format='text', fs=None, state_dir=None, cwd=None,
+                 confirm=None, history_file=None):
+        """Сессия оболочки.
+
+        Все пути сессии абсолютные и не зависят от текущего каталога процесса:
+        state_dir - каталог корзины, лога и кэша хэшей (по умолчанию текущий
+        каталог при создании), cwd - начальный каталог команд, confirm - функция
+        запроса подтверждения (по умолчанию input), history_file - файл в state_dir,
+        где история хранится между запусками (по умолчанию история только у сессии).
+        Поэтому в одном процессе можно одновременно держать много сессий.
+        """
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"Неизвестный формат лога: {log_format}")
+        # Файловая система, с которой работают команды (по умолчанию локальная)
+        self.fs = fs if fs is not None else LocalFS()
+        state_dir = os.path.abspath(state_dir or os.getcwd())
+        if cwd is not None:
+            self.current_dir = os.path.abspath(cwd)
+        else:
+            self.current_dir = os.getcwd() if self.fs.is_local else self.fs.root
+        self.state_dir = state_dir
+        self.history_file = os.path.join(state_dir, history_file) if history_file else None
+        self.trash_dir = os.path.join(state_dir, '.trash')
+        self.log_file = os.path.join(state_dir, 'shell.log')
+        self.hash_cache_file = os.path.join(state_dir, '.hashcache')
+        self.stats_index_file = os.path.join(state_dir, '.logstats')
+        # Реестр журналов незаконченных mv: по нему прерванные перемещения доводятся при запуске
+        self.move_journals_dir = os.path.join(state_dir, '.mvjournals')
+        self.progress_stream = sys.stderr
+        # Поток для команд, выводящих результат по мере работы (tail -f, watch);
+        # None - у сессии нет вывода, который можно прервать, и эти команды недоступны
+        self.output_stream = sys.stdout
+        self.confirm = confirm
+        self.log_format = log_format
+        self.log_writer = LogWriter.open_shared(self.log_file)
         self.command_history = []
+        self.profile = profile
+        # tracemalloc общий на процесс: запускается один раз, а не на каждую команду
+        self._own_tracemalloc = profile and not tracemalloc.is_tracing()
+        if self._own_tracemalloc:
+            tracemalloc.start()
+        # Состояние выполняемой команды хранится отдельно для каждого потока,
+        # так как фоновые задачи выполняются одновременно
+        self._local = threading.local()
+        self._jobs = None
+        self._purger = None
+        self._archives = {}
+        self._archives_lock = threading.Lock()
+        self._closed = False
+        self.last_status = 0
         self.load_history()
-        Path(self.trash_dir).mkdir(exist_ok=True)
+        if self.fs.is_local:
+            Path(self.trash_dir).mkdir(exist_ok=True)
+
+    @property
+    def metrics(self):
+        if not hasattr(self._local, 'metrics'):
+            self._local.metrics = new_metrics()
+        return self._local.metrics
+
+    @metrics.setter
+    def metrics(self, value):
+        self._local.metrics = value
+
+    @property
+    def jobs(self):
+        """Менеджер задач создается при первом обращении"""
+        if self._jobs is None:
+            self._jobs = JobManager(self.execute)
+        return self._jobs
+
+    @property
+    def purger(self):
+        if self._purger is None:
+            self._purger = Purger()
+        return self._purger
 
     def log(self, command, success=True, error_msg=""):
+        if self.log_format == 'json':
+            parts = command.split()
+            duration = None
+            command_start = getattr(self._local, 'command_start', None)
+            if command_start is not None:
+                duration = round(time.perf_counter() - command_start, 6)
+            record = {
+                'ts': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                'command': parts[0] if parts else command,
+                'args': parts[1:],
+                'duration': duration,
+                'status': 'ok' if success else 'error',
+                'error': error_msg if not success else None,
+                'cwd': self.current_dir,
+            }
+            self.log_writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+            return
+
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] {command}\n")
-            if not success:
-                f.write(f"[{timestamp}] ERROR: {error_msg}\n")
+        text = f"[{timestamp}] {command}\n"
+        if not success:
+            text += f"[{timestamp}] ERROR: {error_msg}\n"
+        self.log_writer.write(text)
+
+    def log_metrics(self, command, wall_time, extra=None):
+        """Записывает метрики команды в лог отдельной JSON-строкой"""
+        record = {
+            'ts': datetime.datetime.now().isoformat(timespec='milliseconds'),
+            'command': command,
+            'wall_time': round(wall_time, 6),
+        }
+        record.update(self.metrics)
+        if extra:
+            record.update(extra)
+        self.log_writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        """Останавливает задачи, дописывает лог и останавливает фоновую запись"""
+        if self._jobs is not None:
+            self._jobs.close()
+            self._jobs = None
+        if self._purger is not None:
+            self._purger.close()
+            self._purger = None
+        with self._archives_lock:
+            for archive in self._archives.values():
+                archive.close()
+            self._archives.clear()
+        if self._own_tracemalloc:
+            self._own_tracemalloc = False
+            tracemalloc.stop()
+        if not self._closed:
+            # Общий писатель лога отпускается ровно один раз
+            self._closed = True
+            self.log_writer.release()
 
     def load_history(self):
-        if os.path.exists(self.history_file):
+        if self.history_file is not None and os.path.exists(self.history_file):
             try:
                 with open(self.history_file, 'r', encoding='utf-8') as f:
                     self.command_history = [line.strip() for line in f.readlines()]
@@ -34,12 +245,18 @@ class MiniShell:
                 self.command_history = []
 
     def save_history(self):
+        if self.history_file is None:
+            return
+        # Файл заменяется атомарно, чтобы читатель не увидел его недописанным
+        tmp = f"{self.history_file}.{os.getpid()}.{threading.get_ident()}.tmp"
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
+            with open(tmp, 'w', encoding='utf-8') as f:
                 for cmd in self.command_history[-100:]:
                     f.write(f"{cmd}\n")
+            os.replace(tmp, self.history_file)
         except:
-            pass
+            if os.path.exists(tmp):
+                os.remove(tmp)
 
     def add_to_history(self, cmd):
         self.command_history.append(cmd)
@@ -54,28 +271,71 @@ class MiniShell:
             path = os.path.join(self.current_dir, path)
         return os.path.normpath(path)
 
-    def ls(self, path=".", detailed=False):
+    def _fs_for(self, path, into_archive=False):
+        """Файловая система, которой принадлежит путь.
+
+        Архив в середине пути открывается как каталог только для чтения;
+        сам путь к архиву - только если into_archive (ls, cd).
+        """
+        if not self.fs.is_local:
+            return self.fs
+        archive = self._archive_root(path, into_archive)
+        if archive is None:
+            return self.fs
+        try:
+            mtime = os.stat(archive).st_mtime
+            with self._archives_lock:
+                cached = self._archives.get(archive)
+                if cached is None or cached.mtime != mtime:
+                    if cached is not None:
+                        cached.close()
+                    cached = self._archives[archive] = ArchiveFS(archive)
+                return cached
+        except (OSError, zipfile.BadZipFile, tarfile.TarError):
+            # Поврежденный архив остается обычным файлом
+            return self.fs
+
+    @staticmethod
+    def _archive_root(path, include_self):
+        """Путь к архиву, внутри которого находится path, или None"""
+        if os.path.exists(path):
+            if include_self and os.path.isfile(path) and path.endswith(ARCHIVE_EXTENSIONS):
+                return path
+            return None
+        parent = os.path.dirname(path)
+        while parent != path:
+            if os.path.isfile(parent):
+                return parent if parent.endswith(ARCHIVE_EXTENSIONS) else None
+            if os.path.isdir(parent):
+                return None
+            path, parent = parent, os.path.dirname(parent)
+        return None
+
+    def ls(self, path=".", detailed=False, sort=None, reverse=False):
+        """Список файлов; sort - 'size' (-S) или 'mtime' (-t), reverse - обратный порядок (-r)"""
         target = self.resolve_path(path)
-        if not os.path.exists(target):
+        fs = self._fs_for(target, into_archive=True)
+        if not fs.exists(target):
             self.log(f"ls {path}", False, "No such file or directory")
             return "Ошибка: Каталог не существует"
 
         try:
-            items = os.listdir(target)
-            if not detailed:
+            if not (detailed or sort or reverse):
+                items = fs.listdir(target)
+                self.metrics['files'] += len(items)
                 self.log(f"ls {path}")
                 return '\n'.join(items)
 
-            result = []
-            for item in items:
-                full = os.path.join(target, item)
-                stat = os.stat(full)
-                perms = oct(stat.st_mode)[-3:]
-                size = stat.st_size
-                mtime = datetime.datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M")
-                result.append(f"{perms} {size:8d} {mtime} {item}")
+            # Записи и их stat берутся за один проход по каталогу и хранятся в колонках;
+            # сортировка идет по колонкам, строки собираются только при выводе
+            listing = Listing.build(fs, target)
+            indexes = listing.children(0) if listing.dirs[0] else [0]
+            self.metrics['files'] += len(indexes)
+            indexes = listing.order(indexes, sort, reverse)
             self.log(f"ls {path}" + (" -l" if detailed else ""))
-            return '\n'.join(result)
+            if detailed:
+                return '\n'.join(listing.long_lines(indexes))
+            return '\n'.join(listing.names[i] for i in indexes)
         except Exception as e:
             self.log(f"ls {path}", False, str(e))
             return f"Ошибка: {str(e)}"
@@ -83,7 +343,7 @@ class MiniShell:
     def cd(self, path):
         target = self.resolve_path(path)
         try:
-            if os.path.isdir(target):
+            if self._fs_for(target, into_archive=True).isdir(target):
                 self.current_dir = target
                 self.log(f"cd {path}")
                 return f"Перешел в {target}"
@@ -96,66 +356,645 @@ class MiniShell:
 
     def cat(self, file_path):
         target = self.resolve_path(file_path)
-        if os.path.isdir(target):
+        fs = self._fs_for(target)
+        if fs.isdir(target):
             self.log(f"cat {file_path}", False, "Is a directory")
             return "Ошибка: Это каталог"
         try:
-            with open(target, 'r', encoding='utf-8') as f:
-                content = f.read()
+            with fs.open(target, 'rb') as f:
+                detected = sniff_file(f)
+                if detected is None:
+                    self.log(f"cat {file_path}", False, "Binary file")
+                    return "Ошибка: Двоичный файл"
+                self.metrics['files'] += 1
+                self.metrics['bytes_read'] += fs.stat(target).st_size
+                content = io.TextIOWrapper(f, encoding=detected[0], errors='replace').read()
             self.log(f"cat {file_path}")
             return content
         except Exception as e:
             self.log(f"cat {file_path}", False, str(e))
             return f"Ошибка: {str(e)}"
 
-    def cp(self, src, dst, recursive=False):
+    def tail(self, file_path, lines=TAIL_LINES, follow=False):
+        """Последние строки файла; с follow выводит дописываемые строки до отмены"""
+        command = f"tail -n {lines}{' -f' if follow else ''} {file_path}"
+        target = self.resolve_path(file_path)
+        fs = self._fs_for(target)
+        if fs.isdir(target):
+            self.log(command, False, "Is a directory")
+            return "Ошибка: Это каталог"
+        if follow and not fs.is_local:
+            self.log(command, False, "Follow needs a local file")
+            return "Ошибка: tail -f работает только с локальными файлами"
+        if follow and self.output_stream is None:
+            self.log(command, False, "No output stream")
+            return "Ошибка: tail -f недоступен в этой сессии"
+        try:
+            st = fs.stat(target)
+            with fs.open(target, 'rb') as f:
+                detected = sniff_file(f)
+                if detected is None:
+                    self.log(command, False, "Binary file")
+                    return "Ошибка: Двоичный файл"
+                encoding, start = detected
+                self.metrics['files'] += 1
+                if encoding in ('utf-8', FALLBACK_ENCODING):
+                    data = self._tail_bytes(f, lines, start)
+                    self.metrics['bytes_read'] += len(data)
+                    text = data.decode(encoding, errors='replace')
+                else:
+                    # В UTF-16/32 перевод строки нельзя искать по байтам
+                    self.metrics['bytes_read'] += st.st_size
+                    reader = io.TextIOWrapper(f, encoding=encoding, errors='replace')
+                    text = ''.join(deque(reader, maxlen=lines)) if lines > 0 else ''
+                    reader.detach()
+        except Exception as e:
+            self.log(command, False, str(e))
+            return f"Ошибка: {str(e)}"
+        self.log(command)
+        if not follow:
+            return text.rstrip('\n')
+        self.output_stream.write(text)
+        self.output_stream.flush()
+        self._follow(target, st, encoding)
+        return ""
+
+    @staticmethod
+    def _tail_bytes(f, lines, start):
+        """Последние строки, прочитанные блоками с конца файла, а не целиком"""
+        position = end = f.seek(0, io.SEEK_END)
+        data = b''
+        # Строк нужно на одну больше: первая из прочитанных может быть неполной
+        while position > start and data.count(b'\n') <= lines:
+            step = min(TAIL_BLOCK_SIZE, position - start)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+        if lines <= 0 or position == end:
+            return b''
+        parts = data.split(b'\n')
+        if parts[-1] == b'':
+            parts.pop()
+        if position > start:
+            parts = parts[1:]
+        return b'\n'.join(parts[-lines:]) + b'\n'
+
+    def _follow(self, target, st, encoding):
+        """Выводит дописываемое в файл по событиям каталога, пока команда не отменена.
+
+        Ротация (файл заменен или усечен) начинает чтение нового файла с начала.
+        """
+        directory, name = os.path.split(target)
+        position, inode = st.st_size, st.st_ino
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        watcher = open_watcher(directory)
+        # Дописанное до появления наблюдателя читается сразу, без ожидания события
+        events = [(name, 'modify')]
+        try:
+            while True:
+                check_cancelled()
+                if any(event_name in (name, '') for event_name, _ in events):
+                    try:
+                        with open(target, 'rb') as f:
+                            st = os.fstat(f.fileno())
+                            if st.st_ino != inode or st.st_size < position:
+                                position, inode = 0, st.st_ino
+                                decoder.reset()
+                            f.seek(position)
+                            data = f.read(st.st_size - position)
+                    except FileNotFoundError:
+                        data = b''
+                    position += len(data)
+                    self.metrics['bytes_read'] += len(data)
+                    text = decoder.decode(data)
+                    if text:
+                        self.output_stream.write(text)
+                        self.output_stream.flush()
+                events = watcher.wait(WATCH_TIMEOUT)
+        finally:
+            watcher.close()
+
+    def watch(self, path):
+        """Выводит изменения в каталоге по мере их появления, пока команда не отменена"""
+        if self.output_stream is None:
+            self.log(f"watch {path}", False, "No output stream")
+            return "Ошибка: watch недоступен в этой сессии"
+        target = self.resolve_path(path)
+        if not os.path.isdir(target):
+            self.log(f"watch {path}", False, "Not a directory")
+            return "Ошибка: Каталог не существует"
+        self.log(f"watch {path}")
+        labels = {'create': 'создан', 'modify': 'изменен', 'delete': 'удален'}
+        watcher = open_watcher(target)
+        try:
+            while True:
+                check_cancelled()
+                for name, kind in watcher.wait(WATCH_TIMEOUT):
+                    if name:
+                        self.output_stream.write(f"{labels[kind]} {name}\n")
+                self.output_stream.flush()
+        finally:
+            watcher.close()
+
+    def cp(self, src, dst, recursive=False, resume=False, dedupe=False, verify=False):
         src_path = self.resolve_path(src)
         dst_path = self.resolve_path(dst)
+        src_fs = self._fs_for(src_path)
+        dst_fs = self._fs_for(dst_path)
 
-        if not os.path.exists(src_path):
+        if not src_fs.exists(src_path):
             self.log(f"cp {src} {dst}", False, "Source does not exist")
             return "Ошибка: Источник не существует"
 
         try:
-            if os.path.isdir(src_path) and recursive:
-                shutil.copytree(src_path, dst_path)
-            elif os.path.isdir(src_path):
+            is_dir = src_fs.isdir(src_path)
+            if is_dir and not recursive:
                 raise IsADirectoryError("Use -r for directories")
-            else:
-                shutil.copy2(src_path, dst_path)
+            if is_dir and dst_fs.exists(dst_path) and not resume:
+                raise FileExistsError(f"File exists: '{dst_path}'")
+            if not is_dir and dst_fs.isdir(dst_path):
+                dst_path = os.path.join(dst_path, os.path.basename(src_path))
+
+            if not (src_fs.is_local and dst_fs.is_local):
+                # Контрольные точки и дедупликация работают только с локальными файлами
+                self._copy_between(src_fs, src_path, dst_fs, dst_path)
+                verified = self._verify_copy(src_fs, src_path, dst_fs, dst_path) if verify else None
+                self.add_to_history(f"cp {src} {dst}")
+                self.log(f"cp {src} {dst}")
+                if verified is not None:
+                    return f"Копирование успешно (проверено файлов: {verified})"
+                return "Копирование успешно"
+
+            checkpoint_path = self._checkpoint_path(dst_path)
+            if resume and not os.path.exists(checkpoint_path):
+                self.log(f"cp {src} {dst}", False, "No checkpoint to resume")
+                return "Ошибка: Нет контрольной точки для продолжения"
+            digests = self._find_duplicates(src_path) if dedupe and is_dir else None
+            checkpoint = Checkpoint(checkpoint_path, resume)
+            try:
+                if is_dir:
+                    duplicates, saved = self._copy_tree(src_path, dst_path, checkpoint, digests)
+                else:
+                    self._copy_resumable(src_path, dst_path, '', checkpoint)
+            except BaseException:
+                checkpoint.close()
+                raise
+            checkpoint.close(remove=True)
+            verified = self._verify_copy(src_fs, src_path, dst_fs, dst_path) if verify else None
+
             self.add_to_history(f"cp {src} {dst}")
             self.log(f"cp {src} {dst}")
-            return "Копирование успешно"
+            result = "Копирование успешно"
+            if digests is not None:
+                result += f" (дубликатов: {duplicates}, сэкономлено байт: {saved})"
+            if verified is not None:
+                result += f" (проверено файлов: {verified})"
+            return result
         except Exception as e:
             self.log(f"cp {src} {dst}", False, str(e))
             return f"Ошибка: {str(e)}"
 
+    def _verify_copy(self, src_fs, src_path, dst_fs, dst_path):
+        """Сравнивает хэши источника и копии в любых файловых системах, возвращает число файлов"""
+        if src_fs.isdir(src_path):
+            pairs = []
+            tree = os.walk(src_path, followlinks=True) if src_fs.is_local else src_fs.walk(src_path)
+            for root, _, files in tree:
+                target_root = os.path.join(dst_path, os.path.relpath(root, src_path))
+                pairs.extend((os.path.join(root, name), os.path.normpath(os.path.join(target_root, name)))
+                             for name in files)
+        else:
+            pairs = [(src_path, dst_path)]
+        if src_fs is dst_fs:
+            digests = self._hash_in(src_fs, [path for pair in pairs for path in pair])
+            src_digests = dst_digests = digests
+        else:
+            src_digests = self._hash_in(src_fs, [src_file for src_file, _ in pairs])
+            dst_digests = self._hash_in(dst_fs, [dst_file for _, dst_file in pairs])
+        for src_file, dst_file in pairs:
+            if src_digests[src_file] != dst_digests[dst_file]:
+                raise OSError(f"Контрольная сумма копии не совпадает: {dst_file}")
+        return len(pairs)
+
+    @staticmethod
+    def _checkpoint_path(target, suffix='checkpoint'):
+        """Служебный файл операции (контрольная точка, журнал) лежит рядом с ее целью"""
+        target = target.rstrip('/\\')
+        return os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.{suffix}")
+
+    def _copy_stream(self, fsrc, fdst, pos=0, progress=None, length=None):
+        """Копирует поток (не больше length байт) блоками через один буфер.
+
+        progress(pos, n) вызывается после каждого блока: позиция в файле
+        (для контрольных точек) и число записанных байт (для прогресса).
+        """
+        buf = bytearray(COPY_CHUNK_SIZE)
+        view = memoryview(buf)
+        while length is None or length > 0:
+            check_cancelled()
+            n = fsrc.readinto(buf if length is None or length >= len(buf) else view[:length])
+            if not n:
+                break
+            if length is not None:
+                length -= n
+            throttle(n)
+            fdst.write(view[:n])
+            pos += n
+            self.metrics['bytes_read'] += n
+            self.metrics['bytes_written'] += n
+            if progress is not None:
+                progress(pos, n)
+        return pos
+
+    def _copy_ranges(self, fsrc, fdst, ranges, size, start=0, progress=None):
+        """Копирует только участки с данными после start; дыры в копии остаются дырами"""
+        for offset, length in ranges:
+            if offset + length <= start:
+                continue
+            begin = max(offset, start)
+            fsrc.seek(begin)
+            fdst.seek(begin)
+            self._copy_stream(fsrc, fdst, begin, progress, offset + length - begin)
+        # Дыра в конце файла появляется при установке размера
+        fdst.truncate(size)
+
+    def _copy_file(self, src, dst, offset=0, progress=None, fsync=False):
+        """Копирует файл с сохранением метаданных, начиная с offset.
+
+        У разреженного файла (виртуальные диски, базы данных) копируются только
+        участки с данными, найденные через SEEK_DATA/SEEK_HOLE.
+        """
+        self.metrics['files'] += 1
+        with open(src, 'rb', buffering=0) as fsrc, \
+                open(dst, 'r+b' if offset else 'wb', buffering=0) as fdst:
+            if offset:
+                fsrc.seek(offset)
+                fdst.seek(offset)
+                fdst.truncate()
+            st = os.fstat(fsrc.fileno())
+            ranges = None
+            if is_sparse(st):
+                try:
+                    ranges = data_ranges(fsrc.fileno(), st.st_size)
+                except OSError:
+                    pass
+            if ranges is not None:
+                self._copy_ranges(fsrc, fdst, ranges, st.st_size, offset, progress)
+            else:
+                self._copy_stream(fsrc, fdst, offset, progress)
+            if fsync:
+                os.fsync(fdst.fileno())
+        shutil.copystat(src, dst)
+
+    def _copy_between(self, src_fs, src, dst_fs, dst):
+        """Копирует файл или дерево между любыми файловыми системами через их open"""
+        if src_fs.isdir(src):
+            for root, dirs, files in src_fs.walk(src):
+                target_root = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+                dst_fs.makedirs(target_root, exist_ok=True)
+                for name in files:
+                    self._copy_between(src_fs, os.path.join(root, name),
+                                       dst_fs, os.path.join(target_root, name))
+            return
+        self.metrics['files'] += 1
+        with src_fs.open(src, 'rb') as fsrc, dst_fs.open(dst, 'wb') as fdst:
+            self._copy_stream(fsrc, fdst)
+
+    @staticmethod
+    def _resume_offset(checkpoint, name, dst):
+        """Смещение для продолжения файла: не дальше того, что реально есть на диске"""
+        offset = checkpoint.offset(name)
+        if not offset or not os.path.exists(dst):
+            return 0
+        return min(offset, os.path.getsize(dst))
+
+    def _copy_resumable(self, src, dst, name, checkpoint):
+        if checkpoint.is_done(name) and os.path.exists(dst) \
+                and os.path.getsize(dst) == os.path.getsize(src):
+            return
+        offset = self._resume_offset(checkpoint, name, dst)
+        self._copy_file(src, dst, offset, lambda pos, n: checkpoint.mark_partial(name, pos))
+        checkpoint.mark_done(name)
+
+    def _copy_tree(self, src_root, dst_root, checkpoint, digests=None):
+        """Рекурсивное копирование с отметкой готовых файлов в контрольной точке.
+
+        Если переданы хэши (digests), файл с тем же хэшем и побайтно равный
+        уже скопированному клонируется с первой копии. Возвращает число
+        таких файлов и байты, сэкономленные клонированием.
+        """
+        copied_dirs = []
+        first_copy = {}
+        duplicates = saved = 0
+        for root, dirs, files in os.walk(src_root, followlinks=True):
+            rel_root = os.path.relpath(root, src_root)
+            target_root = os.path.normpath(os.path.join(dst_root, rel_root))
+            os.makedirs(target_root, exist_ok=True)
+            for name in files:
+                rel = os.path.normpath(os.path.join(rel_root, name))
+                src_file = os.path.join(root, name)
+                dst_file = os.path.join(target_root, name)
+                digest = digests.get(src_file) if digests else None
+                # Быстрый хэш не криптографический: перед клонированием сверяем байты
+                if digest in first_copy and not checkpoint.is_done(rel) \
+                        and filecmp.cmp(first_copy[digest][0], src_file, shallow=False):
+                    if self._link_duplicate(first_copy[digest][1], dst_file):
+                        saved += os.path.getsize(src_file)
+                    checkpoint.mark_done(rel)
+                    duplicates += 1
+                    continue
+                self._copy_resumable(src_file, dst_file, rel, checkpoint)
+                if digest is not None:
+                    first_copy.setdefault(digest, (src_file, dst_file))
+            copied_dirs.append((root, target_root))
+        # Время изменения каталогов выставляем после того, как в них все записано
+        for src_dir, dst_dir in reversed(copied_dirs):
+            shutil.copystat(src_dir, dst_dir)
+        return duplicates, saved
+
+    def _find_duplicates(self, root):
+        """Хэширует только файлы, размер которых встречается в дереве больше одного раза"""
+        by_size = {}
+        for dirpath, _, files in os.walk(root, followlinks=True):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                size = os.path.getsize(path)
+                if size:
+                    by_size.setdefault(size, []).append(path)
+        candidates = [path for group in by_size.values() if len(group) > 1 for path in group]
+
+        cache = HashCache(self.hash_cache_file)
+        digests = hash_files(candidates, cache=cache)
+        cache.save()
+        self.metrics['cache_hits'] += cache.hits
+        return digests
+
+    def _link_duplicate(self, existing, dst):
+        """Создает dst как reflink-копию existing, иначе обычную копию; True, если клонировано.
+
+        Жесткие ссылки не используются: изменение одной копии меняло бы и другую.
+        """
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            self._reflink(existing, dst)
+            return True
+        except OSError:
+            self._copy_file(existing, dst)
+            return False
+
+    @staticmethod
+    def _reflink(src, dst):
+        """Клонирует файл через FICLONE (btrfs, xfs): данные общие, а файлы независимы"""
+        if fcntl is None:
+            raise OSError("reflink не поддерживается")
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            raise
+        shutil.copystat(src, dst)
+
     def mv(self, src, dst):
         src_path = self.resolve_path(src)
         dst_path = self.resolve_path(dst)
+        src_fs = self._fs_for(src_path)
+        dst_fs = self._fs_for(dst_path)
 
-        if not os.path.exists(src_path):
+        if not src_fs.exists(src_path):
             self.log(f"mv {src} {dst}", False, "Source does not exist")
             return "Ошибка: Источник не существует"
 
         try:
-            shutil.move(src_path, dst_path)
+            final_path = dst_path
+            if dst_fs.isdir(dst_path):
+                final_path = os.path.join(dst_path, os.path.basename(src_path.rstrip('/\\')))
+            if not (src_fs.is_local and dst_fs.is_local):
+                self._move_between(src_fs, src_path, dst_fs, final_path)
+                self.add_to_history(f"mv {src} {dst}")
+                self.log(f"mv {src} {dst}")
+                return "Перемещение успешно"
+
+            journal_path = self._checkpoint_path(final_path, 'mvjournal')
+            if os.path.exists(journal_path):
+                self._recover_move(journal_path)
+
+            if self._is_cross_device(src_path, final_path):
+                result = self._move_across(src_path, final_path, journal_path)
+            else:
+                shutil.move(src_path, dst_path)
+                result = "Перемещение успешно"
             self.add_to_history(f"mv {src} {dst}")
             self.log(f"mv {src} {dst}")
-            return "Перемещение успешно"
+            return result
         except Exception as e:
             self.log(f"mv {src} {dst}", False, str(e))
             return f"Ошибка: {str(e)}"
 
-    def rm(self, target, recursive=False):
+    def _move_between(self, src_fs, src_path, dst_fs, dst_path):
+        """Перемещение, в котором участвует виртуальная файловая система"""
+        if src_fs.readonly:
+            raise OSError(errno.EROFS, "Read-only file system", src_path)
+        if src_fs is dst_fs:
+            src_fs.rename(src_path, dst_path)
+            return
+        if src_fs.isdir(src_path) and dst_fs.exists(dst_path):
+            raise FileExistsError(f"Destination path '{dst_path}' already exists")
+        self._copy_between(src_fs, src_path, dst_fs, dst_path)
+        self._remove_in(src_fs, src_path)
+
+    def _remove_in(self, fs, path):
+        """Удаляет файл или дерево в любой файловой системе"""
+        if fs.is_local:
+            self._remove_path(path)
+        elif fs.isdir(path):
+            # Обход сверху вниз в обратном порядке: каталоги удаляются после содержимого
+            for root, dirs, files in reversed(list(fs.walk(path))):
+                for name in files:
+                    fs.remove(os.path.join(root, name))
+                fs.rmdir(root)
+        elif fs.exists(path):
+            fs.remove(path)
+
+    @staticmethod
+    def _is_cross_device(src_path, dst_path):
+        if os.path.islink(src_path):
+            return False
+        dst_parent = os.path.dirname(dst_path.rstrip('/\\'))
+        return os.lstat(src_path).st_dev != os.stat(dst_parent).st_dev
+
+    def _move_across(self, src_path, dst_path, journal_path):
+        """Перемещение между файловыми системами.
+
+        Источник копируется во временный путь рядом с назначением с fsync и
+        проверкой размеров и хэшей, затем временный путь атомарно переименовывается
+        в назначение, и только после этого удаляется источник. Журнал позволяет
+        после сбоя откатить незаконченное копирование или доудалить источник.
+        """
+        if os.path.isdir(src_path) and os.path.exists(dst_path):
+            raise FileExistsError(f"Destination path '{dst_path}' already exists")
+        tmp_path = self._checkpoint_path(dst_path, 'mvtmp')
+        journal = {'src': src_path, 'dst': dst_path, 'tmp': tmp_path, 'phase': 'copy'}
+        self._register_journal(journal_path)
+        self._write_journal(journal_path, journal)
+        try:
+            progress = self._parallel_copy(src_path, tmp_path)
+            os.replace(tmp_path, dst_path)
+            self._fsync_dir(os.path.dirname(dst_path))
+        except BaseException:
+            self._remove_path(tmp_path)
+            os.remove(journal_path)
+            self._unregister_journal(journal_path)
+            raise
+        journal['phase'] = 'commit'
+        self._write_journal(journal_path, journal)
+        self._remove_path(src_path)
+        os.remove(journal_path)
+        self._unregister_journal(journal_path)
+        return f"Перемещение успешно ({progress.done} байт, {progress.rate:.1f} МБ/с)"
+
+    def _parallel_copy(self, src_path, dst_path):
+        """Копирует файл или дерево в несколько потоков с fsync и проверкой размеров и хэшей"""
+        tasks = []
+        dirs = []
+        if os.path.isdir(src_path):
+            for root, dirnames, files in os.walk(src_path):
+                target_root = os.path.normpath(os.path.join(dst_path, os.path.relpath(root, src_path)))
+                os.makedirs(target_root)
+                dirs.append((root, target_root))
+                for name in dirnames + files:
+                    src_item = os.path.join(root, name)
+                    dst_item = os.path.join(target_root, name)
+                    if os.path.islink(src_item):
+                        os.symlink(os.readlink(src_item), dst_item)
+                    elif name in files:
+                        tasks.append((src_item, dst_item, os.path.getsize(src_item)))
+        else:
+            tasks.append((src_path, dst_path, os.path.getsize(src_path)))
+
+        # Копируются только участки с данными, поэтому и 100% считаем по ним
+        progress = Progress(sum(data_size(src) for src, _, _ in tasks), self.progress_stream, "mv")
+
+        def copy_verified(src, dst, size):
+            self._copy_file(src, dst, progress=progress.copied, fsync=True)
+            if os.path.getsize(dst) != size:
+                raise OSError(f"Размер копии не совпадает с источником: {dst}")
+            # Источник удаляется после переноса, поэтому сверяем и содержимое
+            if hash_file(src) != hash_file(dst):
+                raise OSError(f"Контрольная сумма копии не совпадает с источником: {dst}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+                futures = [pool.submit(contextvars.copy_context().run, copy_verified, *task)
+                           for task in tasks]
+                for future in futures:
+                    future.result()
+        finally:
+            progress.finish()
+
+        for src_dir, dst_dir in reversed(dirs):
+            shutil.copystat(src_dir, dst_dir)
+            self._fsync_dir(dst_dir)
+        # Копирование шло в других потоках, учитываем его в метриках команды
+        self.metrics['files'] += len(tasks)
+        self.metrics['bytes_read'] += progress.done
+        self.metrics['bytes_written'] += progress.done
+        return progress
+
+    @staticmethod
+    def _write_journal(path, journal):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(journal, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _recover_move(self, journal_path):
+        """Доводит до конца перемещение, прерванное сбоем"""
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            journal = json.load(f)
+        if journal['phase'] == 'copy':
+            # Назначение еще не появилось: откатываем частичную копию
+            self._remove_path(journal['tmp'])
+        else:
+            # Назначение уже на месте: доудаляем источник
+            self._remove_path(journal['src'])
+        os.remove(journal_path)
+        self._unregister_journal(journal_path)
+        self.log(f"mv recover {journal['src']} {journal['dst']}")
+
+    def _journal_entry(self, journal_path):
+        name = hashlib.sha1(journal_path.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.move_journals_dir, name)
+
+    def _register_journal(self, journal_path):
+        """Записывает путь журнала в реестр state_dir до начала перемещения"""
+        os.makedirs(self.move_journals_dir, exist_ok=True)
+        with open(self._journal_entry(journal_path), 'w', encoding='utf-8', errors='surrogateescape') as f:
+            f.write(journal_path)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _unregister_journal(self, journal_path):
+        try:
+            os.remove(self._journal_entry(journal_path))
+        except FileNotFoundError:
+            pass
+
+    def recover_moves(self):
+        """Доводит перемещения, прерванные сбоем, по реестру журналов; возвращает их число.
+
+        Вызывается при запуске процесса, пока ни одна сессия не начала свой mv.
+        """
+        if not os.path.isdir(self.move_journals_dir):
+            return 0
+        recovered = 0
+        for name in os.listdir(self.move_journals_dir):
+            entry = os.path.join(self.move_journals_dir, name)
+            try:
+                with open(entry, 'r', encoding='utf-8', errors='surrogateescape') as f:
+                    journal_path = f.read()
+                if os.path.exists(journal_path):
+                    self._recover_move(journal_path)
+                    recovered += 1
+                else:
+                    os.remove(entry)
+            except (OSError, ValueError, KeyError) as e:
+                self.log(f"mv recover {name}", False, str(e))
+        return recovered
+
+    @staticmethod
+    def _remove_path(path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _fsync_dir(path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def rm(self, target, recursive=False, force=False, purge=False):
         target_path = self.resolve_path(target)
 
         # Проверяем защищенные пути
         try:
             abs_target = os.path.abspath(target_path)
             abs_root = os.path.abspath("/")
-            abs_parent = os.path.abspath("..")
-            abs_current = os.path.abspath(".")
+            abs_parent = os.path.dirname(self.current_dir)
+            abs_current = self.current_dir
 
             if abs_target == abs_root or abs_target == abs_parent or abs_target == abs_current:
                 self.log(f"rm {target}", False, "Cannot remove protected directory")
@@ -163,22 +1002,38 @@ class MiniShell:
         except:
             pass
 
-        if os.path.isdir(target_path) and recursive:
-            confirm = input(f"Удалить каталог {target} рекурсивно? (y/n): ")
-            if confirm.lower() != 'y':
+        fs = self._fs_for(target_path)
+        if fs.isdir(target_path) and recursive and not force:
+            ask = self.confirm if self.confirm is not None else input
+            answer = ask(f"Удалить каталог {target} рекурсивно? (y/n): ")
+            if answer.lower() != 'y':
                 return "Отменено"
 
         try:
-            if os.path.isdir(target_path) and recursive:
+            if fs.isdir(target_path) and recursive:
                 # Создаем уникальное имя для корзины
-                timestamp = str(int(datetime.datetime.now().timestamp()))
                 base_name = os.path.basename(target_path.rstrip('/\\'))
-                trash_path = os.path.join(self.trash_dir, f"{base_name}_{timestamp}")
-                shutil.move(target_path, trash_path)
-            elif os.path.isdir(target_path):
-                os.rmdir(target_path)  # Только для пустых директорий
+                trash_path = os.path.join(self._trash_for(target_path), f"{base_name}_{time.time_ns()}")
+                if not fs.is_local:
+                    fs.rename(target_path, trash_path)
+                    if purge:
+                        self._remove_in(fs, trash_path)
+                        self.log(f"rm --purge {target}")
+                        return "Удаление успешно"
+                else:
+                    try:
+                        os.rename(target_path, trash_path)
+                    except OSError:
+                        # Точка монтирования не переносится переименованием
+                        shutil.move(target_path, trash_path)
+                    if purge:
+                        self.purger.submit(trash_path, self._purge_failed)
+                        self.log(f"rm --purge {target}")
+                        return "Удаление запущено в фоне"
+            elif fs.isdir(target_path):
+                fs.rmdir(target_path)  # Только для пустых директорий
             else:
-                os.remove(target_path)
+                fs.remove(target_path)
 
             self.add_to_history(f"rm {target}")
             self.log(f"rm {target}")
@@ -187,6 +1042,53 @@ class MiniShell:
             self.log(f"rm {target}", False, str(e))
             return f"Ошибка: {str(e)}"
 
+    def _trash_for(self, target_path):
+        """Корзина на той же файловой системе, что и удаляемый путь.
+
+        Тогда перенос в корзину - это rename, а не копирование. Для другой
+        файловой системы корзина создается в ее точке монтирования, а если
+        туда нельзя писать - рядом с удаляемым путем.
+        """
+        fs = self._fs_for(target_path)
+        if not fs.is_local:
+            # У виртуальной файловой системы своя корзина в корне
+            trash = os.path.join(fs.root, '.trash')
+            fs.makedirs(trash, exist_ok=True)
+            return trash
+        parent = os.path.dirname(target_path.rstrip('/\\'))
+        device = os.stat(parent).st_dev
+        default = self.trash_dir
+        os.makedirs(default, exist_ok=True)
+        if os.stat(default).st_dev == device:
+            return default
+
+        mount = parent
+        while True:
+            upper = os.path.dirname(mount)
+            if upper == mount or os.stat(upper).st_dev != device:
+                break
+            mount = upper
+        for base in (mount, parent):
+            trash = os.path.join(base, '.trash')
+            try:
+                os.makedirs(trash, exist_ok=True)
+                return trash
+            except OSError:
+                continue
+        return default
+
+    def _purge_failed(self, path, error):
+        self.log(f"purge {path}", False, str(error))
+
+    def purge_trash(self):
+        """Окончательно удаляет содержимое корзины в фоне"""
+        trash = self.trash_dir
+        items = os.listdir(trash) if os.path.isdir(trash) else []
+        for name in items:
+            self.purger.submit(os.path.join(trash, name), self._purge_failed)
+        self.log("rm --purge")
+        return f"Очистка корзины запущена в фоне (элементов: {len(items)})"
+
     def history(self, n=10):
         """Возвращает последние n команд из истории"""
         last_n = self.command_history[-n:] if self.command_history else []
@@ -194,6 +1096,34 @@ class MiniShell:
             return "История пуста"
         return '\n'.join([f"{i + 1}: {cmd}" for i, cmd in enumerate(last_n)])
 
+    def stats(self, kind=None, n=STATS_TOP):
+        """Сводка по shell.log: частые команды, доля ошибок, самые долгие.
+
+        Лог дочитывается с места прошлого запроса (смещение и сводка хранятся
+        в .logstats), поэтому повторный запрос читает только новые записи.
+        """
+        self.log_writer.flush()
+        try:
+            stats = update_stats(self.log_file, self.stats_index_file)
+        except Exception as e:
+            return f"Ошибка: {str(e)}"
+        sections = []
+        if kind in (None, 'top'):
+            top = stats.top(n)
+            width = max((len(name) for name, _ in top), default=0)
+            sections.append(("Частые команды:",
+                             [f"  {name:<{width}}  {count}" for name, count in top]))
+        if kind in (None, 'errors'):
+            errors = stats.errors(n)
+            width = max((len(name) for name, _, _ in errors), default=0)
+            sections.append(("Ошибки по командам:",
+                             [f"  {name:<{width}}  {failed}/{total} ({failed / total:.0%})"
+                              for name, failed, total in errors]))
+        if kind in (None, 'slow'):
+            sections.append(("Самые долгие:",
+                             [f"  {seconds:8.3f} с  {command}" for seconds, command in stats.slow(n)]))
+        return '\n'.join('\n'.join([title] + (lines or ["  нет данных"])) for title, lines in sections)
+
     def undo(self):
         if not self.command_history:
             return "История пуста"
@@ -201,16 +1131,14 @@ class MiniShell:
         last_cmd = self.command_history[-1]
         parts = last_cmd.split()
 
-        if len(parts) < 3:
+        if len(parts) < 2 or (parts[0] not in ('rm', 'snapshot', 'restore') and len(parts) < 3):
             return "Нечего отменять"
 
         if parts[0] == 'cp':
             dst = self.resolve_path(parts[2])
-            if os.path.exists(dst):
-                if os.path.isdir(dst):
-                    shutil.rmtree(dst)
-                else:
-                    os.remove(dst)
+            fs = self._fs_for(dst)
+            if fs.exists(dst):
+                self._remove_in(fs, dst)
                 self.command_history.pop()
                 self.save_history()
                 self.log(f"undo: {last_cmd}")
@@ -222,28 +1150,186 @@ class MiniShell:
             return "Для mv требуется ручное восстановление"
 
         elif parts[0] == 'rm':
-            trash_items = list(Path(self.trash_dir).iterdir())
-            if trash_items:
-                # Находим самый свежий элемент в корзине
-                trash_items.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-                latest = trash_items[0]
-                # Извлекаем оригинальное имя (без timestamp)
-                name_parts = latest.name.rsplit('_', 1)
-                original_name = name_parts[0] if len(name_parts) > 1 else latest.name
-                shutil.move(str(latest), os.path.join(self.current_dir, original_name))
+            original_path = self.resolve_path(parts[1])
+            original_name = os.path.basename(original_path)
+            fs = self._fs_for(original_path)
+            trash = self._trash_for(original_path)
+            # Находим самую свежую копию этого каталога в корзине по метке времени в имени
+            trash_items = [name for name in fs.listdir(trash)
+                           if name.rsplit('_', 1)[0] == original_name
+                           and name.rsplit('_', 1)[-1].isdigit()]
+            if trash_items and not fs.exists(original_path):
+                latest = max(trash_items, key=lambda name: int(name.rsplit('_', 1)[1]))
+                fs.rename(os.path.join(trash, latest), original_path)
                 self.command_history.pop()
                 self.save_history()
                 self.log(f"undo: {last_cmd}")
                 return f"Восстановлено: {original_name}"
 
+        elif parts[0] == 'snapshot':
+            snapshots = self._snapshots(parts[1])
+            if snapshots:
+                # Удаляем последний снимок в фоне; до этого он скрыт из списка снимков
+                latest = os.path.join(self._checkpoint_path(parts[1], 'snapshots'), snapshots[-1])
+                os.rename(latest, f"{latest}.tmp")
+                self.purger.submit(f"{latest}.tmp", self._purge_failed)
+                self.command_history.pop()
+                self.save_history()
+                self.log(f"undo: {last_cmd}")
+                return f"Удален снимок: {snapshots[-1]}"
+
+        elif parts[0] == 'restore':
+            target = self._snapshot_target(parts[1])
+            previous = os.path.join(self._trash_for(target), parts[2]) if len(parts) > 2 else None
+            if target is not None and (previous is None or os.path.lexists(previous)):
+                # Оба шага - переименования, поэтому откат не зависит от размера дерева
+                if os.path.lexists(target):
+                    restored = os.path.join(self._trash_for(target),
+                                            f"{os.path.basename(target)}_{time.time_ns()}")
+                    os.rename(target, restored)
+                    self.purger.submit(restored, self._purge_failed)
+                if previous is not None:
+                    os.rename(previous, target)
+                self.command_history.pop()
+                self.save_history()
+                self.log(f"undo: {last_cmd}")
+                return f"Восстановлено: {os.path.basename(target)}"
+
         return "Нечего отменять"
 
+    def snapshot(self, path):
+        """Снимок каталога на момент команды, как в rsnapshot.
+
+        Файлы, не изменившиеся с прошлого снимка (размер, mtime, права), становятся
+        жесткими ссылками на его файлы, остальные клонируются (reflink) или
+        копируются. Снимки лежат рядом с каталогом в .<имя>.snapshots и никогда
+        не изменяются, поэтому делить файлы между ними безопасно.
+        """
+        target = self.resolve_path(path).rstrip('/\\')
+        if not os.path.isdir(target):
+            self.log(f"snapshot {path}", False, "Not a directory")
+            return "Ошибка: Каталог не существует"
+        root = self._checkpoint_path(target, 'snapshots')
+        previous = self._snapshots(target)
+        name = datetime.datetime.now().strftime(SNAPSHOT_NAME_FORMAT)
+        snapshot = os.path.join(root, name)
+        # Снимок появляется под своим именем, только когда он собран целиком
+        staging = f"{snapshot}.tmp"
+        try:
+            os.makedirs(root, exist_ok=True)
+            base = os.path.join(root, previous[-1]) if previous else None
+            linked, copied = self._build_tree(target, staging, base)
+            os.rename(staging, snapshot)
+        except Exception as e:
+            shutil.rmtree(staging, ignore_errors=True)
+            self.log(f"snapshot {path}", False, str(e))
+            return f"Ошибка: {str(e)}"
+        self.add_to_history(f"snapshot {target}")
+        self.log(f"snapshot {path}")
+        return (f"Снимок создан: {os.path.relpath(snapshot, self.current_dir)} "
+                f"(скопировано файлов: {copied}, общих с прошлым снимком: {linked})")
+
+    def restore(self, snapshot):
+        """Возвращает каталог к снимку (или к последнему снимку, если указан сам каталог).
+
+        Дерево собирается рядом из клонов или копий файлов снимка: жесткие ссылки
+        здесь нельзя, запись в файл каталога изменила бы снимок. Затем текущий
+        каталог переносится в корзину, а собранное дерево встает на его место;
+        undo меняет их обратно двумя переименованиями.
+        """
+        snapshot_path = self.resolve_path(snapshot).rstrip('/\\')
+        target = self._snapshot_target(snapshot_path)
+        if target is None:
+            snapshots = self._snapshots(snapshot_path)
+            if snapshots:
+                target = snapshot_path
+                snapshot_path = os.path.join(self._checkpoint_path(target, 'snapshots'), snapshots[-1])
+        if target is None or not os.path.isdir(snapshot_path):
+            self.log(f"restore {snapshot}", False, "No such snapshot")
+            return "Ошибка: Снимок не найден"
+        staging = self._checkpoint_path(target, 'restore')
+        try:
+            if os.path.lexists(staging):
+                shutil.rmtree(staging)
+            self._build_tree(snapshot_path, staging)
+            trashed = ''
+            if os.path.lexists(target):
+                trashed = f"{os.path.basename(target)}_{time.time_ns()}"
+                os.rename(target, os.path.join(self._trash_for(target), trashed))
+            os.rename(staging, target)
+        except Exception as e:
+            shutil.rmtree(staging, ignore_errors=True)
+            self.log(f"restore {snapshot}", False, str(e))
+            return f"Ошибка: {str(e)}"
+        self.add_to_history(f"restore {snapshot_path} {trashed}".rstrip())
+        self.log(f"restore {snapshot}")
+        return f"Восстановлено из снимка: {os.path.basename(snapshot_path)}"
+
+    def _snapshots(self, target):
+        """Имена готовых снимков каталога, от старых к новым"""
+        root = self._checkpoint_path(target, 'snapshots')
+        if not os.path.isdir(root):
+            return []
+        return sorted(name for name in os.listdir(root) if not name.endswith('.tmp'))
+
+    @staticmethod
+    def _snapshot_target(snapshot_path):
+        """Каталог, к которому относится снимок .<имя>.snapshots/<снимок>, или None"""
+        parent, _ = os.path.split(snapshot_path)
+        match = re.fullmatch(r'\.(.+)\.snapshots', os.path.basename(parent))
+        if match is None:
+            return None
+        return os.path.join(os.path.dirname(parent), match.group(1))
+
+    def _build_tree(self, src_root, dst_root, base=None):
+        """Копия дерева для снимка или восстановления.
+
+        Файл, совпадающий по размеру, mtime и правам с файлом в base (прошлом
+        снимке), связывается с ним жесткой ссылкой, остальные клонируются
+        через reflink или копируются. Возвращает (связано, скопировано).
+        """
+        linked = copied = 0
+        os.makedirs(dst_root)
+        dirs = [(src_root, dst_root)]
+        for rel, is_dir, st in walk_tree(LocalFS(), src_root):
+            check_cancelled()
+            src_item = os.path.join(src_root, rel)
+            dst_item = os.path.join(dst_root, rel)
+            if os.path.islink(src_item):
+                os.symlink(os.readlink(src_item), dst_item)
+            elif is_dir:
+                os.mkdir(dst_item)
+                dirs.append((src_item, dst_item))
+            elif stat.S_ISREG(st.st_mode):
+                previous = os.path.join(base, rel) if base else None
+                if previous and self._unchanged(st, previous):
+                    os.link(previous, dst_item)
+                    linked += 1
+                    continue
+                try:
+                    self._reflink(src_item, dst_item)
+                except OSError:
+                    self._copy_file(src_item, dst_item)
+                copied += 1
+        for src_dir, dst_dir in reversed(dirs):
+            shutil.copystat(src_dir, dst_dir)
+        return linked, copied
+
+    @staticmethod
+    def _unchanged(st, path):
+        try:
+            old = os.lstat(path)
+        except OSError:
+            return False
+        return (stat.S_ISREG(old.st_mode) and old.st_size == st.st_size
+                and old.st_mtime_ns == st.st_mtime_ns and old.st_mode == st.st_mode)
+
     # Плагины
     def zip(self, folder, archive):
         try:
-            # Убираем расширение .zip если оно есть
-            archive_name = archive.replace('.zip', '')
-            shutil.make_archive(archive_name, 'zip', folder)
+            # Расширение .zip добавляется, только если имя им не оканчивается
+            archive_name = archive if archive.endswith('.zip') else archive + '.zip'
+            self._write_zip(self.resolve_path(folder), self.resolve_path(archive_name))
             self.log(f"zip {folder} {archive}")
             return "Архив ZIP создан"
         except Exception as e:
@@ -251,183 +1337,998 @@ class MiniShell:
             return f"Ошибка: {str(e)}"
 
     def unzip(self, archive):
+        """Потоковая распаковка ZIP с ограничениями против zip-бомб.
+
+        До записи по центральному каталогу проверяются число элементов, общий
+        объем и степень сжатия. zipfile не выдает больше объявленного размера
+        элемента и сверяет CRC-32 по мере чтения, поэтому обойти ограничения
+        ложными размерами нельзя. Элементы копируются блоками через один буфер.
+        """
         try:
-            with zipfile.ZipFile(archive, 'r') as zf:
-                zf.extractall()
+            with zipfile.ZipFile(self.resolve_path(archive), 'r') as zf:
+                members = zf.infolist()
+                progress = Progress(self._check_zip_limits(members), self.progress_stream, "unzip")
+                try:
+                    for member in members:
+                        check_cancelled()
+                        self._extract_zip_member(zf, member, self.current_dir, progress.copied)
+                finally:
+                    progress.finish()
             self.log(f"unzip {archive}")
-            return "Архив ZIP распакован"
+            return f"Архив ZIP распакован (элементов: {len(members)}, {progress.done} байт, {progress.rate:.1f} МБ/с)"
         except Exception as e:
             self.log(f"unzip {archive}", False, str(e))
             return f"Ошибка: {str(e)}"
 
+    @staticmethod
+    def _check_zip_limits(members):
+        """Проверяет ограничения распаковки; возвращает общий объем в байтах"""
+        if len(members) > UNZIP_MAX_MEMBERS:
+            raise ValueError(f"Слишком много элементов в архиве: {len(members)} (допустимо {UNZIP_MAX_MEMBERS})")
+        total = 0
+        for member in members:
+            ratio = member.file_size / max(member.compress_size, 1)
+            if member.file_size > UNZIP_RATIO_MIN_SIZE and ratio > UNZIP_MAX_RATIO:
+                raise ValueError(f"Подозрительная степень сжатия {ratio:.0f}:1 у {member.filename} "
+                                 f"(допустимо {UNZIP_MAX_RATIO}:1)")
+            total += member.file_size
+        if total > UNZIP_MAX_SIZE:
+            raise ValueError(f"Слишком большой объем после распаковки: {total} байт (допустимо {UNZIP_MAX_SIZE})")
+        return total
+
+    def _extract_zip_member(self, zf, member, extract_dir, progress):
+        """Распаковывает элемент блоками; файл с неверной CRC-32 или размером удаляется"""
+        # Как zf.extract: абсолютные пути и '..' в имени отбрасываются
+        parts = [part for part in member.filename.replace('\\', '/').split('/')
+                 if part not in ('', '.', '..')]
+        if not parts:
+            return
+        target = os.path.join(extract_dir, *parts)
+        if member.is_dir():
+            os.makedirs(target, exist_ok=True)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self.metrics['files'] += 1
+        with zf.open(member) as source:
+            out = open(target, 'wb')
+            try:
+                with out:
+                    size = self._copy_stream(source, out, progress=progress)
+                if size != member.file_size:
+                    raise zipfile.BadZipFile(f"Размер {member.filename} не совпадает с заголовком")
+            except BaseException:
+                os.remove(target)
+                raise
+
     def tar(self, folder, archive):
         try:
-            # Убираем расширение .tar.gz если оно есть
-            archive_name = archive.replace('.tar.gz', '')
-            shutil.make_archive(archive_name, 'gztar', folder)
+            # Расширение .tar.gz добавляется, только если имя им не оканчивается
+            archive_name = archive if archive.endswith('.tar.gz') else archive + '.tar.gz'
+            self._write_tar(self.resolve_path(folder), self.resolve_path(archive_name))
             self.log(f"tar {folder} {archive}")
             return "Архив TAR.GZ создан"
         except Exception as e:
             self.log(f"tar {folder} {archive}", False, str(e))
             return f"Ошибка: {str(e)}"
 
-    def untar(self, archive):
+    def _write_zip(self, root, archive_path):
+        """Архив ZIP с теми же именами, что у shutil.make_archive; файлы читаются через планировщик"""
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f"Not a directory: '{root}'")
         try:
-            with tarfile.open(archive, 'r:gz') as tf:
-                # Используем filter='data' для подавления предупреждения
-                if hasattr(tarfile, 'data_filter'):
-                    tf.extractall(filter='data')
-                else:
-                    tf.extractall()
+            with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for rel, _, _ in walk_tree(LocalFS(), root, with_stat=False):
+                    check_cancelled()
+                    path = os.path.join(root, rel)
+                    if os.path.isdir(path):
+                        zf.write(path, rel)
+                    elif os.path.isfile(path):
+                        info = zipfile.ZipInfo.from_file(path, rel)
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                        with throttled(open(path, 'rb')) as src, zf.open(info, 'w') as dst:
+                            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+                        self.metrics['files'] += 1
+                        self.metrics['bytes_read'] += info.file_size
+        except BaseException:
+            # Недописанный архив не оставляем
+            self._remove_path(archive_path)
+            raise
+
+    def _write_tar(self, root, archive_path):
+        """Архив TAR.GZ с теми же именами, что у shutil.make_archive; файлы читаются через планировщик"""
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f"Not a directory: '{root}'")
+        try:
+            with tarfile.open(archive_path, 'w:gz', copybufsize=COPY_CHUNK_SIZE) as tf:
+                tf.add(root, arcname=os.curdir, recursive=False)
+                for rel, _, _ in walk_tree(LocalFS(), root, with_stat=False):
+                    check_cancelled()
+                    path = os.path.join(root, rel)
+                    info = tf.gettarinfo(path, os.path.join(os.curdir, rel))
+                    if info is None:
+                        # Сокеты и другие файлы, которые tar хранить не умеет, пропускаем, как TarFile.add
+                        continue
+                    if not info.isreg():
+                        tf.addfile(info)
+                        continue
+                    with throttled(open(path, 'rb')) as f:
+                        st = os.fstat(f.fileno())
+                        if is_sparse(st):
+                            # Дыры не записываются: элемент GNU sparse (PAX 1.0) хранит только данные
+                            ranges = data_ranges(f.fileno(), st.st_size)
+                            f = SparseReader(f, sparse_tarinfo(info, ranges), ranges)
+                        tf.addfile(info, f)
+                    self.metrics['files'] += 1
+                    self.metrics['bytes_read'] += info.size
+        except BaseException:
+            # Недописанный архив не оставляем
+            self._remove_path(archive_path)
+            raise
+
+    def untar(self, archive, resume=False, verify=False):
+        extract_dir = self.current_dir
+        checkpoint_path = self._checkpoint_path(os.path.join(extract_dir, os.path.basename(archive)))
+        if resume and not os.path.exists(checkpoint_path):
+            self.log(f"untar {archive}", False, "No checkpoint to resume")
+            return "Ошибка: Нет контрольной точки для продолжения"
+        try:
+            checkpoint = Checkpoint(checkpoint_path, resume)
+            try:
+                with tarfile.open(self.resolve_path(archive), 'r:gz') as tf:
+                    # Распаковываем по одному элементу, чтобы команду можно было
+                    # отменить и продолжить с места остановки
+                    for index, member in enumerate(tf):
+                        check_cancelled()
+                        # Имена в tar могут повторяться, поэтому в журнал идет и позиция
+                        name = f"{index}:{member.name}"
+                        if checkpoint.is_done(name):
+                            continue
+                        # Используем filter='data' для подавления предупреждения и защиты путей
+                        if hasattr(tarfile, 'data_filter'):
+                            member = tarfile.data_filter(member, extract_dir)
+                        if member.isreg():
+                            self._extract_member(tf, member, extract_dir, name, checkpoint)
+                        elif hasattr(tarfile, 'data_filter'):
+                            tf.extract(member, extract_dir, filter='data')
+                        else:
+                            tf.extract(member, extract_dir)
+                        checkpoint.mark_done(name)
+            except BaseException:
+                checkpoint.close()
+                raise
+            checkpoint.close(remove=True)
+            result = "Архив TAR.GZ распакован"
+            if verify:
+                result += f" (проверено файлов: {self._verify_tar(self.resolve_path(archive), extract_dir)})"
             self.log(f"untar {archive}")
-            return "Архив TAR.GZ распакован"
+            return result
         except Exception as e:
             self.log(f"untar {archive}", False, str(e))
             return f"Ошибка: {str(e)}"
 
-    def grep(self, pattern, path, recursive=False, ignore_case=False):
+    @staticmethod
+    def _verify_tar(archive_path, extract_dir):
+        """Сравнивает распакованные файлы с содержимым архива.
+
+        Пока архив читается и хэшируется в этом потоке, распакованные файлы
+        хэшируются параллельно в пуле.
+        """
+        with tarfile.open(archive_path, 'r:gz') as tf:
+            # Элемент с повторяющимся именем перезаписывает прежний, поэтому
+            # сравниваем с последним; порядок остается порядком в архиве
+            latest = {}
+            for member in tf.getmembers():
+                path = os.path.normpath(os.path.join(extract_dir, member.name))
+                latest.pop(path, None)
+                latest[path] = member
+            paths = [path for path, member in latest.items() if member.isreg()]
+            members = [latest[path] for path in paths]
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                extracted = pool.submit(contextvars.copy_context().run, hash_files, paths)
+                expected = [hash_stream(tf.extractfile(member)) for member in members]
+                actual = extracted.result()
+        for path, digest in zip(paths, expected):
+            if actual[path] != digest:
+                raise OSError(f"Контрольная сумма не совпадает с архивом: {path}")
+        return len(paths)
+
+    def _extract_member(self, tf, member, extract_dir, name, checkpoint):
+        """Распаковывает обычный файл блоками, продолжая недописанный файл"""
+        target = os.path.join(extract_dir, member.name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        offset = self._resume_offset(checkpoint, name, target)
+        self.metrics['files'] += 1
+        source = tf.extractfile(member)
+
+        def progress(pos, n):
+            checkpoint.mark_partial(name, pos)
+
+        with open(target, 'r+b' if offset else 'wb', buffering=0) as out:
+            if offset:
+                source.seek(offset)
+                out.seek(offset)
+                out.truncate()
+            if member.sparse is not None:
+                # Разреженный элемент GNU: пишем только участки с данными
+                self._copy_ranges(source, out, member.sparse, member.size, offset, progress)
+            else:
+                self._copy_stream(source, out, offset, progress)
+        if member.mode is not None:
+            os.chmod(target, member.mode & 0o777)
+        os.utime(target, (member.mtime, member.mtime))
+
+    def hash(self, path, algorithm=CHECKSUM_ALGORITHM, manifest=None):
+        """Контрольные суммы файла или всех файлов каталога в формате sha256sum.
+
+        Файлы хэшируются параллельно во всех ядрах. С manifest строки пишутся
+        в файл, а пути в нем - относительно каталога манифеста.
+        """
+        target = self.resolve_path(path)
+        fs = self._fs_for(target)
+        if not fs.exists(target):
+            self.log(f"hash {path}", False, "No such file or directory")
+            return "Ошибка: Путь не существует"
+        manifest_path = self.resolve_path(manifest) if manifest else None
+        try:
+            if fs.isdir(target):
+                files = sorted(os.path.join(root, name)
+                               for root, _, names in fs.walk(target) for name in names)
+            else:
+                files = [target]
+            files = [f for f in files if f != manifest_path]
+            digests = self._hash_in(fs, files, algorithm)
+            self.metrics['files'] += len(files)
+            self.metrics['bytes_read'] += sum(fs.stat(f).st_size for f in files)
+
+            base = os.path.dirname(manifest_path) if manifest_path else self.current_dir
+            lines = [f"{digests[f]}  {os.path.relpath(f, base)}" for f in files]
+            self.log(f"hash {path}")
+            if manifest_path is None:
+                return '\n'.join(lines)
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                f.writelines(line + '\n' for line in lines)
+            return f"Манифест записан: {manifest} (файлов: {len(files)})"
+        except Exception as e:
+            self.log(f"hash {path}", False, str(e))
+            return f"Ошибка: {str(e)}"
+
+    def verify(self, manifest):
+        """Проверяет файлы по манифесту; при расхождениях last_status = 1"""
+        manifest_path = self.resolve_path(manifest)
+        try:
+            with self._fs_for(manifest_path).open(manifest_path, 'r', encoding='utf-8') as f:
+                entries = parse_manifest(f)
+            base = os.path.dirname(manifest_path)
+            paths = [os.path.normpath(os.path.join(base, name)) for _, name, _ in entries]
+            # Файлы хэшируются группами по файловой системе (диск, архивы) и алгоритму
+            groups = {}
+            for path, (_, _, algorithm) in zip(paths, entries):
+                fs = self._fs_for(path)
+                if fs.isfile(path):
+                    groups.setdefault((fs, algorithm), []).append(path)
+            digests = {}
+            for (fs, algorithm), existing in groups.items():
+                for file_path, digest in self._hash_in(fs, existing, algorithm).items():
+                    digests[file_path, algorithm] = digest
+                self.metrics['files'] += len(existing)
+                self.metrics['bytes_read'] += sum(fs.stat(file_path).st_size for file_path in existing)
+        except Exception as e:
+            self.log(f"verify {manifest}", False, str(e))
+            return f"Ошибка: {str(e)}"
+
+        results = []
+        failed = missing = 0
+        for path, (digest, name, algorithm) in zip(paths, entries):
+            actual = digests.get((path, algorithm))
+            if actual is None:
+                missing += 1
+                results.append(f"{name}: НЕТ ФАЙЛА")
+            elif actual != digest:
+                failed += 1
+                results.append(f"{name}: ОШИБКА")
+            else:
+                results.append(f"{name}: OK")
+        self.last_status = 1 if failed or missing else 0
+        self.log(f"verify {manifest}", not self.last_status, f"{failed} failed, {missing} missing")
+        results.append(f"Проверено файлов: {len(entries)}, не совпало: {failed}, отсутствует: {missing}")
+        return '\n'.join(results)
+
+    def diff(self, left, right, recursive=False):
+        """Сравнение двух файлов или деревьев (-r).
+
+        Деревья сканируются параллельно общим обходчиком, по одному разу каждое.
+        Файлы с одинаковыми размером и mtime считаются неизменными, хэшируются
+        только оставшиеся файлы одного размера. В выводе '+' - добавлено,
+        '-' - удалено, 'M' - изменено; last_status 1, если различия есть.
+        """
+        command = f"diff {left} {right}"
+        left_path, right_path = self.resolve_path(left), self.resolve_path(right)
+        left_fs = self._fs_for(left_path, into_archive=recursive)
+        right_fs = self._fs_for(right_path, into_archive=recursive)
+        for fs, path, name in ((left_fs, left_path, left), (right_fs, right_path, right)):
+            if not fs.exists(path):
+                self.log(command, False, "No such file or directory")
+                return f"Ошибка: Путь не существует: {name}"
+
+        try:
+            is_dir = left_fs.isdir(left_path)
+            if is_dir != right_fs.isdir(right_path):
+                raise ValueError("Нельзя сравнить файл с каталогом")
+            if is_dir and not recursive:
+                raise IsADirectoryError("Use -r for directories")
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                futures = [pool.submit(contextvars.copy_context().run, Listing.build, fs, path, True)
+                           for fs, path in ((left_fs, left_path), (right_fs, right_path))]
+                left_index, right_index = [future.result() for future in futures]
+            self.metrics['files'] += len(left_index) + len(right_index)
+
+            changes, candidates, candidate_bytes, links = self._compare_indexes(left_index, right_index)
+            # Ссылки бывают только на локальном диске
+            changes.extend((rel, 'M', False) for rel in links
+                           if os.readlink(self._join(left_path, rel))
+                           != os.readlink(self._join(right_path, rel)))
+            if candidates:
+                left_digests = self._hash_in(left_fs, [self._join(left_path, rel) for rel in candidates])
+                right_digests = self._hash_in(right_fs, [self._join(right_path, rel) for rel in candidates])
+                self.metrics['bytes_read'] += 2 * candidate_bytes
+                changes.extend((rel, 'M', False) for rel in candidates
+                               if left_digests[self._join(left_path, rel)]
+                               != right_digests[self._join(right_path, rel)])
+        except Exception as e:
+            self.log(command, False, str(e))
+            return f"Ошибка: {str(e)}"
+
+        self.log(command)
+        self.last_status = 1 if changes else 0
+        if not changes:
+            return "Различий нет"
+        changes.sort()
+        lines = []
+        for rel, mark, is_dir in changes:
+            name = rel or os.path.basename(right_path)
+            lines.append(f"{mark} {name}/" if is_dir else f"{mark} {name}")
+        counts = {mark: sum(1 for _, m, _ in changes if m == mark) for mark in '+-M'}
+        lines.append(f"Добавлено: {counts['+']}, удалено: {counts['-']}, изменено: {counts['M']} "
+                     f"(сравнено по хэшу: {len(candidates)})")
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _join(root, rel):
+        return os.path.join(root, rel) if rel else root
+
+    @staticmethod
+    def _compare_indexes(left, right):
+        """Различия двух листингов по размеру и mtime и файлы, которые нужно сравнить по хэшу.
+
+        Дети каталога в листинге отсортированы по имени, поэтому каталоги
+        сравниваются слиянием списков детей, без словарей путей. Содержимое
+        добавленных и удаленных каталогов отдельно не перечисляется.
+        Символические ссылки одной длины нужно сравнить по readlink, а не по
+        хэшу: ссылка может вести на каталог. Другие особые файлы (FIFO,
+        сокеты) сравниваются только по типу.
+        Возвращает (изменения (путь, знак, каталог ли), кандидаты, их байты, ссылки).
+        """
+        changes = []
+        candidates = []
+        candidate_bytes = 0
+        links = []
+        pairs = [(0, 0)]
+        while pairs:
+            check_cancelled()
+            li, ri = pairs.pop()
+            mode = left.modes[li]
+            if (stat.S_IFMT(mode) != stat.S_IFMT(right.modes[ri])
+                    or (not left.dirs[li] and left.sizes[li] != right.sizes[ri])):
+                changes.append((left.path(li), 'M', bool(left.dirs[li])))
+            elif stat.S_ISLNK(mode):
+                links.append(left.path(li))
+            elif stat.S_ISREG(mode):
+                if left.mtimes[li] != right.mtimes[ri]:
+                    candidates.append(left.path(li))
+                    candidate_bytes += left.sizes[li]
+            elif left.dirs[li]:
+                left_children, right_children = left.children(li), right.children(ri)
+                i = j = 0
+                while i < len(left_children) or j < len(right_children):
+                    a = left_children[i] if i < len(left_children) else None
+                    b = right_children[j] if j < len(right_children) else None
+                    if b is None or (a is not None and left.names[a] < right.names[b]):
+                        changes.append((left.path(a), '-', bool(left.dirs[a])))
+                        i += 1
+                    elif a is None or right.names[b] < left.names[a]:
+                        changes.append((right.path(b), '+', bool(right.dirs[b])))
+                        j += 1
+                    else:
+                        pairs.append((a, b))
+                        i += 1
+                        j += 1
+        return changes, candidates, candidate_bytes, links
+
+    @staticmethod
+    def _hash_in(fs, paths, algorithm=FAST_ALGORITHM):
+        """Параллельное хэширование файлов любой файловой системы"""
+        if fs.is_local:
+            return hash_files(paths, algorithm)
+
+        def hash_virtual(path, algorithm):
+            with fs.open(path, 'rb') as f:
+                return hash_stream(f, algorithm)
+        return hash_files(paths, algorithm, hasher=hash_virtual)
+
+    def grep(self, pattern, path, recursive=False, ignore_case=False,
+             count=False, files_with_matches=False, quiet=False, max_count=None,
+             before=0, after=0, multiline=False):
+        """Поиск строк по шаблону.
+
+        count - число совпадений в каждом файле, files_with_matches - только имена
+        файлов (чтение файла прекращается на первом совпадении), quiet - без вывода,
+        поиск прекращается на первом совпадении, результат в last_status (0 - найдено),
+        max_count - не больше N совпадений в каждом файле.
+        before/after - строки контекста до и после совпадения, multiline - шаблон
+        ищется по тексту целиком и может захватывать несколько строк.
+        """
         target = self.resolve_path(path)
+        # grep -r по пути архива ищет внутри архива
+        fs = self._fs_for(target, into_archive=recursive)
         results = []
 
         flags = re.IGNORECASE if ignore_case else 0
+        if multiline:
+            flags |= re.MULTILINE
+        hits = compile_pattern.cache_info().hits
+        try:
+            regex = compile_pattern(pattern, flags)
+        except re.error as e:
+            self.log(f"grep {pattern} {path}", False, str(e))
+            return f"Ошибка: {str(e)}"
+        self.metrics['cache_hits'] += compile_pattern.cache_info().hits - hits
+        # Строки совпадений форматируются только в обычном режиме вывода
+        stop_at_first = quiet or files_with_matches
+        print_lines = not (count or stop_at_first)
+        with_context = print_lines and (before or after)
+
+        def scan_lines(f, name, search, decode):
+            """Построчный поиск; контекст до совпадения хранится в кольцевом буфере"""
+            matches = 0
+            previous = deque(maxlen=before)
+            after_left = 0
+            last_printed = 0
+
+            def emit(i, line, sep):
+                nonlocal last_printed
+                if with_context and last_printed and i > last_printed + 1:
+                    results.append("--")
+                # Обрезаем длинные строки для читаемости
+                results.append(f"{name}{sep}{i}{sep} {decode(line).strip()[:100]}")
+                last_printed = i
+
+            for i, line in enumerate(f, 1):
+                if not i & 0x3ff:
+                    check_cancelled()
+                if max_count is not None and matches >= max_count:
+                    # После последнего совпадения выводим только оставшийся контекст
+                    if not after_left:
+                        break
+                    emit(i, line, '-')
+                    after_left -= 1
+                    continue
+                if search(line) is None:
+                    if after_left:
+                        emit(i, line, '-')
+                        after_left -= 1
+                    elif before:
+                        previous.append((i, line))
+                    continue
+                matches += 1
+                if stop_at_first:
+                    break
+                if print_lines:
+                    for j, context_line in previous:
+                        emit(j, context_line, '-')
+                    previous.clear()
+                    emit(i, line, ':')
+                    after_left = after
+            return matches
+
+        def scan_multiline(read, name, regex, decode, newline):
+            """Поиск по блокам текста: совпадение может занимать несколько строк.
+
+            Хвост блока длиной MULTILINE_OVERLAP переносится в следующий блок,
+            поэтому совпадения на границе блоков не теряются. Перед местом, с
+            которого продолжается поиск, в буфере остается один символ: по нему
+            ^ и \\b понимают, начало ли это строки, как при поиске по всему файлу.
+            """
+            if max_count is not None and max_count <= 0:
+                return 0
+            matches = 0
+            buffer = newline[:0]
+            start = 0
+            line_no = 1
+            while True:
+                check_cancelled()
+                chunk = read(MULTILINE_CHUNK_SIZE)
+                eof = not chunk
+                buffer += chunk
+                limit = len(buffer) if eof else len(buffer) - MULTILINE_OVERLAP
+                counted = end = start
+                for m in regex.finditer(buffer, start):
+                    if m.start() >= limit:
+                        break
+                    if m.start() == m.end():
+                        continue
+                    line_no += buffer.count(newline, counted, m.start())
+                    counted = m.start()
+                    end = m.end()
+                    matches += 1
+                    if stop_at_first:
+                        return matches
+                    if print_lines:
+                        text = decode(m.group()).strip().replace('\n', '\\n')[:100]
+                        results.append(f"{name}:{line_no}: {text}")
+                    if max_count is not None and matches >= max_count:
+                        return matches
+                if eof:
+                    return matches
+                cut = max(start, limit, end)
+                line_no += buffer.count(newline, counted, cut)
+                if cut:
+                    buffer = buffer[cut - 1:]
+                    start = 1
 
         def search_in_file(file_path):
+            matches = 0
+            name = os.path.basename(file_path)
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for i, line in enumerate(f, 1):
-                        if re.search(pattern, line, flags):
-                            # Обрезаем длинные строки для читаемости
-                            line_display = line.strip()[:100]
-                            results.append(f"{os.path.basename(file_path)}:{i}: {line_display}")
-            except:
+                with throttled(fs.open(file_path, 'rb')) as raw:
+                    detected = sniff_file(raw)
+                    if detected is None:
+                        # Двоичные файлы пропускаем по первому блоку
+                        return 0
+                    self.metrics['files'] += 1
+                    self.metrics['bytes_read'] += fs.stat(file_path).st_size
+                    encoding = detected[0]
+                    raw_pattern = bytes_pattern(pattern, encoding, ignore_case)
+                    if raw_pattern is not None:
+                        # Ищем прямо в байтах, декодируем только найденные строки
+                        file_regex = compile_pattern(raw_pattern, flags)
+                        f = raw
+                        newline = b'\n'
+
+                        def decode(data):
+                            return data.decode(encoding, errors='replace')
+
+                        # Как в текстовом режиме, \r\n считается одним \n, иначе $ и \s
+                        # на строках с окончаниями Windows ведут себя иначе
+                        def search(line):
+                            if line.endswith(b'\r\n'):
+                                line = line[:-2] + b'\n'
+                            return file_regex.search(line)
+
+                        def read(size):
+                            chunk = raw.read(size)
+                            if chunk.endswith(b'\r'):
+                                chunk += raw.read(1)
+                            return chunk.replace(b'\r\n', b'\n')
+                    else:
+                        file_regex = regex
+                        f = io.TextIOWrapper(raw, encoding=encoding, errors='replace')
+                        newline = '\n'
+                        search, read = file_regex.search, f.read
+
+                        def decode(text):
+                            return text
+                    if multiline:
+                        matches = scan_multiline(read, name, file_regex, decode, newline)
+                    else:
+                        matches = scan_lines(f, name, search, decode)
+            except Exception:
                 pass
-
-        if os.path.isfile(target):
-            search_in_file(target)
-        elif recursive and os.path.isdir(target):
-            for root, dirs, files in os.walk(target):
-                for file in files:
-                    search_in_file(os.path.join(root, file))
+            if count:
+                results.append(f"{name}:{matches}")
+            elif files_with_matches and matches:
+                results.append(name)
+            return matches
+
+        def search_tree():
+            for rel, is_dir, _ in walk_tree(fs, target, with_stat=False):
+                check_cancelled()
+                if not is_dir and search_in_file(os.path.join(target, rel)) and quiet:
+                    return True
+            return False
+
+        if fs.isfile(target):
+            found = search_in_file(target) > 0
+        elif recursive and fs.isdir(target):
+            found = search_tree()
         else:
-            return "Совпадений не найдено"
+            self.last_status = 1
+            return "" if quiet else "Совпадений не найдено"
 
+        self.last_status = 0 if found or results else 1
         self.log(f"grep {pattern} {path}")
+        if quiet:
+            return ""
         return '\n'.join(results) if results else "Совпадений не найдено"
 
-
-def main():
-    shell = MiniShell()
+    def jobs_list(self):
+        """Список фоновых задач"""
+        if self._jobs is None or not self._jobs.jobs:
+            return "Нет фоновых задач"
+        return '\n'.join(f"[{job.id}] {job.status}  {job.command}"
+                         for job in self._jobs.jobs.values())
+
+    def kill(self, spec):
+        job = self._jobs.get(spec) if self._jobs is not None else None
+        if job is None:
+            return f"Ошибка: Нет задачи {spec}"
+        job.cancel()
+        return f"[{job.id}] Отменяется  {job.command}"
+
+    def execute(self, line):
+        """Выполняет строку команды и возвращает ее вывод.
+
+        Префикс `time` добавляет к выводу время выполнения, а в режиме
+        профилирования к выводу прикладывается статистика cProfile/tracemalloc.
+        Пик памяти отсчитывается от начала команды, но считается по всему
+        процессу, поэтому включает и одновременно работающие фоновые задачи.
+        Метрики каждой команды пишутся в лог JSON-строкой.
+        """
+        line = line.strip()
+        timed = False
+        if line.startswith('time '):
+            timed = True
+            line = line[len('time '):].strip()
+        if not line:
+            return ""
+        try:
+            scheduler, line = self._io_scheduler(line)
+        except ValueError as e:
+            return f"Ошибка: {e}"
+
+        self.metrics = new_metrics()
+        extra = {}
+        profiler = None
+        if self.profile:
+            profiler = cProfile.Profile()
+            tracemalloc.reset_peak()
+            memory_before, _ = tracemalloc.get_traced_memory()
+            profiler.enable()
+
+        start = self._local.command_start = time.perf_counter()
+        try:
+            if scheduler is None:
+                output = self._dispatch(line)
+            else:
+                metrics = self.metrics
+
+                def dispatch():
+                    # С --nice команда выполняется в своем потоке, а состояние команды у потоков свое
+                    self.metrics = metrics
+                    self._local.command_start = start
+                    return self._dispatch(line)
+                output = scheduler.run(dispatch)
+        except CommandCancelled:
+            self.log(line, False, "Cancelled")
+            output = "Команда отменена"
+        finally:
+            wall_time = time.perf_counter() - start
+            self._local.command_start = None
+            if profiler is not None:
+                profiler.disable()
+                _, peak = tracemalloc.get_traced_memory()
+                extra['peak_memory'] = max(peak - memory_before, 0)
+            if scheduler is not None:
+                extra['io_wait'] = round(scheduler.waited, 6)
+            self.log_metrics(line, wall_time, extra)
+
+        if profiler is not None:
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            output += f"\n--- profile ---\npeak memory: {extra['peak_memory']} bytes\n{stream.getvalue()}"
+        if timed:
+            m = self.metrics
+            output += (f"\nreal {wall_time:.3f}s  files {m['files']}  "
+                       f"read {m['bytes_read']}B  written {m['bytes_written']}B  "
+                       f"cache hits {m['cache_hits']}")
+        return output
+
+    @staticmethod
+    def _parse_grep_args(args):
+        """Разбирает флаги grep (в том числе слитные, например -ri); None - ошибка разбора"""
+        names = {'r': 'recursive', 'i': 'ignore_case', 'c': 'count',
+                 'l': 'files_with_matches', 'q': 'quiet', 'U': 'multiline'}
+        with_value = {'-m': ('max_count',), '-A': ('after',), '-B': ('before',),
+                      '-C': ('before', 'after')}
+        options = {}
+        clean_args = []
+        args = iter(args)
+        for arg in args:
+            if arg == '--':
+                # Все дальше - шаблон и пути, даже если начинаются с '-'
+                clean_args.extend(args)
+            elif arg in with_value:
+                value = next(args, '')
+                if not value.isdigit():
+                    return None, []
+                for option in with_value[arg]:
+                    options[option] = int(value)
+            elif arg.startswith('-') and len(arg) > 1 and all(c in names for c in arg[1:]):
+                for c in arg[1:]:
+                    options[names[c]] = True
+            else:
+                clean_args.append(arg)
+        return options, clean_args
+
+    @staticmethod
+    def _io_scheduler(line):
+        """Забирает из строки --bwlimit, --iops и --nice: (планировщик или None, строка без них).
+
+        Опции берутся только среди флагов до первого позиционного аргумента
+        и до '--', поэтому шаблон grep или файл с таким именем не пострадают.
+        """
+        parts = line.split()
+        options = {}
+        i = 1
+        while i < len(parts) and parts[i].startswith('-') and parts[i] != '--':
+            if parts[i] in ('--bwlimit', '--iops', '--nice'):
+                if i + 1 == len(parts):
+                    raise ValueError(f"Не задано значение {parts[i]}")
+                options[parts[i]] = parts[i + 1]
+                del parts[i:i + 2]
+            else:
+                i += 1
+        if not options:
+            return None, line
+        try:
+            bwlimit = parse_size(options['--bwlimit']) if '--bwlimit' in options else None
+            iops = parse_size(options['--iops']) if '--iops' in options else None
+            nice = int(options.get('--nice', 0))
+        except ValueError:
+            raise ValueError("Неверное значение --bwlimit, --iops или --nice")
+        if not 0 <= nice <= 19:
+            raise ValueError("--nice должно быть от 0 до 19")
+        return IOScheduler(bwlimit, iops, nice), ' '.join(parts)
+
+    def _dispatch(self, line):
+        """Разбирает строку и вызывает соответствующую команду"""
+        parts = line.split()
+        command = parts[0]
+        args = parts[1:]
+
+        if command == 'ls':
+            flags = ''.join(a[1:] for a in args if a.startswith('-'))
+            if set(flags) - set('lStr'):
+                return "Использование: ls [-l] [-S|-t] [-r] [путь]"
+            path_args = [a for a in args if not a.startswith('-')]
+            path = path_args[0] if path_args else "."
+            sort = 'size' if 'S' in flags else 'mtime' if 't' in flags else None
+            return self.ls(path, 'l' in flags, sort, 'r' in flags)
+
+        elif command == 'cd':
+            path = args[0] if args else "~"
+            return self.cd(path)
+
+        elif command == 'cat':
+            if args:
+                return self.cat(args[0])
+            return "Использование: cat <файл>"
+
+        elif command == 'cp':
+            recursive = '-r' in args
+            resume = '--resume' in args
+            dedupe = '--dedupe' in args
+            verify = '--verify' in args
+            src_dst = [a for a in args if a not in ('-r', '--resume', '--dedupe', '--verify')]
+            if len(src_dst) >= 2:
+                return self.cp(src_dst[0], src_dst[1], recursive, resume, dedupe, verify)
+            return "Использование: cp [-r] [--resume] [--dedupe] [--verify] <источник> <назначение>"
+
+        elif command == 'mv':
+            if len(args) == 2:
+                return self.mv(args[0], args[1])
+            return "Использование: mv <источник> <назначение>"
+
+        elif command == 'rm':
+            flags = ''.join(a[1:] for a in args if a.startswith('-') and not a.startswith('--'))
+            purge = '--purge' in args
+            targets = [a for a in args if not a.startswith('-')]
+            if targets:
+                return self.rm(targets[0], 'r' in flags, 'f' in flags, purge)
+            if purge:
+                return self.purge_trash()
+            return "Использование: rm [-r] [-f] [--purge] <файл/каталог>"
+
+        elif command == 'history':
+            n = int(args[0]) if args and args[0].isdigit() else 10
+            return self.history(n)
+
+        elif command == 'undo':
+            return self.undo()
+
+        # Плагины
+        elif command == 'zip' and len(args) == 2:
+            return self.zip(args[0], args[1])
+
+        elif command == 'unzip' and args:
+            return self.unzip(args[0])
+
+        elif command == 'tar' and len(args) == 2:
+            return self.tar(args[0], args[1])
+
+        elif command == 'untar' and args:
+            archives = [a for a in args if a not in ('--resume', '--verify')]
+            if archives:
+                return self.untar(archives[0], '--resume' in args, '--verify' in args)
+            return "Использование: untar [--resume] [--verify] <архив.tar.gz>"
+
+        elif command == 'grep' and len(args) >= 2:
+            options, clean_args = self._parse_grep_args(args)
+            if options is None or len(clean_args) < 2:
+                return ("Использование: grep [-r] [-i] [-U] [-c|-l|-q] [-m N] "
+                        "[-A N] [-B N] [-C N] <шаблон> <путь>")
+            return self.grep(clean_args[0], clean_args[1], **options)
+
+        elif command == 'hash':
+            options = {}
+            paths = []
+            it = iter(args)
+            for arg in it:
+                if arg in ('-a', '-o'):
+                    options[arg] = next(it, None)
+                else:
+                    paths.append(arg)
+            if paths and None not in options.values():
+                return self.hash(paths[0], options.get('-a', CHECKSUM_ALGORITHM), options.get('-o'))
+            return "Использование: hash [-a алгоритм] [-o манифест] <путь>"
+
+        elif command == 'verify':
+            if args:
+                return self.verify(args[0])
+            return "Использование: verify <манифест>"
+
+        elif command == 'diff':
+            paths = [a for a in args if a != '-r']
+            if len(paths) == 2:
+                return self.diff(paths[0], paths[1], '-r' in args)
+            return "Использование: diff [-r] <путь1> <путь2>"
+
+        elif command == 'tail':
+            lines = TAIL_LINES
+            paths = []
+            it = iter(args)
+            for arg in it:
+                if arg == '-n':
+                    value = next(it, '')
+                    if not value.isdigit():
+                        return "Использование: tail [-n N] [-f] <файл>"
+                    lines = int(value)
+                elif arg != '-f':
+                    paths.append(arg)
+            if paths:
+                return self.tail(paths[0], lines, '-f' in args)
+            return "Использование: tail [-n N] [-f] <файл>"
+
+        elif command == 'watch':
+            if args:
+                return self.watch(args[0])
+            return "Использование: watch <каталог>"
+
+        elif command == 'stats':
+            kind = next((a for a in args if a in ('top', 'errors', 'slow')), None)
+            counts = [a for a in args if a.isdigit()]
+            if len(args) == (kind is not None) + len(counts) and len(counts) <= 1:
+                return self.stats(kind, int(counts[0]) if counts else STATS_TOP)
+            return "Использование: stats [top|errors|slow] [N]"
+
+        elif command == 'snapshot':
+            if args:
+                return self.snapshot(args[0])
+            return "Использование: snapshot <каталог>"
+
+        elif command == 'restore':
+            if args:
+                return self.restore(args[0])
+            return "Использование: restore <снимок или каталог>"
+
+        elif command == 'jobs':
+            return self.jobs_list()
+
+        elif command == 'kill':
+            if args:
+                return self.kill(args[0])
+            return "Использование: kill %<номер>"
+
+        elif command == 'help':
+            return HELP_TEXT
+
+        return f"Неизвестная команда: {command}"
+
+
+def wait_foreground(shell, job):
+    """Ждет задачу переднего плана; Ctrl+C отменяет только ее"""
+    try:
+        return shell.jobs.wait(job)
+    except KeyboardInterrupt:
+        job.cancel()
+        print("^C")
+        return shell.jobs.wait(job)
+
+
+def report_finished_jobs(shell):
+    if shell._jobs is None:
+        return
+    for job in shell.jobs.reap():
+        print(f"[{job.id}] {job.status}  {job.command}")
+        try:
+            output = job.result()
+        except CommandCancelled:
+            continue
+        if output:
+            print(output)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    log_format = 'text'
+    if '--log-format' in argv:
+        i = argv.index('--log-format')
+        log_format = argv[i + 1] if i + 1 < len(argv) else ''
+    try:
+        shell = MiniShell(profile='--profile' in argv, log_format=log_format, history_file='.history')
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        return
+    recovered = shell.recover_moves()
+    if recovered:
+        print(f"Восстановлено прерванных перемещений: {recovered}")
+    if '--serve' in argv:
+        # Сервер импортирует MiniShell, поэтому подключается только здесь
+        from server import serve
+        i = argv.index('--socket') if '--socket' in argv else -1
+        serve(shell, argv[i + 1] if 0 <= i < len(argv) - 1 else SERVER_SOCKET)
+        shell.close()
+        return
+    completion.install(shell)
     print("Мини-оболочка на Python. Введите 'help' для справки, 'exit' для выхода")
 
     while True:
         try:
+            report_finished_jobs(shell)
             cmd = input(f"{shell.current_dir} $ ").strip()
             if not cmd:
                 continue
             if cmd == 'exit':
                 break
 
-            parts = cmd.split()
-            command = parts[0]
-            args = parts[1:]
-
-            if command == 'ls':
-                detailed = '-l' in args
-                path_args = [a for a in args if a != '-l']
-                path = path_args[0] if path_args else "."
-                print(shell.ls(path, detailed))
-
-            elif command == 'cd':
-                path = args[0] if args else "~"
-                print(shell.cd(path))
-
-            elif command == 'cat':
-                if args:
-                    print(shell.cat(args[0]))
-                else:
-                    print("Использование: cat <файл>")
-
-            elif command == 'cp':
-                if len(args) >= 2:
-                    recursive = '-r' in args
-                    src_dst = [a for a in args if a != '-r']
-                    print(shell.cp(src_dst[0], src_dst[1], recursive))
-                else:
-                    print("Использование: cp [-r] <источник> <назначение>")
-
-            elif command == 'mv':
-                if len(args) == 2:
-                    print(shell.mv(args[0], args[1]))
-                else:
-                    print("Использование: mv <источник> <назначение>")
-
-            elif command == 'rm':
-                if args:
-                    recursive = '-r' in args
-                    target = args[1] if '-r' in args else args[0]
-                    print(shell.rm(target, recursive))
-                else:
-                    print("Использование: rm [-r] <файл/каталог>")
-
-            elif command == 'history':
-                n = int(args[0]) if args and args[0].isdigit() else 10
-                print(shell.history(n))
-
-            elif command == 'undo':
-                print(shell.undo())
-
-            # Плагины
-            elif command == 'zip' and len(args) == 2:
-                print(shell.zip(args[0], args[1]))
-
-            elif command == 'unzip' and args:
-                print(shell.unzip(args[0]))
-
-            elif command == 'tar' and len(args) == 2:
-                print(shell.tar(args[0], args[1]))
-
-            elif command == 'untar' and args:
-                print(shell.untar(args[0]))
-
-            elif command == 'grep' and len(args) >= 2:
-                recursive = '-r' in args
-                ignore_case = '-i' in args
-                clean_args = [a for a in args if a not in ['-r', '-i']]
-                print(shell.grep(clean_args[0], clean_args[1], recursive, ignore_case))
-
-            elif command == 'help':
-                print("""
-Доступные команды:
-  ls [-l] [путь]          - список файлов
-  cd [путь]              - смена каталога (.., ~)
-  cat <файл>             - вывод файла
-  cp [-r] <src> <dst>    - копирование
-  mv <src> <dst>         - перемещение/переименование
-  rm [-r] <путь>         - удаление
-
-Плагины:
-  zip <папка> <архив.zip>   - создать ZIP архив
-  unzip <архив.zip>         - распаковать ZIP
-  tar <папка> <архив.tar.gz> - создать TAR.GZ архив
-  untar <архив.tar.gz>      - распаковать TAR.GZ
-  grep [-r] [-i] <шаблон> <путь> - поиск в файлах
-
-Утилиты:
-  history [N]            - показать последние N команд
-  undo                   - отменить последнюю команду
-  help                   - эта справка
-  exit                   - выход из оболочки
-""")
+            if cmd.endswith('&'):
+                job = shell.jobs.submit(cmd[:-1].strip(), background=True)
+                print(f"[{job.id}] {job.command}")
+                continue
 
+            if cmd.split()[0] == 'fg':
+                spec = cmd.split()[1] if len(cmd.split()) > 1 else ''
+                job = shell.jobs.get(spec) if shell.jobs.jobs else None
+                if job is None:
+                    print(f"Ошибка: Нет задачи {spec}")
+                    continue
+                shell.jobs.remove(job)
+                print(job.command)
             else:
-                print(f"Неизвестная команда: {command}")
+                job = shell.jobs.submit(cmd)
+            print(wait_foreground(shell, job))
 
         except KeyboardInterrupt:
+            # Ctrl+C в приглашении не завершает оболочку
+            print()
+        except EOFError:
             print("\nВыход...")
             break
         except Exception as e:
             print(f"Ошибка: {e}")
 
+    shell.close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import PURGE_WORKERS, PURGE_FANOUT, PURGE_MAX_DEPTH
+
+# Удаление относительно дескрипторов каталогов (unlinkat) доступно не везде
+_SUPPORTS_FD = (os.scandir in os.supports_fd and os.unlink in os.supports_dir_fd
+                and os.rmdir in os.supports_dir_fd)
+
+
+def _remove_tree(path, dir_fd=None):
+    """Удаляет дерево через openat/unlinkat: без повторного разбора полных путей"""
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | getattr(os, 'O_NOFOLLOW', 0), dir_fd=dir_fd)
+    try:
+        subdirs = []
+        with os.scandir(fd) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    os.unlink(entry.name, dir_fd=fd)
+        for name in subdirs:
+            _remove_tree(name, fd)
+    finally:
+        os.close(fd)
+    os.rmdir(path, dir_fd=dir_fd)
+
+
+def purge_tree(path, pool=None):
+    """Удаляет дерево, распределяя поддеревья по потокам пула.
+
+    Верхние уровни раскрываются, пока не наберется PURGE_FANOUT поддеревьев,
+    затем они удаляются параллельно, а раскрытые каталоги - в конце.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.unlink(path)
+        return
+    if not _SUPPORTS_FD or pool is None:
+        shutil.rmtree(path)
+        return
+
+    expanded = []
+    frontier = [path]
+    for _ in range(PURGE_MAX_DEPTH):
+        if not frontier or len(frontier) >= PURGE_FANOUT:
+            break
+        next_frontier = []
+        for directory in frontier:
+            expanded.append(directory)
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        next_frontier.append(entry.path)
+                    else:
+                        os.unlink(entry.path)
+        frontier = next_frontier
+
+    for _ in pool.map(_remove_tree, frontier):
+        pass
+    for directory in reversed(expanded):
+        os.rmdir(directory)
+
+
+class Purger:
+    """Фоновое удаление больших деревьев, не блокирующее приглашение оболочки"""
+
+    def __init__(self, workers=PURGE_WORKERS):
+        self._coordinator = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purger")
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="purger-worker")
+        self._futures = []
+
+    def submit(self, path, on_error=None):
+        future = self._coordinator.submit(purge_tree, path, self._workers)
+        if on_error is not None:
+            future.add_done_callback(lambda f: f.exception() and on_error(path, f.exception()))
+        self._futures = [f for f in self._futures if not f.done()] + [future]
+        return future
+
+    def pending(self):
+        return sum(1 for f in self._futures if not f.done())
+
+    def close(self):
+        """Дожидается завершения начатых удалений"""
+        self._coordinator.shutdown(wait=True)
+        self._workers.shutdown(wait=True)
@@ -0,0 +1,122 @@
+import errno
+import json
+import os
+import socket
+import socketserver
+import stat
+
+from main import MiniShell
+
+
+def _refuse(prompt):
+    """Подтверждения у клиента запросить нельзя: рекурсивное удаление только с -f"""
+    return 'n'
+
+
+class _SessionHandler(socketserver.StreamRequestHandler):
+    """Одно соединение - одна сессия; запросы и ответы - JSON-строки"""
+
+    def handle(self):
+        shell = None
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                    command = request['command']
+                except (ValueError, KeyError, TypeError) as e:
+                    self._reply({'output': f"Ошибка: Неверный запрос: {e}", 'status': 2})
+                    continue
+                if shell is None:
+                    shell = self.server.new_session(request.get('cwd'))
+                if command.strip() == 'exit':
+                    break
+                shell.last_status = 0
+                output = shell.execute(command)
+                status = 1 if output.startswith("Ошибка") else shell.last_status
+                self._reply({'output': output, 'status': status, 'cwd': shell.current_dir})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            if shell is not None:
+                shell.close()
+
+    def _reply(self, response):
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class ShellServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Сервер оболочки на Unix-сокете.
+
+    Процесс, импорты и общие кэши (шаблоны grep, писатель лога) остаются
+    прогретыми, поэтому клиент платит только за соединение и саму команду.
+    Каждое соединение получает свою сессию с каталогом клиента; открытые
+    архивы (cd archive.zip) кэшируются в сессии и живут до конца соединения.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, engine):
+        self.engine = engine
+        self._remove_stale_socket(path)
+        # Сокет сразу создается с правами 0600: после bind нет момента, когда
+        # к нему могут подключиться другие пользователи
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, _SessionHandler)
+        finally:
+            os.umask(umask)
+
+    @staticmethod
+    def _remove_stale_socket(path):
+        """Удаляет сокет, оставшийся от завершившегося сервера; другие файлы и живой сервер не трогает"""
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(st.st_mode):
+            raise FileExistsError(errno.EEXIST, "Путь занят и не является сокетом", path)
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, "Сервер уже слушает этот сокет", path)
+
+    def new_session(self, cwd=None):
+        """Сессия соединения с прогретыми ФС и логом движка.
+
+        История у сессии своя и хранится в памяти, поэтому history и undo
+        не видят команды других клиентов. Бесконечные tail -f и watch
+        отклоняются: ответ приходит после завершения команды, а прервать
+        ее клиент не может.
+        """
+        engine = self.engine
+        session = MiniShell(profile=engine.profile, log_format=engine.log_format, fs=engine.fs,
+                            state_dir=engine.state_dir, cwd=cwd or engine.current_dir,
+                            confirm=_refuse)
+        session.output_stream = None
+        return session
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def serve(engine, path):
+    """Обслуживает клиентов до Ctrl+C"""
+    try:
+        server = ShellServer(path, engine)
+    except OSError as e:
+        print(f"Ошибка: {e}")
+        return
+    with server:
+        print(f"Сервер оболочки слушает {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nСервер остановлен")
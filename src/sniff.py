@@ -0,0 +1,82 @@
+import codecs
+import re
+
+from constants import SNIFF_SIZE, FALLBACK_ENCODING
+
+# UTF-32 проверяется раньше UTF-16: BOM UTF-32-LE начинается с BOM UTF-16-LE
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Конструкции регулярных выражений, которые в байтовом шаблоне работают
+# только с ASCII и поэтому дают другой результат на кириллице
+_UNICODE_SENSITIVE = re.compile(r'\\[wWbB]')
+# В UTF-8 символ может занимать несколько байт: точка, отрицательный класс
+# и классы \s, \d, \S, \D съели бы только часть символа
+_MULTIBYTE_SENSITIVE = re.compile(r'\.|\[\^|\\[wWbBsSdD]')
+
+
+def _utf16_without_bom(head):
+    """Текст UTF-16 без BOM: старшие байты символов принимают всего несколько значений"""
+    head = head[:len(head) - len(head) % 2]
+    for encoding, high, low in (('utf-16-le', head[1::2], head[0::2]),
+                                ('utf-16-be', head[0::2], head[1::2])):
+        # В тексте нулевые только старшие байты, младшие байты нулей не содержат
+        if 0 in high and 0 not in low and len(set(high)) <= 3:
+            try:
+                head.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+            return encoding
+    return None
+
+
+def detect_encoding(head):
+    """Определяет кодировку по первому блоку файла.
+
+    Возвращает (кодировка, число байт BOM, которые нужно пропустить) или
+    None для двоичного файла (в первом блоке есть нулевые байты).
+    """
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            # Кодеки utf-16/utf-32 сами разбирают BOM, для UTF-8 его пропускаем
+            return encoding, len(bom) if encoding == 'utf-8' else 0
+    if b'\0' in head:
+        encoding = _utf16_without_bom(head)
+        return (encoding, 0) if encoding else None
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Блок мог оборваться посреди многобайтового символа
+        if not (e.reason == 'unexpected end of data' and e.start >= len(head) - 3):
+            return FALLBACK_ENCODING, 0
+    return 'utf-8', 0
+
+
+def sniff_file(f):
+    """Определяет кодировку открытого в двоичном режиме файла и переходит к началу текста"""
+    head = f.read(SNIFF_SIZE)
+    detected = detect_encoding(head)
+    if detected is not None:
+        f.seek(detected[1])
+    return detected
+
+
+def bytes_pattern(pattern, encoding, ignore_case):
+    """Байтовый шаблон для поиска без декодирования файла или None, если так искать нельзя"""
+    if encoding == 'utf-8':
+        if not pattern.isascii() or _MULTIBYTE_SENSITIVE.search(pattern):
+            return None
+    elif encoding == FALLBACK_ENCODING:
+        if _UNICODE_SENSITIVE.search(pattern) or (ignore_case and not pattern.isascii()):
+            return None
+    else:
+        return None
+    try:
+        return pattern.encode(encoding)
+    except UnicodeEncodeError:
+        return None
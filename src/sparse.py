@@ -0,0 +1,96 @@
+import errno
+import os
+import tarfile
+
+# Каталог, в который GNU tar помещает имя разреженного элемента в формате PAX 1.0
+_SPARSE_DIR = 'GNUSparseFile.0'
+
+
+def is_sparse(st):
+    """Есть ли в файле дыры: на диске занято меньше места, чем его размер"""
+    return hasattr(os, 'SEEK_DATA') and hasattr(st, 'st_blocks') and st.st_blocks * 512 < st.st_size
+
+
+def data_ranges(fd, size):
+    """Участки файла с данными: список (смещение, длина) по SEEK_DATA/SEEK_HOLE"""
+    ranges = []
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            # За последним участком данных только дыра
+            if e.errno == errno.ENXIO:
+                break
+            raise
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        ranges.append((start, end - start))
+        pos = end
+    return ranges
+
+
+def data_size(path):
+    """Сколько байт займут данные файла при копировании: у разреженного - без дыр"""
+    st = os.stat(path)
+    if is_sparse(st):
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                return sum(length for _, length in data_ranges(f.fileno(), st.st_size))
+        except OSError:
+            pass
+    return st.st_size
+
+
+def sparse_tarinfo(info, ranges):
+    """Превращает элемент tar в разреженный элемент GNU (PAX 1.0).
+
+    Возвращает карту участков, которую нужно записать в начало данных элемента
+    перед самими участками; info.size становится размером этих данных.
+    """
+    if not ranges or sum(ranges[-1]) < info.size:
+        # Как у GNU tar: файл, который кончается дырой, завершает карта (размер, 0)
+        ranges = ranges + [(info.size, 0)]
+    numbers = [len(ranges)] + [n for pair in ranges for n in pair]
+    sparse_map = ''.join(f"{n}\n" for n in numbers).encode('ascii')
+    sparse_map += b'\0' * (-len(sparse_map) % tarfile.BLOCKSIZE)
+    directory, name = os.path.split(info.name)
+    info.pax_headers = dict(info.pax_headers, **{
+        'GNU.sparse.major': '1',
+        'GNU.sparse.minor': '0',
+        'GNU.sparse.name': info.name,
+        'GNU.sparse.realsize': str(info.size),
+    })
+    info.name = os.path.join(directory, _SPARSE_DIR, name)
+    info.size = len(sparse_map) + sum(length for _, length in ranges)
+    return sparse_map
+
+
+class SparseReader:
+    """Данные разреженного элемента tar: карта участков, затем сами участки файла f"""
+
+    def __init__(self, f, sparse_map, ranges):
+        self._f = f
+        self._head = sparse_map
+        self._ranges = iter(ranges)
+        self._left = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size:
+            if self._head:
+                part = self._head if size < 0 else self._head[:size]
+                self._head = self._head[len(part):]
+            else:
+                if not self._left:
+                    offset, self._left = next(self._ranges, (None, 0))
+                    if offset is None:
+                        break
+                    self._f.seek(offset)
+                part = self._f.read(self._left if size < 0 else min(size, self._left))
+                if not part:
+                    raise EOFError("Файл уменьшился во время архивации")
+                self._left -= len(part)
+            parts.append(part)
+            if size > 0:
+                size -= len(part)
+        return b''.join(parts)
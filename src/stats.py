@@ -0,0 +1,128 @@
+import heapq
+import json
+import os
+import threading
+
+from constants import STATS_MAX_COMMANDS, STATS_KEEP_SLOWEST, STATS_CHUNK_SIZE
+
+# Сколько байт перед сохраненным смещением запомнить, чтобы заметить,
+# что файл лога был заменен или переписан
+_FINGERPRINT_SIZE = 64
+
+
+class LogStats:
+    """Сводка по shell.log в ограниченной памяти.
+
+    commands: имя команды -> [выполнений, ошибок], не больше STATS_MAX_COMMANDS
+    имен (при переполнении вытесняется самая редкая, как в алгоритме
+    Space-Saving); slowest: куча из STATS_KEEP_SLOWEST самых долгих команд.
+    """
+
+    def __init__(self, commands=None, slowest=None, last=None):
+        self.commands = commands or {}
+        self.slowest = slowest or []
+        # Последняя команда текстового лога: к ней относится следующая строка ERROR
+        self.last = last
+
+    def _entry(self, name):
+        entry = self.commands.get(name)
+        if entry is None:
+            count = 0
+            if len(self.commands) >= STATS_MAX_COMMANDS:
+                rarest = min(self.commands, key=lambda key: self.commands[key][0])
+                count = self.commands.pop(rarest)[0]
+            entry = self.commands[name] = [count, 0]
+        return entry
+
+    def feed(self, line):
+        """Учитывает одну строку лога (текстовую, JSON-запись или метрики)"""
+        if line.startswith('{'):
+            try:
+                record = json.loads(line)
+                command = record['command']
+            except (ValueError, KeyError, TypeError):
+                return
+            if 'wall_time' in record:
+                # Метрики пишутся ровно один раз на каждую выполненную команду
+                words = command.split()
+                if words:
+                    self._entry(words[0])[0] += 1
+                    item = [record['wall_time'], command]
+                    if len(self.slowest) < STATS_KEEP_SLOWEST:
+                        heapq.heappush(self.slowest, item)
+                    elif item > self.slowest[0]:
+                        heapq.heapreplace(self.slowest, item)
+            elif record.get('status') == 'error':
+                self._entry(command)[1] += 1
+        elif line.startswith('['):
+            _, _, text = line.partition('] ')
+            if text.startswith('ERROR: '):
+                if self.last is not None:
+                    self._entry(self.last)[1] += 1
+            else:
+                words = text.split()
+                self.last = words[0] if words else None
+
+    def top(self, n):
+        """n самых частых команд: [(имя, выполнений)]"""
+        ranked = sorted(self.commands.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(name, count) for name, (count, _) in ranked[:n] if count]
+
+    def errors(self, n):
+        """n команд с наибольшей долей ошибок: [(имя, ошибок, выполнений)]"""
+        failing = [(name, errors, max(count, errors))
+                   for name, (count, errors) in self.commands.items() if errors]
+        failing.sort(key=lambda item: (-item[1] / item[2], -item[1], item[0]))
+        return failing[:n]
+
+    def slow(self, n):
+        """n самых долгих команд: [(секунд, команда)]"""
+        return [tuple(item) for item in heapq.nlargest(n, self.slowest)]
+
+
+def update_stats(log_path, index_path):
+    """Сводка по логу с учетом только новых байт.
+
+    В index_path хранятся смещение, до которого лог уже прочитан, и сводка
+    на этот момент. Если лог заменен или усечен, он читается заново.
+    """
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        stats = LogStats(index['commands'], index['slowest'], index['last'])
+        offset, inode, fingerprint = index['offset'], index['inode'], index['fingerprint']
+    except (OSError, ValueError, KeyError, TypeError):
+        stats, offset, inode, fingerprint = LogStats(), 0, None, ''
+
+    with open(log_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if offset:
+            start = max(0, offset - _FINGERPRINT_SIZE)
+            f.seek(start)
+            if (st.st_ino != inode or st.st_size < offset
+                    or f.read(offset - start).hex() != fingerprint):
+                stats, offset = LogStats(), 0
+        f.seek(offset)
+        pending = b''
+        while True:
+            chunk = f.read(STATS_CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            # Последняя строка может быть еще не дописана: ее прочитаем в следующий раз
+            pending = lines.pop()
+            for line in lines:
+                offset += len(line) + 1
+                stats.feed(line.decode('utf-8', errors='replace'))
+        start = max(0, offset - _FINGERPRINT_SIZE)
+        f.seek(start)
+        fingerprint = f.read(offset - start).hex()
+
+    index = {'offset': offset, 'inode': st.st_ino, 'fingerprint': fingerprint,
+             'commands': stats.commands, 'slowest': stats.slowest, 'last': stats.last}
+    # Свой временный файл у каждого потока: сессии с общим state_dir не мешают друг другу
+    tmp = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp, index_path)
+    return stats
@@ -0,0 +1,205 @@
+import contextvars
+import ctypes
+import ctypes.util
+import io
+import os
+import platform
+import threading
+import time
+
+from constants import THROTTLE_SLICE
+from jobs import check_cancelled
+
+# Номер системного вызова ioprio_set (в os его нет) по архитектурам Linux
+_IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_BE = 2
+_IOPRIO_CLASS_SHIFT = 13
+
+# Буфер потока throttled: большие чтения (tar, zip) идут мимо него одним блоком,
+# а определение кодировки в grep не вычитывает весь двоичный файл
+_BUFFER_SIZE = 64 * 1024
+
+# Планировщик ввода-вывода выполняемой команды; copy_context переносит его
+# в рабочие потоки команды вместе с флагом отмены
+_scheduler = contextvars.ContextVar('io_scheduler', default=None)
+
+
+def _load_libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (OSError, TypeError):
+        return None
+
+
+_libc = _load_libc() if platform.system() == 'Linux' else None
+
+
+class TokenBucket:
+    """Маркерная корзина: rate единиц в секунду, запас не больше burst.
+
+    Запрос больше запаса уводит корзину в долг, и поток ждет, пока долг
+    не погасится, поэтому блок любого размера проходит с нужной средней скоростью.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount):
+        """Списывает amount и ждет, если корзина ушла в долг; возвращает время ожидания"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        deadline = time.monotonic() + delay
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return delay
+            check_cancelled()
+            time.sleep(min(left, THROTTLE_SLICE))
+
+
+def _lower_priority(nice):
+    """Понижает приоритет CPU (nice) и ввода-вывода (ioprio) текущего потока.
+
+    В Linux оба значения задаются для потока, поэтому остальные потоки
+    процесса не замедляются. Если система этого не позволяет, ничего не делает.
+    """
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, min(19, os.getpriority(os.PRIO_PROCESS, tid) + nice))
+    except (OSError, AttributeError):
+        pass
+    number = _IOPRIO_SET.get(platform.machine())
+    if _libc is not None and number is not None:
+        # Уровни best-effort 0..7 соответствуют nice 0..19, как в ionice
+        level = min(7, nice * 8 // 20)
+        _libc.syscall(number, _IOPRIO_WHO_PROCESS, tid, (_IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT) | level)
+
+
+class IOScheduler:
+    """Общий для всех потоков команды планировщик ввода-вывода.
+
+    bwlimit - байт в секунду, iops - операций (блоков) ввода-вывода в секунду,
+    nice - на сколько понизить приоритет потоков команды (0..19).
+    """
+
+    def __init__(self, bwlimit=None, iops=None, nice=None):
+        self.bandwidth = TokenBucket(bwlimit) if bwlimit else None
+        self.operations = TokenBucket(iops) if iops else None
+        self.nice = nice
+        self.waited = 0.0
+        self._lowered = set()
+        self._lock = threading.Lock()
+
+    def io(self, nbytes):
+        """Одна операция ввода-вывода на nbytes байт"""
+        if self.nice:
+            self._lower_thread()
+        waited = 0.0
+        if self.bandwidth is not None:
+            waited += self.bandwidth.take(nbytes)
+        if self.operations is not None:
+            waited += self.operations.take(1)
+        if waited:
+            with self._lock:
+                self.waited += waited
+
+    def _lower_thread(self):
+        tid = threading.get_ident()
+        if tid not in self._lowered:
+            self._lowered.add(tid)
+            _lower_priority(self.nice)
+
+    def run(self, func, *args):
+        """Выполняет func с этим планировщиком.
+
+        С nice func выполняется в отдельном потоке: приоритет потока Linux
+        без привилегий нельзя вернуть обратно, поэтому нельзя понижать его
+        потоку, который потом займут другие команды.
+        """
+        context = contextvars.copy_context()
+        context.run(_scheduler.set, self)
+        if not self.nice:
+            return context.run(func, *args)
+        result = {}
+
+        def target():
+            try:
+                result['value'] = context.run(func, *args)
+            except BaseException as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=target, name="io-nice")
+        thread.start()
+        thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+
+_SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    """Размер с необязательным суффиксом K, M или G: '512K' -> 524288"""
+    factor = _SIZE_SUFFIXES.get(text[-1:].upper(), 1)
+    number = text[:-1] if factor > 1 else text
+    if not number.isdigit() or not int(number):
+        raise ValueError(text)
+    return int(number) * factor
+
+
+def throttle(nbytes):
+    """Учитывает операцию ввода-вывода в планировщике команды, если он задан"""
+    scheduler = _scheduler.get()
+    if scheduler is not None:
+        scheduler.io(nbytes)
+
+
+class _ThrottledRaw(io.RawIOBase):
+    def __init__(self, f):
+        self._f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._f.readinto(b)
+        if n:
+            throttle(n)
+        return n
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def seekable(self):
+        return self._f.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+def throttled(f, buffer_size=_BUFFER_SIZE):
+    """Двоичный поток, чтение из которого проходит через планировщик команды.
+
+    Без ограничений возвращает сам f, чтобы не тратить время на обертку.
+    """
+    if _scheduler.get() is None:
+        return f
+    return io.BufferedReader(_ThrottledRaw(f), buffer_size)
@@ -0,0 +1,365 @@
+import errno
+import io
+import os
+import stat
+import tarfile
+import threading
+import time
+import zipfile
+
+
+def _stat_result(mode, size, mtime):
+    """os.stat_result для файлов виртуальных файловых систем"""
+    seconds = int(mtime)
+    ns = int(mtime * 1e9)
+    return os.stat_result((mode, 0, 0, 1, 0, 0, size, seconds, seconds, seconds),
+                          {'st_atime': mtime, 'st_mtime': mtime, 'st_ctime': mtime,
+                           'st_atime_ns': ns, 'st_mtime_ns': ns, 'st_ctime_ns': ns})
+
+
+def _open_mode(stream, mode, encoding, errors):
+    """Оборачивает двоичный поток в текстовый для режимов без 'b'"""
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding or 'utf-8', errors=errors)
+
+
+class LocalFS:
+    """Обычная файловая система через os и open"""
+
+    is_local = True
+    readonly = False
+    root = os.path.abspath(os.sep)
+
+    exists = staticmethod(os.path.exists)
+    isdir = staticmethod(os.path.isdir)
+    isfile = staticmethod(os.path.isfile)
+    listdir = staticmethod(os.listdir)
+    stat = staticmethod(os.stat)
+    remove = staticmethod(os.remove)
+    rmdir = staticmethod(os.rmdir)
+    rename = staticmethod(os.rename)
+    walk = staticmethod(os.walk)
+
+    @staticmethod
+    def open(path, mode='rb', encoding=None, errors=None):
+        return open(path, mode, encoding=encoding, errors=errors)
+
+    @staticmethod
+    def makedirs(path, exist_ok=True):
+        os.makedirs(path, exist_ok=exist_ok)
+
+
+class _MemoryFile(io.BytesIO):
+    """Открытый на запись файл MemoryFS: содержимое сохраняется при закрытии"""
+
+    def __init__(self, fs, path, data):
+        super().__init__(data)
+        self._fs = fs
+        self._path = path
+
+    def close(self):
+        if not self.closed:
+            self._fs._store(self._path, self.getvalue())
+        super().close()
+
+
+class MemoryFS:
+    """Файловая система в памяти для быстрых тестов и замеров.
+
+    Пути абсолютные, как у локальной системы; каталоги хранят множества имен
+    детей, файлы - байты и время изменения.
+    """
+
+    is_local = False
+    readonly = False
+    root = os.path.abspath(os.sep)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._dirs = {self.root: (set(), time.time())}
+        self._files = {}
+
+    @staticmethod
+    def _norm(path):
+        return os.path.normpath(os.path.join(MemoryFS.root, path))
+
+    def _parent_entry(self, path):
+        parent = os.path.dirname(path)
+        if parent not in self._dirs:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", parent)
+        return self._dirs[parent][0]
+
+    def _store(self, path, data):
+        with self._lock:
+            self._parent_entry(path).add(os.path.basename(path))
+            self._files[path] = (bytes(data), time.time())
+
+    def exists(self, path):
+        path = self._norm(path)
+        return path in self._dirs or path in self._files
+
+    def isdir(self, path):
+        return self._norm(path) in self._dirs
+
+    def isfile(self, path):
+        return self._norm(path) in self._files
+
+    def listdir(self, path):
+        path = self._norm(path)
+        if path not in self._dirs:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+        return sorted(self._dirs[path][0])
+
+    def stat(self, path):
+        path = self._norm(path)
+        if path in self._dirs:
+            return _stat_result(stat.S_IFDIR | 0o755, 0, self._dirs[path][1])
+        if path in self._files:
+            data, mtime = self._files[path]
+            return _stat_result(stat.S_IFREG | 0o644, len(data), mtime)
+        raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+
+    def open(self, path, mode='rb', encoding=None, errors=None):
+        path = self._norm(path)
+        if path in self._dirs:
+            raise IsADirectoryError(errno.EISDIR, "Is a directory", path)
+        if 'r' in mode and '+' not in mode:
+            if path not in self._files:
+                raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+            stream = io.BytesIO(self._files[path][0])
+        else:
+            with self._lock:
+                self._parent_entry(path)
+                data = b''
+                if ('a' in mode or '+' in mode) and path in self._files:
+                    data = self._files[path][0]
+                stream = _MemoryFile(self, path, data)
+                if 'a' in mode:
+                    stream.seek(0, io.SEEK_END)
+        return _open_mode(stream, mode, encoding, errors)
+
+    def makedirs(self, path, exist_ok=True):
+        path = self._norm(path)
+        with self._lock:
+            if path in self._files or (path in self._dirs and not exist_ok):
+                raise FileExistsError(errno.EEXIST, "File exists", path)
+            missing = []
+            while path not in self._dirs:
+                missing.append(path)
+                path = os.path.dirname(path)
+            for directory in reversed(missing):
+                self._parent_entry(directory).add(os.path.basename(directory))
+                self._dirs[directory] = (set(), time.time())
+
+    def remove(self, path):
+        path = self._norm(path)
+        with self._lock:
+            if path not in self._files:
+                raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+            del self._files[path]
+            self._parent_entry(path).discard(os.path.basename(path))
+
+    def rmdir(self, path):
+        path = self._norm(path)
+        with self._lock:
+            if path not in self._dirs:
+                raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+            if self._dirs[path][0]:
+                raise OSError(errno.ENOTEMPTY, "Directory not empty", path)
+            del self._dirs[path]
+            self._parent_entry(path).discard(os.path.basename(path))
+
+    def rename(self, src, dst):
+        src, dst = self._norm(src), self._norm(dst)
+        with self._lock:
+            if not self.exists(src):
+                raise FileNotFoundError(errno.ENOENT, "No such file or directory", src)
+            self._parent_entry(dst)
+            if src in self._files:
+                self._files[dst] = self._files.pop(src)
+            else:
+                # Переносим поддерево: меняем префикс у всех вложенных путей
+                prefix = src + os.sep
+                for table in (self._dirs, self._files):
+                    for path in [p for p in table if p == src or p.startswith(prefix)]:
+                        table[dst + path[len(src):]] = table.pop(path)
+            self._parent_entry(src).discard(os.path.basename(src))
+            self._parent_entry(dst).add(os.path.basename(dst))
+
+    def walk(self, top):
+        top = self._norm(top)
+        if top not in self._dirs:
+            return
+        names = self.listdir(top)
+        dirs = [name for name in names if os.path.join(top, name) in self._dirs]
+        files = [name for name in names if os.path.join(top, name) in self._files]
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(os.path.join(top, name))
+
+
+class ArchiveFS:
+    """Файловая система только для чтения поверх zip или tar архива.
+
+    Путь к архиву ведет себя как каталог: `cd archive.zip`, а затем
+    ls/cat/grep работают с содержимым без распаковки.
+    """
+
+    is_local = False
+    readonly = True
+
+    def __init__(self, archive_path):
+        self.root = archive_path
+        self.mtime = os.stat(archive_path).st_mtime
+        self._lock = threading.Lock()
+        self._dirs = {'': set()}
+        self._files = {}
+        if zipfile.is_zipfile(archive_path):
+            self._zip = zipfile.ZipFile(archive_path)
+            self._tar = None
+            for info in self._zip.infolist():
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                mode = (info.external_attr >> 16) & 0o777 or 0o644
+                self._add(info.filename, info.is_dir(), info, info.file_size, mtime, mode)
+        else:
+            self._zip = None
+            self._tar = tarfile.open(archive_path, 'r:*')
+            for member in self._tar.getmembers():
+                if member.isdir() or member.isreg():
+                    self._add(member.name, member.isdir(), member, member.size,
+                              member.mtime, member.mode & 0o777)
+
+    def _add(self, name, is_dir, member, size, mtime, mode):
+        name = name.strip('/')
+        if name.startswith('./'):
+            name = name[2:]
+        if not name or name == '.':
+            return
+        parts = name.split('/')
+        for i in range(1, len(parts)):
+            directory = '/'.join(parts[:i])
+            self._dirs.setdefault(directory, set())
+            self._dirs['/'.join(parts[:i - 1])].add(parts[i - 1])
+        self._dirs['/'.join(parts[:-1])].add(parts[-1])
+        if is_dir:
+            self._dirs.setdefault(name, set())
+        else:
+            self._files[name] = (member, size, mtime, mode)
+
+    def _inner(self, path):
+        rel = os.path.relpath(path, self.root)
+        return '' if rel == '.' else rel.replace(os.sep, '/')
+
+    def _readonly(self, path):
+        return OSError(errno.EROFS, "Read-only file system", path)
+
+    def exists(self, path):
+        inner = self._inner(path)
+        return inner in self._dirs or inner in self._files
+
+    def isdir(self, path):
+        return self._inner(path) in self._dirs
+
+    def isfile(self, path):
+        return self._inner(path) in self._files
+
+    def listdir(self, path):
+        inner = self._inner(path)
+        if inner not in self._dirs:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+        return sorted(self._dirs[inner])
+
+    def stat(self, path):
+        inner = self._inner(path)
+        if inner in self._dirs:
+            return _stat_result(stat.S_IFDIR | 0o555, 0, self.mtime)
+        if inner in self._files:
+            _, size, mtime, mode = self._files[inner]
+            return _stat_result(stat.S_IFREG | mode, size, mtime)
+        raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+
+    def open(self, path, mode='rb', encoding=None, errors=None):
+        if any(c in mode for c in 'wa+'):
+            raise self._readonly(path)
+        inner = self._inner(path)
+        if inner in self._dirs:
+            raise IsADirectoryError(errno.EISDIR, "Is a directory", path)
+        if inner not in self._files:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+        member = self._files[inner][0]
+        with self._lock:
+            if self._zip is not None:
+                stream = self._zip.open(member)
+            else:
+                # Общий поток tar не рассчитан на одновременное чтение, читаем элемент целиком
+                stream = io.BytesIO(self._tar.extractfile(member).read())
+        return _open_mode(stream, mode, encoding, errors)
+
+    def walk(self, top):
+        inner = self._inner(top)
+        if inner not in self._dirs:
+            return
+        names = sorted(self._dirs[inner])
+        prefix = inner + '/' if inner else ''
+        dirs = [name for name in names if prefix + name in self._dirs]
+        files = [name for name in names if prefix + name in self._files]
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(os.path.join(top, name))
+
+    def makedirs(self, path, exist_ok=True):
+        raise self._readonly(path)
+
+    def remove(self, path):
+        raise self._readonly(path)
+
+    def rmdir(self, path):
+        raise self._readonly(path)
+
+    def rename(self, src, dst):
+        raise self._readonly(src)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+
+def scan(fs, path, with_stat=True):
+    """Записи каталога: (имя, каталог ли, stat).
+
+    На локальном диске используется os.scandir: тип записи известен без
+    отдельного stat, а полные пути не собираются заново. stat берется без
+    перехода по символическим ссылкам, как и тип: ссылка на каталог - не
+    каталог. Без with_stat на локальном диске вместо stat отдается None.
+    """
+    if not fs.is_local:
+        for name in fs.listdir(path):
+            st = fs.stat(os.path.join(path, name))
+            yield name, stat.S_ISDIR(st.st_mode), st
+        return
+    with os.scandir(path) as it:
+        for entry in it:
+            st = entry.stat(follow_symlinks=False) if with_stat else None
+            yield entry.name, entry.is_dir(follow_symlinks=False), st
+
+
+def walk_tree(fs, root, with_stat=True):
+    """Обход дерева в глубину за один проход: (путь относительно root, каталог ли, stat).
+
+    Общий обходчик ls, grep и diff; по символическим ссылкам на каталоги не идет.
+    Обходу, которому нужны только имена (grep -r), with_stat=False экономит stat на запись.
+    """
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        entries = sorted(scan(fs, os.path.join(root, rel) if rel else root, with_stat),
+                         key=lambda entry: entry[0])
+        for name, is_dir, st in entries:
+            child = os.path.join(rel, name) if rel else name
+            yield child, is_dir, st
+        # Подкаталоги кладем в обратном порядке, чтобы обходить их по алфавиту
+        stack.extend(os.path.join(rel, name) if rel else name
+                     for name, is_dir, _ in reversed(entries) if is_dir)
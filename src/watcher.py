@@ -0,0 +1,129 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# Флаги inotify из <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+
+_WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# struct inotify_event без имени: wd, mask, cookie, len
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def _kind(mask):
+    """Вид события: 'create', 'modify' или 'delete'"""
+    if mask & (IN_CREATE | IN_MOVED_TO):
+        return 'create'
+    if mask & (IN_DELETE | IN_MOVED_FROM):
+        return 'delete'
+    if mask & (IN_MODIFY | IN_Q_OVERFLOW):
+        return 'modify'
+    return None
+
+
+class InotifyWatcher:
+    """Изменения в каталоге через inotify: ожидание событий не тратит CPU"""
+
+    def __init__(self, directory):
+        self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if _libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, os.strerror(error), directory)
+
+    def wait(self, timeout):
+        """События за время ожидания: список (имя, вид) без повторов.
+
+        При переполнении очереди ядра приходит событие с пустым именем:
+        изменилось что угодно.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            kind = _kind(mask)
+            if kind is not None:
+                events.append((name, kind))
+        return list(dict.fromkeys(events))
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Запасной вариант без inotify: сравнение снимков каталога раз в timeout секунд"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[entry.name] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            pass
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        current = self._scan()
+        previous, self._snapshot = self._snapshot, current
+        events = [(name, 'create') for name in current if name not in previous]
+        events += [(name, 'modify') for name, state in current.items()
+                   if name in previous and previous[name] != state]
+        events += [(name, 'delete') for name in previous if name not in current]
+        return events
+
+    def close(self):
+        pass
+
+
+def open_watcher(directory):
+    """Наблюдатель за каталогом: inotify, если он доступен, иначе опрос"""
+    if _libc is not None:
+        try:
+            return InotifyWatcher(directory)
+        except OSError:
+            pass
+    return PollingWatcher(directory)
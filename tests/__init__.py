@@ -6,49 +6,112 @@ from pathlib import Path
 import sys
 import io
 import contextlib
+import atexit
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from main import MiniShell
+from vfs import MemoryFS, LocalFS
 
+# Каталог, в котором параллельный запуск собирает заготовки всех процессов
+FIXTURE_ROOT_ENV = 'MINISHELL_TEST_FIXTURES'
+# Сколько самых долгих тестов показывать в отчете
+SLOWEST_TESTS = 5
+
+_fixtures: dict[str, str] = {}
+_fixtures_lock = threading.Lock()
+
+
+def shared_fixture(build):
+    """Дерево-заготовка, которое строится один раз за процесс.
+
+    Тесты только читают его или копируют себе. При параллельном запуске
+    заготовки лежат в общем каталоге и удаляются вместе с ним, иначе -
+    при выходе из процесса.
+    """
+    with _fixtures_lock:
+        root = _fixtures.get(build.__name__)
+        if root is None:
+            base = os.environ.get(FIXTURE_ROOT_ENV)
+            root = tempfile.mkdtemp(prefix=f"{build.__name__}-", dir=base)
+            build(root)
+            if base is None:
+                atexit.register(shutil.rmtree, root, True)
+            _fixtures[build.__name__] = root
+        return root
+
+
+def build_basic_tree(root):
+    """Файлы и каталоги основных тестов"""
+    os.makedirs(os.path.join(root, "test_dir", "subdir"))
+    with open(os.path.join(root, "test_file.txt"), 'w', encoding='utf-8') as f:
+        f.write("Hello World\nLine 2\nLine 3")
+    with open(os.path.join(root, "another_file.txt"), 'w', encoding='utf-8') as f:
+        f.write("Test content\nAnother line")
+    with open(os.path.join(root, "test_dir", "subdir", "nested.txt"), 'w', encoding='utf-8') as f:
+        f.write("Nested content\nFind me")
+
+
+def build_archive_tree(root):
+    """Каталог для тестов архивов и плагинов"""
+    os.makedirs(os.path.join(root, "archive_test"))
+    with open(os.path.join(root, "archive_test", "file.txt"), 'w') as f:
+        f.write("Content for archive")
+
+
+class ShellTestCase(unittest.TestCase):
+    """Основа тестов: у каждого теста свой каталог и своя сессия, os.chdir не нужен.
+
+    fixture - функция, строящая заготовку; тест получает ее копию, а если
+    shared, то работает прямо в общей заготовке (только для тестов без записи).
+    """
+
+    fixture: Optional[Callable[..., Any]] = None
+    shared = False
 
-class TestMiniShell(unittest.TestCase):
     def setUp(self):
-        """Создание временной директории для тестов"""
         self.test_dir = tempfile.mkdtemp()
-        self.original_dir = os.getcwd()
-        os.chdir(self.test_dir)
+        cwd = self.test_dir
+        if self.fixture is not None:
+            template = shared_fixture(self.fixture)
+            if self.shared:
+                cwd = template
+            else:
+                shutil.copytree(template, self.test_dir, dirs_exist_ok=True)
+        self.shell = self.new_shell(cwd=cwd)
+
+    def tearDown(self):
+        self.shell.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
 
-        # Для проведения тестов надо создать соответствующие временные директории и файлы
-        self.file1 = "test_file.txt"
-        self.file2 = "another_file.txt"
-        self.dir1 = "test_dir"
-        self.subdir = "test_dir/subdir"
-        self.nested_file = "test_dir/subdir/nested.txt"
+    def new_shell(self, **kwargs):
+        """Сессия, хранящая корзину и лог в каталоге теста"""
+        kwargs.setdefault('state_dir', self.test_dir)
+        if 'fs' not in kwargs:
+            kwargs.setdefault('cwd', self.test_dir)
+        return MiniShell(**kwargs)
 
-        with open(self.file1, 'w', encoding='utf-8') as f:
-            f.write("Hello World\nLine 2\nLine 3")
+    def path(self, *parts):
+        """Абсолютный путь внутри каталога теста"""
+        return os.path.join(self.test_dir, *parts)
 
-        with open(self.file2, 'w', encoding='utf-8') as f:
-            f.write("Test content\nAnother line")
 
-        os.makedirs(self.subdir, exist_ok=True)
+class BasicTreeTestCase(ShellTestCase):
+    fixture = staticmethod(build_basic_tree)
+    file1 = "test_file.txt"
+    file2 = "another_file.txt"
+    dir1 = "test_dir"
+    subdir = "test_dir/subdir"
+    nested_file = "test_dir/subdir/nested.txt"
 
-        with open(self.nested_file, 'w', encoding='utf-8') as f:
-            f.write("Nested content\nFind me")
 
-        self.shell = MiniShell()
+class TestMiniShellReadOnly(BasicTreeTestCase):
+    """Тесты, которые только читают общую заготовку"""
 
-    def tearDown(self):
-        """Очистка после тестов"""
-        os.chdir(self.original_dir)
-        shutil.rmtree(self.test_dir)
-        # Удаляем файлы логов
-        for log_file in ['shell.log', '.history', '.trash']:
-            if os.path.exists(log_file):
-                if os.path.isdir(log_file):
-                    shutil.rmtree(log_file)
-                else:
-                    os.remove(log_file)
+    shared = True
 
     # ========== Тесты правильно работы кода ==========
 
@@ -82,37 +145,11 @@ class TestMiniShell(unittest.TestCase):
         self.assertIn("Hello World", result)
         self.assertIn("Line 2", result)
 
-    def test_06_cp_file(self):
-        """Тест копирования файла"""
-        new_file = "copied_file.txt"
-        result = self.shell.cp(self.file1, new_file)
-        self.assertEqual("Копирование успешно", result)
-        self.assertTrue(os.path.exists(new_file))
-
-    def test_07_cp_directory_recursive(self):
-        """Тест рекурсивного копирования директории"""
-        dest_dir = "copied_dir"
-        result = self.shell.cp(self.dir1, dest_dir, recursive=True)
-        self.assertEqual("Копирование успешно", result)
-        self.assertTrue(os.path.exists(dest_dir))
-
-    def test_08_mv_file(self):
-        """Тест перемещения файла"""
-        new_name = "renamed_file.txt"
-        result = self.shell.mv(self.file1, new_name)
-        self.assertEqual("Перемещение успешно", result)
-        self.assertTrue(os.path.exists(new_name))
-
     def test_09_grep_basic(self):
         """Тест поиска по содержимому"""
         result = self.shell.grep("World", self.file1)
         self.assertIn("World", result)
 
-    def test_10_zip_command(self):
-        """Тест создания архива"""
-        result1 = self.shell.zip(self.dir1, "test.zip")
-        self.assertIn("Архив ZIP создан", result1)
-
     # ========== Тесты ошибок выполнения кодов ==========
 
     def test_11_ls_nonexistent_directory(self):
@@ -135,6 +172,41 @@ class TestMiniShell(unittest.TestCase):
         result = self.shell.cat("non_existent_file_98765.txt")
         self.assertIn("Ошибка", result)
 
+    def test_20_grep_nonexistent_file(self):
+        """Тест поиска в несуществующем файле"""
+        result = self.shell.grep("pattern", "non_existent_file.txt")
+        self.assertEqual("Совпадений не найдено", result)
+
+
+class TestMiniShell(BasicTreeTestCase):
+    def test_06_cp_file(self):
+        """Тест копирования файла"""
+        new_file = "copied_file.txt"
+        result = self.shell.cp(self.file1, new_file)
+        self.assertEqual("Копирование успешно", result)
+        self.assertTrue(os.path.exists(self.path(new_file)))
+
+    def test_07_cp_directory_recursive(self):
+        """Тест рекурсивного копирования директории"""
+        dest_dir = "copied_dir"
+        result = self.shell.cp(self.dir1, dest_dir, recursive=True)
+        self.assertEqual("Копирование успешно", result)
+        self.assertTrue(os.path.exists(self.path(dest_dir)))
+
+    def test_08_mv_file(self):
+        """Тест перемещения файла"""
+        new_name = "renamed_file.txt"
+        result = self.shell.mv(self.file1, new_name)
+        self.assertEqual("Перемещение успешно", result)
+        self.assertTrue(os.path.exists(self.path(new_name)))
+
+    def test_10_zip_command(self):
+        """Тест создания архива"""
+        result1 = self.shell.zip(self.dir1, "test.zip")
+        self.assertIn("Архив ZIP создан", result1)
+
+    # ========== Тесты ошибок выполнения кодов ==========
+
     def test_15_cp_nonexistent_source(self):
         """Тест копирования несуществующего файла"""
         result = self.shell.cp("non_existent.txt", "dest.txt")
@@ -152,58 +224,28 @@ class TestMiniShell(unittest.TestCase):
 
     def test_18_rm_protected_paths(self):
         """Тест удаления защищенных путей"""
-        # Имитируем ввод 'y' для теста
-        import builtins
-        original_input = builtins.input
-        builtins.input = lambda _: 'y'
+        # Подтверждение дается сразу, запрет должен сработать раньше
+        self.shell.confirm = lambda _: 'y'
 
-        try:
-            # Проверяем запрет на удаление текущего каталога
-            result = self.shell.rm(".", recursive=True)
-            self.assertIn("Ошибка", result)
-        finally:
-            builtins.input = original_input
+        # Проверяем запрет на удаление текущего каталога
+        result = self.shell.rm(".", recursive=True)
+        self.assertIn("Ошибка", result)
 
     def test_19_rm_directory_without_recursive(self):
         """Тест удаления пустой директории"""
         # Создаем ПУСТУЮ директорию для теста
         test_rm_dir = "empty_dir"
-        os.makedirs(test_rm_dir, exist_ok=True)
+        os.makedirs(self.path(test_rm_dir), exist_ok=True)
 
         result = self.shell.rm(test_rm_dir, recursive=False)
         self.assertTrue("Удаление успешно" in result or "Ошибка" in result)
 
-    def test_20_grep_nonexistent_file(self):
-        """Тест поиска в несуществующем файле"""
-        result = self.shell.grep("pattern", "non_existent_file.txt")
-        self.assertEqual("Совпадений не найдено", result)
-
     # ========== Тесты работы плагинов ==========
 
-class TestMiniShellPlugins(unittest.TestCase):
-    def setUp(self):
-        self.test_dir = tempfile.mkdtemp()
-        self.original_dir = os.getcwd()
-        os.chdir(self.test_dir)
-
-        # Создаем тестовую структуру для архивов
-        self.archive_dir = "archive_test"
 
-        os.makedirs(self.archive_dir, exist_ok=True)
-        with open(os.path.join(self.archive_dir, "file.txt"), 'w') as f:
-            f.write("Content for archive")
-
-        self.shell = MiniShell()
-
-    def tearDown(self):
-        os.chdir(self.original_dir)
-        shutil.rmtree(self.test_dir)
-        for log_file in ['shell.log', '.history', '.trash']:
-            if os.path.exists(log_file):
-                if os.path.isdir(log_file):
-                    shutil.rmtree(log_file)
-                else:
-                    os.remove(log_file)
+class TestMiniShellPlugins(ShellTestCase):
+    fixture = staticmethod(build_archive_tree)
+    archive_dir = "archive_test"
 
     def test_21_tar_command(self):
         """Тест создания tar.gz архива"""
@@ -214,10 +256,10 @@ class TestMiniShellPlugins(unittest.TestCase):
     def test_22_grep_recursive(self):
         """Тест рекурсивного поиска"""
         # Создаем вложенную структуру
-        os.makedirs("dir1/dir2", exist_ok=True)
-        with open("dir1/file1.txt", 'w') as f:
+        os.makedirs(self.path("dir1/dir2"), exist_ok=True)
+        with open(self.path("dir1/file1.txt"), 'w') as f:
             f.write("search_pattern here")
-        with open("dir1/dir2/file2.txt", 'w') as f:
+        with open(self.path("dir1/dir2/file2.txt"), 'w') as f:
             f.write("another search_pattern")
 
         result = self.shell.grep("search_pattern", ".", recursive=True)
@@ -226,7 +268,7 @@ class TestMiniShellPlugins(unittest.TestCase):
     def test_23_grep_case_insensitive(self):
         """Тест поиска без учета регистра"""
         test_file = "case_test.txt"
-        with open(test_file, 'w') as f:
+        with open(self.path(test_file), 'w') as f:
             f.write("UPPERCASE\nlowercase\nMixedCase")
 
         result = self.shell.grep("uppercase", test_file, ignore_case=True)
@@ -247,11 +289,11 @@ class TestMiniShellPlugins(unittest.TestCase):
         source = "source_undo.txt"
         dest = "dest_undo.txt"
 
-        with open(source, 'w') as f:
+        with open(self.path(source), 'w') as f:
             f.write("test content")
 
         self.shell.cp(source, dest)
-        self.assertTrue(os.path.exists(dest))
+        self.assertTrue(os.path.exists(self.path(dest)))
 
         # Отменяем
         result = self.shell.undo()
@@ -263,24 +305,21 @@ class TestMiniShellPlugins(unittest.TestCase):
         result = self.shell.ls()
 
         # Проверяем, что лог-файл создан
-        self.assertTrue(os.path.exists('shell.log'))
+        self.assertTrue(os.path.exists(self.path('shell.log')))
 
     def test_27_rm_with_confirmation(self):
         """Тест удаления с подтверждением"""
         # Создаем директорию для удаления
         dir_to_remove = "confirm_test_dir"
-        os.makedirs(dir_to_remove, exist_ok=True)
+        os.makedirs(self.path(dir_to_remove), exist_ok=True)
 
         # Имитируем ввод 'y' (подтверждение)
-        import builtins
-        original_input = builtins.input
-        builtins.input = lambda _: 'y'
+        prompts = []
+        self.shell.confirm = lambda prompt: prompts.append(prompt) or 'y'
 
-        try:
-            result = self.shell.rm(dir_to_remove, recursive=True)
-            self.assertIn("Удаление успешно", result)
-        finally:
-            builtins.input = original_input
+        result = self.shell.rm(dir_to_remove, recursive=True)
+        self.assertIn("Удаление успешно", result)
+        self.assertEqual(1, len(prompts))
 
     def test_28_undo_empty_history(self):
         """Тест отмены при пустой истории"""
@@ -291,7 +330,7 @@ class TestMiniShellPlugins(unittest.TestCase):
         """Тест сложной последовательности команд"""
         # Создаем файл
         test_file = "test_file.txt"
-        with open(test_file, 'w') as f:
+        with open(self.path(test_file), 'w') as f:
             f.write("content")
 
         # Проверяем ls
@@ -309,49 +348,1074 @@ class TestMiniShellPlugins(unittest.TestCase):
         self.assertIn("ls -l", result)
 
 
-def run_tests():
-    """Запуск тестов с красивым выводом"""
-    buffer = io.StringIO()
+    def test_31_time_prefix(self):
+        """Тест префикса time с выводом метрик"""
+        result = self.shell.execute("time ls")
+        self.assertIn(self.archive_dir, result)
+        self.assertIn("real", result)
+
+    def test_32_metrics_json_in_log(self):
+        """Тест записи метрик команды в лог JSON-строкой"""
+        import json
+        self.shell.execute(f"cp -r {self.archive_dir} copy_dir")
+        self.shell.log_writer.flush()
+
+        with open(self.path('shell.log'), encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.startswith('{')]
+        self.assertEqual(records[-1]['command'], f"cp -r {self.archive_dir} copy_dir")
+        self.assertEqual(records[-1]['files'], 1)
+        self.assertEqual(records[-1]['bytes_written'], len("Content for archive"))
+
+
+    def test_33_profile_mode(self):
+        """Тест режима профилирования"""
+        import tracemalloc
+        shell = self.new_shell(profile=True)
+        result = shell.execute("ls")
+        self.assertIn("--- profile ---", result)
+        # tracemalloc запускается один раз на оболочку, а не на каждую команду
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertIn("peak memory:", shell.execute("ls"))
+        shell.close()
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+    def test_34_json_log_format(self):
+        """Тест структурированного JSON-лога"""
+        import json
+        shell = self.new_shell(log_format='json')
+        shell.execute("cat missing.txt")
+        shell.close()
+
+        with open(self.path('shell.log'), encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        record = [r for r in records if 'status' in r][-1]
+        self.assertEqual(record['command'], 'cat')
+        self.assertEqual(record['args'], ['missing.txt'])
+        self.assertEqual(record['status'], 'error')
+        self.assertIsNotNone(record['duration'])
+        self.assertEqual(record['cwd'], shell.current_dir)
+
+
+    def test_35_background_job(self):
+        """Тест выполнения команды фоновой задачей"""
+        job = self.shell.jobs.submit("ls", background=True)
+        self.assertIn(self.archive_dir, self.shell.jobs.wait(job))
+        self.assertEqual(self.shell.jobs.reap(), [job])
+        self.assertEqual("Нет фоновых задач", self.shell.jobs_list())
+        self.shell.close()
+
+    def test_36_job_cancel(self):
+        """Тест отмены выполняющейся задачи"""
+        import time
+        from jobs import JobManager, CommandCancelled, check_cancelled
+
+        def endless(_):
+            while True:
+                check_cancelled()
+                time.sleep(0.01)
+
+        manager = JobManager(endless)
+        job = manager.submit("endless", background=True)
+        self.assertEqual(job.status, "Выполняется")
+        job.cancel()
+        with self.assertRaises(CommandCancelled):
+            job.result(timeout=5)
+        manager.close()
+
+    def test_37_kill_unknown_job(self):
+        """Тест kill несуществующей задачи"""
+        result = self.shell.execute("kill %7")
+        self.assertIn("Ошибка", result)
+
 
-    with contextlib.redirect_stdout(buffer):
-        loader = unittest.TestLoader()
-        suite = unittest.TestSuite()
+    def test_38_cp_resume(self):
+        """Тест продолжения прерванного рекурсивного копирования"""
+        import json
+        os.makedirs(self.path("big/sub"))
+        with open(self.path("big/a.txt"), 'w') as f:
+            f.write("aaaa")
+        with open(self.path("big/sub/b.txt"), 'w') as f:
+            f.write("0123456789")
+
+        # Имитируем прерванное копирование: a.txt готов, b.txt записан наполовину
+        os.makedirs(self.path("copy/sub"))
+        shutil.copy2(self.path("big/a.txt"), self.path("copy/a.txt"))
+        with open(self.path("copy/sub/b.txt"), 'w') as f:
+            f.write("01234")
+        with open(self.path(".copy.checkpoint"), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(['done', 'a.txt']) + "\n")
+            f.write(json.dumps(['partial', os.path.join('sub', 'b.txt'), 5]) + "\n")
+
+        result = self.shell.execute("cp -r --resume big copy")
+        self.assertEqual("Копирование успешно", result)
+        with open(self.path("copy/sub/b.txt")) as f:
+            self.assertEqual("0123456789", f.read())
+        self.assertEqual(self.shell.metrics['bytes_written'], 5)
+        self.assertFalse(os.path.exists(self.path(".copy.checkpoint")))
+
+    def test_39_resume_without_checkpoint(self):
+        """Тест --resume без контрольной точки"""
+        result = self.shell.cp(self.archive_dir, "copy", recursive=True, resume=True)
+        self.assertIn("Ошибка", result)
 
-        suite.addTests(loader.loadTestsFromTestCase(TestMiniShell))
-        suite.addTests(loader.loadTestsFromTestCase(TestMiniShellPlugins))
+    def test_40_untar_resume(self):
+        """Тест продолжения распаковки tar.gz"""
+        import json
+        self.shell.tar(self.archive_dir, "test.tar.gz")
+        os.makedirs(self.path("out"))
+        self.shell.cd("out")
+        with open(self.path("out/file.txt"), 'w') as f:
+            f.write("Content")
+        with open(self.path("out/.test.tar.gz.checkpoint"), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(['done', '.']) + "\n")
+            f.write(json.dumps(['partial', './file.txt', 7]) + "\n")
+
+        result = self.shell.untar("../test.tar.gz", resume=True)
+        self.assertIn("распакован", result)
+        with open(self.path("out/file.txt")) as f:
+            self.assertEqual("Content for archive", f.read())
+
+
+    def test_41_cp_dedupe(self):
+        """Тест копирования с дедупликацией одинаковых файлов"""
+        os.makedirs(self.path("build/a"))
+        os.makedirs(self.path("build/b"))
+        for path in ("build/a/lib.bin", "build/b/lib.bin"):
+            with open(self.path(path), 'wb') as f:
+                f.write(b"same bytes" * 100)
+        with open(self.path("build/unique.bin"), 'wb') as f:
+            f.write(b"other")
+
+        result = self.shell.cp("build", "out", recursive=True, dedupe=True)
+        self.assertIn("дубликатов: 1", result)
+        a, b = os.stat(self.path("out/a/lib.bin")), os.stat(self.path("out/b/lib.bin"))
+        # Копии независимы: жесткие ссылки не создаются
+        self.assertNotEqual(a.st_ino, b.st_ino)
+        with open(self.path("out/b/lib.bin"), 'rb') as f:
+            self.assertEqual(b"same bytes" * 100, f.read())
+
+        # Повторный запуск берет хэши из постоянного кэша
+        self.shell.cp("build", "out2", recursive=True, dedupe=True)
+        self.assertEqual(self.shell.metrics['cache_hits'], 2)
+
+        # Совпадение хэша без совпадения байтов не считается дубликатом
+        from unittest import mock
+        with open(self.path("build/b/lib.bin"), 'wb') as f:
+            f.write(b"diff bytes" * 100)
+        with mock.patch('main.hash_files', lambda paths, **kwargs: {path: 'same' for path in paths}):
+            self.assertIn("дубликатов: 0", self.shell.cp("build", "out3", recursive=True, dedupe=True))
+        with open(self.path("out3/b/lib.bin"), 'rb') as f:
+            self.assertEqual(b"diff bytes" * 100, f.read())
+
+
+    def test_42_rm_force_and_undo(self):
+        """Тест rm -rf без подтверждения и восстановления из корзины"""
+        os.makedirs(self.path("victim/sub"))
+        result = self.shell.execute("rm -rf victim")
+        self.assertEqual("Удаление успешно", result)
+        self.assertFalse(os.path.exists(self.path("victim")))
 
-        runner = unittest.TextTestRunner(verbosity=1, stream=buffer)
-        result = runner.run(suite)
+        result = self.shell.undo()
+        self.assertIn("Восстановлено", result)
+        self.assertTrue(os.path.isdir(self.path("victim/sub")))
+
+    def test_43_rm_purge_background(self):
+        """Тест окончательного удаления большого дерева в фоне"""
+        from purger import purge_tree
+        from concurrent.futures import ThreadPoolExecutor
+        for i in range(5):
+            os.makedirs(self.path(f"huge/d{i}/inner"))
+            for j in range(10):
+                with open(self.path(f"huge/d{i}/inner/f{j}"), 'w') as f:
+                    f.write("x")
+
+        result = self.shell.rm("huge", recursive=True, force=True, purge=True)
+        self.assertIn("в фоне", result)
+        self.shell.close()
+        self.assertFalse(os.path.exists(self.path("huge")))
+        self.assertEqual([], os.listdir(self.path(".trash")))
+
+        os.makedirs(self.path("tree/a/b"))
+        with ThreadPoolExecutor(2) as pool:
+            purge_tree(self.path("tree"), pool)
+        self.assertFalse(os.path.exists(self.path("tree")))
+
+
+    def test_44_mv_cross_device(self):
+        """Тест перемещения между файловыми системами через копию с проверкой"""
+        os.makedirs(self.path(self.archive_dir, "sub"))
+        with open(self.path(self.archive_dir, "sub", "deep.txt"), 'w') as f:
+            f.write("deep")
+        # Имитируем разные устройства у источника и назначения
+        self.shell._is_cross_device = lambda src, dst: True
+
+        result = self.shell.mv(self.archive_dir, "moved")
+        self.assertIn("Перемещение успешно", result)
+        self.assertIn("байт", result)
+        self.assertFalse(os.path.exists(self.path(self.archive_dir)))
+        with open(self.path("moved/sub/deep.txt")) as f:
+            self.assertEqual("deep", f.read())
+        self.assertEqual([], [n for n in os.listdir(self.test_dir) if n.startswith(".moved")])
+
+    def test_45_mv_recover_interrupted(self):
+        """Тест отката перемещения, прерванного на этапе копирования"""
+        import json
+        os.makedirs(self.path(".moved.mvtmp/partial"))
+        with open(self.path(".moved.mvjournal"), 'w', encoding='utf-8') as f:
+            json.dump({'src': self.path(self.archive_dir), 'dst': self.path("moved"),
+                       'tmp': self.path(".moved.mvtmp"), 'phase': 'copy'}, f)
+
+        result = self.shell.mv(self.archive_dir, "moved")
+        self.assertEqual("Перемещение успешно", result)
+        self.assertFalse(os.path.exists(self.path(".moved.mvtmp")))
+        self.assertFalse(os.path.exists(self.path(".moved.mvjournal")))
+        self.assertTrue(os.path.exists(self.path("moved/file.txt")))
+
+        # Журнал из реестра доводится при запуске, без повторного mv
+        os.makedirs(self.path(".again.mvtmp"))
+        self.shell._register_journal(self.path(".again.mvjournal"))
+        with open(self.path(".again.mvjournal"), 'w', encoding='utf-8') as f:
+            json.dump({'src': self.path("moved"), 'dst': self.path("again"),
+                       'tmp': self.path(".again.mvtmp"), 'phase': 'copy'}, f)
+        self.assertEqual(1, self.shell.recover_moves())
+        self.assertFalse(os.path.exists(self.path(".again.mvtmp")))
+        self.assertEqual([], os.listdir(self.shell.move_journals_dir))
+
+        # Копия с другим содержимым не приводит к удалению источника
+        from unittest import mock
+        self.shell._is_cross_device = lambda src, dst: True
+        with mock.patch('main.hash_file', side_effect=lambda path: path):
+            self.assertIn("Контрольная сумма", self.shell.mv("moved", "again"))
+        self.assertTrue(os.path.exists(self.path("moved/file.txt")))
+        self.assertFalse(os.path.exists(self.path("again")))
+
+
+    def test_46_grep_output_modes(self):
+        """Тест режимов grep -c, -l, -q и -m"""
+        os.makedirs(self.path("logs"))
+        with open(self.path("logs/a.log"), 'w') as f:
+            f.write("error 1\nok\nerror 2\nerror 3\n")
+        with open(self.path("logs/b.log"), 'w') as f:
+            f.write("ok\n")
+
+        self.assertIn("a.log:3", self.shell.execute("grep -rc error logs"))
+        self.assertIn("b.log:0", self.shell.execute("grep -rc error logs"))
+        self.assertEqual("a.log", self.shell.execute("grep -r -l error logs"))
+        self.assertEqual("", self.shell.execute("grep -q error logs/a.log"))
+        self.assertEqual(0, self.shell.last_status)
+        self.shell.execute("grep -q missing logs/a.log")
+        self.assertEqual(1, self.shell.last_status)
+        result = self.shell.execute("grep -m 2 error logs/a.log")
+        self.assertEqual(2, len(result.splitlines()))
+
+    def test_47_grep_pattern_cache(self):
+        """Тест повторного использования скомпилированного шаблона"""
+        self.shell.grep("Content", os.path.join(self.archive_dir, "file.txt"))
+        self.shell.execute(f"grep Content {self.archive_dir}/file.txt")
+        self.assertEqual(1, self.shell.metrics['cache_hits'])
+        self.assertIn("Ошибка", self.shell.grep("(", self.archive_dir))
+
+
+    def test_48_grep_context(self):
+        """Тест вывода строк контекста вокруг совпадений"""
+        with open(self.path("ctx.log"), 'w') as f:
+            f.write("\n".join(f"line {n}" for n in range(1, 11)) + "\n")
+
+        result = self.shell.execute("grep -C 1 line.5 ctx.log")
+        self.assertEqual(["ctx.log-4- line 4", "ctx.log:5: line 5", "ctx.log-6- line 6"],
+                         result.splitlines())
+        lines = self.shell.grep("line [29]", "ctx.log", before=1, after=1).splitlines()
+        self.assertEqual(["ctx.log-1- line 1", "ctx.log:2: line 2", "ctx.log-3- line 3", "--",
+                          "ctx.log-8- line 8", "ctx.log:9: line 9", "ctx.log-10- line 10"], lines)
+
+    def test_49_grep_multiline(self):
+        """Тест многострочного поиска с переходом через границу блока"""
+        from unittest import mock
+        with open(self.path("multi.log"), 'w') as f:
+            f.write("start\nBEGIN\nbody\nEND\n" + "filler\n" * 50 + "BEGIN\nEND\n")
+
+        with mock.patch('main.MULTILINE_CHUNK_SIZE', 16), mock.patch('main.MULTILINE_OVERLAP', 12):
+            result = self.shell.grep(r"BEGIN\n(body\n)?END", "multi.log", multiline=True)
+        self.assertEqual(["multi.log:2: BEGIN\\nbody\\nEND", "multi.log:55: BEGIN\\nEND"],
+                         result.splitlines())
+
+
+    def test_50_grep_encodings(self):
+        """Тест поиска в файлах cp1251, UTF-16 и пропуска двоичных файлов"""
+        os.makedirs(self.path("enc"))
+        with open(self.path("enc/cp1251.txt"), 'wb') as f:
+            f.write("первая строка\nОшибка доступа\n".encode('cp1251'))
+        with open(self.path("enc/utf16.txt"), 'wb') as f:
+            f.write("строка\nОшибка в UTF-16\n".encode('utf-16'))
+        with open(self.path("enc/data.bin"), 'wb') as f:
+            f.write(b"\x00\x01\x02\xff" + "Ошибка".encode())
+
+        result = self.shell.grep("Ошибка", "enc", recursive=True)
+        self.assertIn("cp1251.txt:2: Ошибка доступа", result)
+        self.assertIn("utf16.txt:2: Ошибка в UTF-16", result)
+        self.assertNotIn("data.bin", result)
+        self.assertIn("cp1251.txt:1", self.shell.grep("access|строка", "enc", recursive=True, count=True))
+
+    def test_51_cat_encodings(self):
+        """Тест вывода файла не в UTF-8 и отказа для двоичного файла"""
+        with open(self.path("win.txt"), 'wb') as f:
+            f.write("Привет".encode('cp1251'))
+        with open(self.path("blob.bin"), 'wb') as f:
+            f.write(b"\x7fELF\x00\x00")
+
+        self.assertEqual("Привет", self.shell.cat("win.txt"))
+        self.assertIn("Ошибка", self.shell.cat("blob.bin"))
+
+
+    def test_52_completion(self):
+        """Тест автодополнения команд и путей из кэша каталогов"""
+        from completion import Completer, DirectoryCache
+        completer = Completer(self.shell, DirectoryCache(refresh=0))
+
+        self.assertEqual(["undo ", "unzip ", "untar "], completer.candidates("un", "un"))
+        self.assertEqual([self.archive_dir + "/"], completer.candidates("cd arch", "arch"))
+        self.assertEqual([os.path.join(self.archive_dir, "file.txt")],
+                         completer.candidates(f"cat {self.archive_dir}/f", f"{self.archive_dir}/f"))
+
+        # Повторный запрос берется из кэша, новый файл виден после изменения каталога
+        completer.candidates("cat a", "a")
+        self.assertGreater(completer.cache.hits, 0)
+        with open(self.path("archive_new.txt"), 'w') as f:
+            f.write("x")
+        os.utime(self.test_dir, ns=(0, 10 ** 18))
+        self.assertIn("archive_new.txt", completer.candidates("cat a", "a"))
+
+    def test_53_memory_fs(self):
+        """Тест команд поверх файловой системы в памяти"""
+        shell = self.new_shell(fs=MemoryFS())
+        shell.fs.makedirs("/data/sub")
+        with shell.fs.open("/data/sub/a.txt", 'w', encoding='utf-8') as f:
+            f.write("alpha\nbeta\n")
+
+        self.assertIn("Перешел в", shell.cd("/data"))
+        self.assertEqual("sub", shell.ls())
+        self.assertEqual("alpha\nbeta\n", shell.cat("sub/a.txt"))
+        self.assertIn("a.txt:2: beta", shell.grep("beta", "sub", recursive=True))
+        self.assertIn("Копирование успешно", shell.cp("sub", "copy", recursive=True))
+        self.assertIn("Перемещение успешно", shell.mv("copy/a.txt", "b.txt"))
+        self.assertEqual(["b.txt", "copy", "sub"], shell.fs.listdir("/data"))
+        self.assertFalse(os.path.exists(self.path("copy")))
+
+        # Удаление и восстановление через корзину в корне виртуальной системы
+        self.assertIn("Удаление успешно", shell.rm("sub", recursive=True, force=True))
+        self.assertNotIn("sub", shell.fs.listdir("/data"))
+        self.assertIn("Восстановлено", shell.undo())
+        self.assertEqual("alpha\nbeta\n", shell.cat("sub/a.txt"))
+        shell.close()
+
+    def test_54_archive_fs(self):
+        """Тест перехода в архив и чтения без распаковки"""
+        os.makedirs(self.path(self.archive_dir, "inner"))
+        with open(self.path(self.archive_dir, "inner", "deep.txt"), 'w') as f:
+            f.write("deep line\n")
+        self.shell.zip(self.archive_dir, "test.zip")
+        self.shell.tar(self.archive_dir, "test.tar.gz")
+
+        for archive in ("test.zip", "test.tar.gz"):
+            self.assertIn("Перешел в", self.shell.cd(archive))
+            self.assertIn("file.txt", self.shell.ls())
+            self.assertIn("inner", self.shell.ls())
+            self.assertEqual("Content for archive", self.shell.cat("file.txt"))
+            self.assertIn("deep.txt:1: deep line", self.shell.grep("deep", ".", recursive=True))
+            self.assertIn("Read-only", self.shell.rm("file.txt"))
+            self.shell.cd(self.test_dir)
+
+        # Копирование из архива на диск
+        self.assertIn("Копирование успешно", self.shell.cp("test.zip/inner/deep.txt", "out.txt"))
+        with open(self.path("out.txt")) as f:
+            self.assertEqual("deep line\n", f.read())
+
+    def test_55_sessions(self):
+        """Тест независимых сессий в одном процессе без смены каталога процесса"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.shell.zip(self.archive_dir, "test.zip")
+        archive = self.path("test.zip")
+
+        def session(i):
+            root = self.path(f"session{i}")
+            os.makedirs(os.path.join(root, "work", "data"))
+            shell = MiniShell(state_dir=root, cwd=os.path.join(root, "work"),
+                              confirm=lambda prompt: 'y')
+            try:
+                results = [shell.execute(f"unzip {archive}"),
+                           shell.execute("cat file.txt"),
+                           shell.execute("rm -r data"),
+                           shell.execute("history")]
+            finally:
+                shell.close()
+            return root, results
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            sessions = list(pool.map(session, range(16)))
+
+        for root, (unzipped, content, removed, history) in sessions:
+            self.assertIn("распакован", unzipped)
+            self.assertEqual("Content for archive", content)
+            self.assertIn("Удаление успешно", removed)
+            self.assertEqual("1: rm data", history)
+            self.assertTrue(os.path.isfile(os.path.join(root, "shell.log")))
+            self.assertEqual(1, len(os.listdir(os.path.join(root, ".trash"))))
+        self.assertFalse(os.path.exists(os.path.join(os.getcwd(), "file.txt")))
+
+    def test_56_server(self):
+        """Тест сервера на Unix-сокете и тонкого клиента"""
+        from server import ShellServer
+        import client
+
+        path = self.path("shell.sock")
+        server = ShellServer(path, self.shell)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        try:
+            # В одном соединении каталог сессии сохраняется между командами
+            responses = list(client.run(["cd " + self.archive_dir, "cat file.txt",
+                                         "cat missing.txt", "rm -r ."], cwd=self.test_dir, path=path))
+            self.assertEqual("Content for archive", responses[1]['output'])
+            self.assertEqual(0, responses[1]['status'])
+            self.assertEqual(1, responses[2]['status'])
+            self.assertEqual(self.path(self.archive_dir), responses[1]['cwd'])
+
+            # Новое соединение начинает в каталоге клиента; подтверждения отклоняются
+            responses = list(client.run(["rm -r " + self.archive_dir, "ls"],
+                                        cwd=self.test_dir, path=path))
+            self.assertEqual("Отменено", responses[0]['output'])
+            self.assertIn(self.archive_dir, responses[1]['output'])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_57_hash_verify(self):
+        """Тест контрольных сумм, манифеста и проверки"""
+        import hashlib
+        expected = hashlib.sha256(b"Content for archive").hexdigest()
+        self.assertEqual(f"{expected}  {self.archive_dir}/file.txt", self.shell.hash(self.archive_dir))
+        self.assertIn(hashlib.md5(b"Content for archive").hexdigest(),
+                      self.shell.execute(f"hash -a md5 {self.archive_dir}/file.txt"))
+
+        result = self.shell.execute(f"hash -o {self.archive_dir}/SHA256SUMS {self.archive_dir}")
+        self.assertIn("файлов: 1", result)
+        result = self.shell.verify(f"{self.archive_dir}/SHA256SUMS")
+        self.assertIn("file.txt: OK", result)
+        self.assertEqual(0, self.shell.last_status)
+
+        with open(self.path(self.archive_dir, "file.txt"), 'a') as f:
+            f.write("!")
+        with open(self.path(self.archive_dir, "SHA256SUMS"), 'a') as f:
+            f.write(f"{expected} *gone.txt\n")
+        result = self.shell.verify(f"{self.archive_dir}/SHA256SUMS")
+        self.assertIn("file.txt: ОШИБКА", result)
+        self.assertIn("gone.txt: НЕТ ФАЙЛА", result)
+        self.assertEqual(1, self.shell.last_status)
+
+    def test_58_cp_untar_verify(self):
+        """Тест проверки копирования и распаковки по хэшам"""
+        result = self.shell.execute(f"cp -r --verify {self.archive_dir} copy")
+        self.assertIn("проверено файлов: 1", result)
+
+        self.shell.tar(self.archive_dir, "test.tar.gz")
+        os.makedirs(self.path("out"))
+        self.shell.cd("out")
+        result = self.shell.execute("untar --verify ../test.tar.gz")
+        self.assertIn("проверено файлов: 1", result)
+
+    def test_59_shared_fixture(self):
+        """Тест однократной сборки заготовки и изоляции копий"""
+        self.assertIs(shared_fixture(build_archive_tree), shared_fixture(build_archive_tree))
+        with open(self.path(self.archive_dir, "file.txt"), 'w') as f:
+            f.write("changed")
+        template = shared_fixture(build_archive_tree)
+        with open(os.path.join(template, self.archive_dir, "file.txt")) as f:
+            self.assertEqual("Content for archive", f.read())
+
+    def test_60_diff_trees(self):
+        """Тест сравнения деревьев: размер и mtime, затем хэш только для оставшихся"""
+        self.shell.cp(self.archive_dir, "release", recursive=True)
+        os.makedirs(self.path("release", "new_dir", "inner"))
+        with open(self.path("release", "new_dir", "inner", "x.txt"), 'w') as f:
+            f.write("x")
+        os.makedirs(self.path(self.archive_dir, "old_dir"))
+        for name, old, new in (("resized.txt", "aaaa", "bbbbbb"), ("touched.txt", "same", "same"),
+                               ("edited.txt", "left", "rite")):
+            with open(self.path(self.archive_dir, name), 'w') as f:
+                f.write(old)
+            with open(self.path("release", name), 'w') as f:
+                f.write(new)
+        os.utime(self.path(self.archive_dir, "touched.txt"), (1, 1))
+        os.utime(self.path(self.archive_dir, "edited.txt"), (1, 1))
+
+        result = self.shell.execute(f"diff -r {self.archive_dir} release").splitlines()
+        self.assertEqual(["M edited.txt", "+ new_dir/", "- old_dir/", "M resized.txt"], result[:-1])
+        self.assertEqual("Добавлено: 1, удалено: 1, изменено: 2 (сравнено по хэшу: 2)", result[-1])
+        self.assertEqual(1, self.shell.last_status)
+
+        self.assertEqual("Различий нет", self.shell.diff(f"{self.archive_dir}/touched.txt",
+                                                         "release/touched.txt"))
+        self.assertEqual(0, self.shell.last_status)
+        self.assertIn("Ошибка", self.shell.diff(self.archive_dir, "release"))
+
+    def test_61_tail(self):
+        """Тест tail -n: чтение блоками с конца файла"""
+        import main
+        lines = [f"строка {i}" for i in range(5000)]
+        with open(self.path("big.txt"), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        with open(self.path("utf16.txt"), 'w', encoding='utf-16') as f:
+            f.write("один\nдва\nтри")
+
+        self.assertEqual('\n'.join(lines[-3:]), self.shell.execute("tail -n 3 big.txt"))
+        self.assertEqual('\n'.join(lines[-10:]), self.shell.execute("tail big.txt"))
+        self.assertLess(self.shell.metrics['bytes_read'], main.TAIL_BLOCK_SIZE + 1)
+        self.assertEqual(lines, self.shell.tail("big.txt", 10000).splitlines())
+        self.assertEqual("", self.shell.tail("big.txt", 0))
+        self.assertEqual("два\nтри", self.shell.tail("utf16.txt", 2))
+        self.assertIn("Ошибка", self.shell.tail(self.archive_dir))
+
+    def test_62_tail_follow_and_watch(self):
+        """Тест tail -f и watch по событиям каталога, в том числе без inotify"""
+        import main
+        import watcher
+
+        def wait_for(stream, text):
+            deadline = time.monotonic() + 5
+            while text not in stream.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return stream.getvalue()
+
+        for polling in (False, True):
+            shell = self.new_shell()
+            shell.output_stream = io.StringIO()
+            log = self.path(f"app{int(polling)}.log")
+            with open(log, 'w') as f:
+                f.write("старт\n")
+            if polling:
+                watcher._libc, saved = None, watcher._libc
+            # Короткое ожидание событий, чтобы отмена и опрос не замедляли тест
+            main.WATCH_TIMEOUT, timeout = 0.05, main.WATCH_TIMEOUT
+            try:
+                job = shell.jobs.submit(f"tail -f {log}", background=True)
+                self.assertIn("старт", wait_for(shell.output_stream, "старт"))
+                with open(log, 'a') as f:
+                    f.write("новая строка\n")
+                self.assertIn("новая строка", wait_for(shell.output_stream, "новая строка"))
+                # Ротация: файл заменен более коротким
+                with open(log + ".new", 'w') as f:
+                    f.write("ротация\n")
+                os.replace(log + ".new", log)
+                self.assertIn("ротация", wait_for(shell.output_stream, "ротация"))
+                job.cancel()
+                self.assertEqual("Команда отменена", job.result(timeout=5))
+
+                shell.output_stream = io.StringIO()
+                job = shell.jobs.submit(f"watch {self.archive_dir}", background=True)
+                time.sleep(0.1)
+                with open(self.path(self.archive_dir, "fresh.txt"), 'w') as f:
+                    f.write("x")
+                self.assertIn("создан fresh.txt", wait_for(shell.output_stream, "создан fresh.txt"))
+                os.remove(self.path(self.archive_dir, "fresh.txt"))
+                self.assertIn("удален fresh.txt", wait_for(shell.output_stream, "удален fresh.txt"))
+                job.cancel()
+                self.assertEqual("Команда отменена", job.result(timeout=5))
+            finally:
+                main.WATCH_TIMEOUT = timeout
+                if polling:
+                    watcher._libc = saved
+                shell.close()
+
+    def test_63_stats(self):
+        """Тест stats: сводка по логу дочитывается с сохраненного смещения"""
+        import json
+        for command in ("ls", "ls", "cat missing.txt", "cat missing.txt", f"cat {self.archive_dir}/file.txt"):
+            self.shell.execute(command)
+        result = self.shell.execute("stats")
+        self.assertIn("Частые команды:\n  cat  3\n  ls   2", result)
+        self.assertIn(f"cat {self.archive_dir}/file.txt", result)
+        self.assertEqual("Ошибки по командам:\n  cat  2/3 (67%)", self.shell.execute("stats errors"))
+
+        with open(self.shell.stats_index_file, encoding='utf-8') as f:
+            offset = json.load(f)['offset']
+        self.shell.execute("ls")
+        self.assertIn("ls     3", self.shell.execute("stats top"))
+        with open(self.shell.stats_index_file, encoding='utf-8') as f:
+            self.assertGreater(json.load(f)['offset'], offset)
+
+        # Лог заменен (ротация): сводка строится заново
+        self.shell.close()
+        os.remove(self.shell.log_file)
+        shell = self.new_shell(log_format='json')
+        shell.execute("cat missing.txt")
+        self.assertEqual("Частые команды:\n  cat  1", shell.execute("stats top 1"))
+        self.assertIn("cat  1/1", shell.execute("stats errors"))
+        shell.close()
+
+    def test_64_io_limits(self):
+        """Тест --bwlimit, --iops и --nice: общий планировщик ввода-вывода команды"""
+        import json
+        import tarfile
+        with open(self.path(self.archive_dir, "big.bin"), 'wb') as f:
+            f.write(b"x" * 300 * 1024)
+
+        start = time.monotonic()
+        result = self.shell.execute(f"time cp -r --bwlimit 200K --nice 5 {self.archive_dir} copy")
+        # Запас корзины - одна секунда (200K), остальные 100K ждут около 0.5 с
+        self.assertGreater(time.monotonic() - start, 0.4)
+        self.assertTrue(result.startswith("Копирование успешно"))
+        self.assertIn("files 2", result)
+        self.shell.log_writer.flush()
+        with open(self.shell.log_file, encoding='utf-8') as f:
+            metrics = [json.loads(line) for line in f if line.startswith('{')]
+        self.assertGreater(metrics[-1]['io_wait'], 0.3)
+
+        self.assertEqual("Архив TAR.GZ создан", self.shell.execute(f"tar --iops 1000 {self.archive_dir} a.tar.gz"))
+        with tarfile.open(self.path("a.tar.gz")) as tf:
+            self.assertEqual(['.', './big.bin', './file.txt'], tf.getnames())
+        self.assertIn("Content for archive", self.shell.execute(f"grep -r --iops 1000 Content {self.archive_dir}"))
+
+        self.assertIn("Ошибка", self.shell.execute("cp --nice 20 a b"))
+        self.assertIn("Ошибка", self.shell.execute("cp --bwlimit 10X a b"))
+        self.assertIn("Ошибка", self.shell.execute("cp a b --iops"))
+
+    def test_65_sparse_files(self):
+        """Тест cp и tar с разреженными файлами: дыры не записываются на диск"""
+        import tarfile
+        image = self.path(self.archive_dir, "disk.img")
+        with open(image, 'wb') as f:
+            f.truncate(64 * 1024 * 1024)
+            f.seek(16 * 1024 * 1024)
+            f.write(b"data" * 1024)
+        if os.stat(image).st_blocks * 512 >= 1024 * 1024:
+            self.skipTest("Файловая система не поддерживает разреженные файлы")
+        with open(image, 'rb') as f:
+            original = f.read()
+
+        def check(path):
+            self.assertLess(os.stat(path).st_blocks * 512, 1024 * 1024)
+            with open(path, 'rb') as f:
+                self.assertEqual(original, f.read())
+
+        self.assertEqual("Копирование успешно", self.shell.execute(f"cp -r {self.archive_dir} copy"))
+        check(self.path("copy", "disk.img"))
+
+        self.assertEqual("Архив TAR.GZ создан", self.shell.execute(f"tar {self.archive_dir} a.tar.gz"))
+        with tarfile.open(self.path("a.tar.gz")) as tf:
+            member = tf.getmember("./disk.img")
+            self.assertEqual(64 * 1024 * 1024, member.size)
+            self.assertEqual([16 * 1024 * 1024, 64 * 1024 * 1024], [offset for offset, _ in member.sparse])
+        os.makedirs(self.path("out"))
+        self.shell.cd("out")
+        self.assertIn("распакован", self.shell.execute("untar ../a.tar.gz"))
+        check(self.path("out", "disk.img"))
+
+        # Прогресс и метрики mv между устройствами считают записанные байты, а не дыры
+        self.shell._is_cross_device = lambda src, dst: True
+        result = self.shell.execute(f"mv {self.path('copy', 'disk.img')} {self.path('moved.img')}")
+        self.assertIn("(4096 байт,", result)
+        self.assertEqual(4096, self.shell.metrics['bytes_written'])
+        check(self.path("moved.img"))
+        # Итог прогресса тоже без дыр, иначе он не дойдет до 100%
+        progress = self.shell._parallel_copy(self.path("moved.img"), self.path("again.img"))
+        self.assertEqual(progress.total, progress.done)
+
+    def test_66_snapshot_restore_undo(self):
+        """Тест снимков: общие файлы между снимками, restore и его отмена"""
+        data = self.path(self.archive_dir, "file.txt")
+        os.makedirs(self.path(self.archive_dir, "sub"))
+        with open(self.path(self.archive_dir, "sub", "keep.txt"), 'w') as f:
+            f.write("keep")
+
+        self.assertIn("скопировано файлов: 2", self.shell.execute(f"snapshot {self.archive_dir}"))
+        with open(data, 'w') as f:
+            f.write("version 2")
+        self.assertIn("скопировано файлов: 1, общих с прошлым снимком: 1",
+                      self.shell.execute(f"snapshot {self.archive_dir}"))
+        root = self.path(f".{self.archive_dir}.snapshots")
+        first, second = sorted(os.listdir(root))
+        self.assertEqual(os.stat(os.path.join(root, first, "sub", "keep.txt")).st_ino,
+                         os.stat(os.path.join(root, second, "sub", "keep.txt")).st_ino)
+
+        # Ломаем каталог и возвращаем его к первому снимку
+        self.shell.execute(f"rm -r -f {self.archive_dir}/sub")
+        with open(data, 'w') as f:
+            f.write("broken")
+        self.assertEqual(f"Восстановлено из снимка: {first}",
+                         self.shell.execute(f"restore .{self.archive_dir}.snapshots/{first}"))
+        with open(data) as f:
+            self.assertEqual("Content for archive", f.read())
+        self.assertTrue(os.path.exists(self.path(self.archive_dir, "sub", "keep.txt")))
+        # Файлы каталога не связаны со снимком: запись в них снимок не меняет
+        with open(data, 'w') as f:
+            f.write("edited")
+        with open(os.path.join(root, first, "file.txt")) as f:
+            self.assertEqual("Content for archive", f.read())
+
+        self.assertEqual(f"Восстановлено: {self.archive_dir}", self.shell.execute("undo"))
+        with open(data) as f:
+            self.assertEqual("broken", f.read())
+        self.shell.execute(f"restore {self.archive_dir}")
+        with open(data) as f:
+            self.assertEqual("version 2", f.read())
+        self.assertIn("Ошибка", self.shell.execute("restore missing"))
+
+    def test_67_compact_listing(self):
+        """Тест колоночного листинга: сортировки ls, общие имена и пути"""
+        from listing import Listing
+        base = self.path(self.archive_dir)
+        with open(os.path.join(base, "big.bin"), 'wb') as f:
+            f.write(b"x" * 5000)
+        os.utime(os.path.join(base, "file.txt"), (1, 1))
+        for sub in ("a", "b"):
+            os.makedirs(os.path.join(base, sub))
+            with open(os.path.join(base, sub, "same.txt"), 'w') as f:
+                f.write(sub)
+
+        def names(output):
+            return [line.split()[-1] for line in output.splitlines()]
+
+        self.assertEqual(["a", "b", "big.bin", "file.txt"], names(self.shell.execute(f"ls -l {self.archive_dir}")))
+        self.assertEqual("big.bin", names(self.shell.execute(f"ls -lS {self.archive_dir}"))[0])
+        self.assertEqual("file.txt", self.shell.execute(f"ls -t -r {self.archive_dir}").splitlines()[0])
+        self.assertIn("Использование", self.shell.execute(f"ls -x {self.archive_dir}"))
+
+        listing = Listing.build(LocalFS(), base, recursive=True)
+        self.assertEqual(7, len(listing))
+        paths = sorted(listing.path(i) for i in range(1, len(listing)))
+        self.assertEqual(["a", os.path.join("a", "same.txt"), "b", os.path.join("b", "same.txt"),
+                          "big.bin", "file.txt"], paths)
+        same = [listing.names[i] for i in range(len(listing)) if listing.names[i] == "same.txt"]
+        self.assertIs(same[0], same[1])
+
+        # Ссылка на каталог - не каталог листинга, и в нее обход не заходит
+        import stat
+        os.symlink("a", os.path.join(base, "link"))
+        listing = Listing.build(LocalFS(), base, recursive=True)
+        link = listing.names.index("link")
+        self.assertEqual(0, listing.dirs[link])
+        self.assertTrue(stat.S_ISLNK(listing.modes[link]))
+        self.assertEqual(0, listing.count[link])
+
+    def test_68_unzip_limits(self):
+        """Тест распаковки ZIP: ограничения против zip-бомб и проверка CRC"""
+        import zipfile
+        from unittest import mock
+        with zipfile.ZipFile(self.path("ok.zip"), 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("dir/a.txt", "hello")
+            zf.writestr("../evil.txt", "x")
+        with zipfile.ZipFile(self.path("bomb.zip"), 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("zeros", b"\0" * (4 * 1024 * 1024))
+        with zipfile.ZipFile(self.path("bad.zip"), 'w') as zf:
+            zf.writestr("b.txt", b"payload-data")
+        with open(self.path("bad.zip"), 'rb') as f:
+            data = f.read().replace(b"payload-data", b"payload-DATA")
+        with open(self.path("bad.zip"), 'wb') as f:
+            f.write(data)
+
+        os.makedirs(self.path("out"))
+        self.shell.cd("out")
+        self.assertIn("Архив ZIP распакован (элементов: 2, 6 байт", self.shell.execute("unzip ../ok.zip"))
+        with open(self.path("out", "dir", "a.txt")) as f:
+            self.assertEqual("hello", f.read())
+        self.assertTrue(os.path.exists(self.path("out", "evil.txt")))
+        self.assertFalse(os.path.exists(self.path("evil.txt")))
+
+        self.assertIn("степень сжатия", self.shell.execute("unzip ../bomb.zip"))
+        self.assertFalse(os.path.exists(self.path("out", "zeros")))
+        with mock.patch('main.UNZIP_MAX_MEMBERS', 1):
+            self.assertIn("Слишком много элементов", self.shell.execute("unzip ../ok.zip"))
+        with mock.patch('main.UNZIP_MAX_SIZE', 5):
+            self.assertIn("Слишком большой объем", self.shell.execute("unzip ../ok.zip"))
+        self.assertIn("CRC", self.shell.execute("unzip ../bad.zip"))
+        self.assertFalse(os.path.exists(self.path("out", "b.txt")))
+
+    def test_69_archive_extension_in_parent_dir(self):
+        """Тест: расширение архива не вырезается из имен родительских каталогов"""
+        session_dir = self.path("xxx.zipped", "work.tar.gz.d")
+        os.makedirs(session_dir)
+        shutil.copytree(self.path(self.archive_dir), os.path.join(session_dir, self.archive_dir))
+        self.shell.cd(session_dir)
+        self.assertEqual("Архив ZIP создан", self.shell.execute(f"zip {self.archive_dir} out"))
+        self.assertEqual("Архив ZIP создан", self.shell.execute(f"zip {self.archive_dir} out2.zip"))
+        self.assertEqual("Архив TAR.GZ создан", self.shell.execute(f"tar {self.archive_dir} out.tar.gz"))
+        self.assertEqual(sorted([self.archive_dir, "out.zip", "out2.zip", "out.tar.gz"]),
+                         sorted(os.listdir(session_dir)))
+
+    def test_70_history_per_session(self):
+        """Тест: сессии с общим state_dir не видят и не отменяют команды друг друга"""
+        with open(self.path("a.txt"), 'w') as f:
+            f.write("a")
+        other = self.new_shell()
+        try:
+            self.shell.execute("cp a.txt b.txt")
+            self.assertEqual("История пуста", other.execute("history"))
+            self.assertEqual("История пуста", other.execute("undo"))
+            self.assertTrue(os.path.exists(self.path("b.txt")))
+        finally:
+            other.close()
+        self.assertFalse(os.path.exists(self.path(".history")))
+
+        # Сохраняемая история переживает перезапуск, временных файлов не остается
+        first = self.new_shell(history_file=".history")
+        first.execute("cp a.txt c.txt")
+        first.close()
+        second = self.new_shell(history_file=".history")
+        try:
+            self.assertEqual("1: cp a.txt c.txt", second.execute("history"))
+        finally:
+            second.close()
+        self.assertEqual([], [name for name in os.listdir(self.test_dir) if name.endswith(".tmp")])
+
+    def test_71_server_sessions_isolated(self):
+        """Тест: у соединений сервера своя история, общие файлы состояния не портятся"""
+        from concurrent.futures import ThreadPoolExecutor
+        from server import ShellServer
+        import client
+
+        path = self.path("shell.sock")
+        server = ShellServer(path, self.shell)
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        try:
+            with open(self.path("a.txt"), 'w') as f:
+                f.write("a")
+            list(client.run(["cp a.txt b.txt"], cwd=self.test_dir, path=path))
+            responses = list(client.run(["history", "undo"], cwd=self.test_dir, path=path))
+            self.assertEqual(["История пуста", "История пуста"], [r['output'] for r in responses])
+            self.assertTrue(os.path.exists(self.path("b.txt")))
+
+            # Бесконечные команды клиент прервать не может, поэтому они отклоняются сразу
+            responses = list(client.run(["tail -f a.txt", "watch ."], cwd=self.test_dir, path=path))
+            self.assertEqual([1, 1], [r['status'] for r in responses])
+            self.assertIn("недоступен", responses[0]['output'])
+
+            def session(i):
+                commands = [f"cp a.txt c{i}_{j}.txt" for j in range(5)] + ["history", "stats"]
+                return list(client.run(commands, cwd=self.test_dir, path=path))
+
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(session, range(4)))
+            for i, responses in enumerate(results):
+                history = responses[5]['output'].splitlines()
+                self.assertEqual([f"{j + 1}: cp a.txt c{i}_{j}.txt" for j in range(5)], history)
+                self.assertNotIn("Ошибка", responses[6]['output'])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([], [name for name in os.listdir(self.test_dir) if name.endswith(".tmp")])
+
+    def test_72_grep_crlf(self):
+        """Тест: строки с окончаниями Windows в байтовом поиске ведут себя как в текстовом"""
+        from unittest import mock
+        with open(self.path("crlf.txt"), 'wb') as f:
+            f.write(b"foo\r\nbar\r\n")
+        with open(self.path("crlf1251.txt"), 'wb') as f:
+            f.write("строка\r\nОшибка\r\n".encode('cp1251'))
+
+        self.assertEqual("crlf.txt:1: foo", self.shell.grep("foo$", "crlf.txt"))
+        self.assertEqual("crlf.txt:2: bar", self.shell.grep("^bar$", "crlf.txt"))
+        self.assertEqual("crlf1251.txt:2: Ошибка", self.shell.grep("Ошибка$", "crlf1251.txt"))
+        # \r\n на границе блока многострочного поиска
+        with mock.patch('main.MULTILINE_CHUNK_SIZE', 4), mock.patch('main.MULTILINE_OVERLAP', 8):
+            self.assertEqual("crlf.txt:1: foo\\nbar", self.shell.grep(r"foo\nbar$", "crlf.txt", multiline=True))
+
+    def test_73_diff_directory_symlinks(self):
+        """Тест: ссылки на каталоги сравниваются по readlink, а не хэшируются как файлы"""
+        for side, stamp in (("a", 1), ("b", 2)):
+            os.makedirs(self.path(side, "real"))
+            os.makedirs(self.path(side, "other"))
+            os.symlink("real", self.path(side, "link"))
+            os.symlink("real", self.path(side, "moved"))
+            os.utime(self.path(side, "real"), (stamp, stamp))
+        self.assertEqual("Различий нет", self.shell.execute("diff -r a b"))
+
+        os.remove(self.path("b", "moved"))
+        os.symlink("othr", self.path("b", "moved"))
+        result = self.shell.execute("diff -r a b").splitlines()
+        self.assertEqual(["M moved"], result[:-1])
+        # Ссылка не выдается за каталог и в grep -r
+        with open(self.path("a", "real", "f.txt"), 'w') as f:
+            f.write("needle")
+        self.assertEqual(["f.txt:1: needle"], self.shell.grep("needle", "a", recursive=True).splitlines())
+
+    def test_74_archive_special_files(self):
+        """Тест: tar и zip пропускают сокеты, а при ошибке не оставляют недописанный архив"""
+        import socket
+        import tarfile
+        import zipfile
+        from unittest import mock
+        sock = socket.socket(socket.AF_UNIX)
+        try:
+            sock.bind(self.path(self.archive_dir, "s.sock"))
+            self.assertEqual("Архив TAR.GZ создан", self.shell.execute(f"tar {self.archive_dir} out.tar.gz"))
+            self.assertEqual("Архив ZIP создан", self.shell.execute(f"zip {self.archive_dir} out.zip"))
+        finally:
+            sock.close()
+        with tarfile.open(self.path("out.tar.gz")) as tf:
+            self.assertEqual([".", "./file.txt"], tf.getnames())
+        with zipfile.ZipFile(self.path("out.zip")) as zf:
+            self.assertEqual(["file.txt"], zf.namelist())
+
+        with mock.patch('main.throttled', side_effect=OSError("read failed")):
+            self.assertIn("read failed", self.shell.execute(f"tar {self.archive_dir} broken.tar.gz"))
+            self.assertIn("read failed", self.shell.execute(f"zip {self.archive_dir} broken.zip"))
+        self.assertFalse(os.path.exists(self.path("broken.tar.gz")))
+        self.assertFalse(os.path.exists(self.path("broken.zip")))
+
+    def test_75_io_options_only_before_arguments(self):
+        """Тест: --nice и --iops после аргументов или после -- не забираются планировщиком"""
+        with open(self.path("opts.txt"), 'w') as f:
+            f.write("run --nice 5\nplain\n")
+        self.assertEqual("opts.txt:1: run --nice 5", self.shell.execute("grep -- --nice opts.txt"))
+        # До первого аргумента опция по-прежнему задает приоритет
+        self.assertEqual("opts.txt:1: run --nice 5", self.shell.execute("grep -i --nice 5 RUN opts.txt"))
+        self.assertEqual("Перемещение успешно", self.shell.execute("mv opts.txt --iops"))
+        self.assertTrue(os.path.exists(self.path("--iops")))
+
+    def test_76_server_socket_path(self):
+        """Тест: сервер не удаляет чужие файлы и сокет живого сервера, сокет доступен только владельцу"""
+        import socket
+        import stat
+        from server import ShellServer
+
+        path = self.path("busy.sock")
+        with open(path, 'w') as f:
+            f.write("data")
+        with self.assertRaises(FileExistsError):
+            ShellServer(path, self.shell)
+        with open(path) as f:
+            self.assertEqual("data", f.read())
+        os.remove(path)
+
+        # Сокет от завершившегося сервера: соединение отклоняется, его можно заменить
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(path)
+        stale.close()
+        server = ShellServer(path, self.shell)
+        try:
+            self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+            with self.assertRaises(OSError):
+                ShellServer(path, self.shell)
+            self.assertTrue(stat.S_ISSOCK(os.stat(path).st_mode))
+        finally:
+            server.server_close()
+
+    def test_77_grep_multiline_chunk_start(self):
+        """Тест: ^ в многострочном поиске не совпадает в середине строки на границе блока; -m 0"""
+        from unittest import mock
+        with open(self.path("u.txt"), 'w') as f:
+            f.write("xxxxxxxxxxxxfoo bar\nfoo end\n")
+        with mock.patch('main.MULTILINE_CHUNK_SIZE', 16), mock.patch('main.MULTILINE_OVERLAP', 4):
+            self.assertEqual(["u.txt:2: foo"], self.shell.grep("^foo", "u.txt", multiline=True).splitlines())
+            self.assertEqual("u.txt:1", self.shell.grep(r"\bbar", "u.txt", multiline=True, count=True))
+        self.assertEqual("u.txt:1", self.shell.grep("^foo", "u.txt", count=True))
+        self.assertEqual("Совпадений не найдено", self.shell.execute("grep -U -m 0 foo u.txt"))
+        self.assertEqual("Совпадений не найдено", self.shell.execute("grep -m 0 foo u.txt"))
+
+
+    def test_78_verify_in_archives(self):
+        """Тест: cp --verify, hash и verify внутри архива; untar --verify с повторяющимися именами"""
+        import hashlib
+        import tarfile
+        import zipfile
+        alpha = hashlib.sha256(b"alpha").hexdigest()
+        with zipfile.ZipFile(self.path("v.zip"), 'w') as zf:
+            zf.writestr("d/a.txt", "alpha")
+            zf.writestr("d/b.txt", "beta")
+            zf.writestr("SUMS", f"{alpha}  d/a.txt\n{alpha}  d/b.txt\n")
+        self.assertEqual("Копирование успешно (проверено файлов: 2)",
+                         self.shell.execute("cp -r --verify v.zip/d out"))
+        self.shell.execute("cd v.zip")
+        self.assertEqual(f"{alpha}  d/a.txt", self.shell.execute("hash d/a.txt"))
+        self.assertEqual(["d/a.txt: OK", "d/b.txt: ОШИБКА"], self.shell.execute("verify SUMS").splitlines()[:2])
+        self.shell.execute("cd ..")
+
+        with tarfile.open(self.path("dup.tar.gz"), 'w:gz') as tf:
+            for data in (b"old", b"new content"):
+                info = tarfile.TarInfo("same.txt")
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+        os.makedirs(self.path("unpacked"))
+        self.shell.execute("cd unpacked")
+        result = self.shell.execute("untar --verify ../dup.tar.gz")
+        self.assertIn("проверено файлов: 1", result)
+
+
+TEST_CASES = (TestMiniShellReadOnly, TestMiniShell, TestMiniShellPlugins)
+
+
+def _run_test(test_id):
+    """Выполняет один тест в процессе пула: (имя, итог, время, текст ошибки)"""
+    test = unittest.defaultTestLoader.loadTestsFromName(test_id, sys.modules[__name__])
+    result = unittest.TestResult()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        test.run(result)
+    elapsed = time.perf_counter() - start
+    for outcome, problems in (('failure', result.failures), ('error', result.errors)):
+        if problems:
+            return test_id, outcome, elapsed, problems[0][1]
+    return test_id, 'ok', elapsed, ''
+
+
+def run_tests(workers=None):
+    """Параллельный запуск тестов в пуле процессов с красивым выводом и временем тестов"""
+    loader = unittest.TestLoader()
+    test_ids = [f"{case.__name__}.{name}"
+                for case in TEST_CASES for name in loader.getTestCaseNames(case)]
+
+    # Заготовки всех процессов пула собираются в одном каталоге и удаляются вместе с ним
+    fixtures_root = tempfile.mkdtemp(prefix="minishell-tests-")
+    os.environ[FIXTURE_ROOT_ENV] = fixtures_root
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(_run_test, test_ids))
+    finally:
+        del os.environ[FIXTURE_ROOT_ENV]
+        shutil.rmtree(fixtures_root, ignore_errors=True)
+    total_time = time.perf_counter() - start
+
+    failures = [(test_id, trace) for test_id, outcome, _, trace in outcomes if outcome == 'failure']
+    errors = [(test_id, trace) for test_id, outcome, _, trace in outcomes if outcome == 'error']
 
     print("=" * 60)
     print("РЕЗУЛЬТАТЫ ТЕСТИРОВАНИЯ МИНИ-ОБОЛОЧКИ")
     print("=" * 60)
-    print(f"Всего тестов: {result.testsRun}")
+    print(f"Всего тестов: {len(outcomes)}")
 
-    passed = result.testsRun - len(result.failures) - len(result.errors)
+    passed = len(outcomes) - len(failures) - len(errors)
     print(f"Пройдено успешно: {passed}")
 
-    if result.failures:
-        print(f"Провалено: {len(result.failures)}")
-        for test, trace in result.failures:
+    if failures:
+        print(f"Провалено: {len(failures)}")
+        for test, trace in failures:
             print(f"\n {test}:")
-            first_line = str(trace).split('\n')[0]
-            print(f"   {first_line}")
+            last_line = str(trace).strip().split('\n')[-1]
+            print(f"   {last_line}")
 
-    if result.errors:
-        print(f"Ошибок: {len(result.errors)}")
-        for test, trace in result.errors:
+    if errors:
+        print(f"Ошибок: {len(errors)}")
+        for test, trace in errors:
             print(f"\n  {test}:")
-            first_line = str(trace).split('\n')[0]
-            print(f"   {first_line}")
+            last_line = str(trace).strip().split('\n')[-1]
+            print(f"   {last_line}")
 
-    if not result.failures and not result.errors:
+    if not failures and not errors:
         print("\n Все тесты пройдены успешно!")
 
+    print(f"\nВремя: {total_time:.2f} с, процессов: {workers or os.cpu_count()}")
+    print("Самые долгие тесты:")
+    for test_id, _, elapsed, _ in sorted(outcomes, key=lambda o: o[2], reverse=True)[:SLOWEST_TESTS]:
+        print(f"  {elapsed:.3f} с  {test_id}")
     print("=" * 60)
 
-    return result
+    return not failures and not errors
 
 
 if __name__ == '__main__':
-    run_tests()
+    sys.exit(0 if run_tests() else 1)